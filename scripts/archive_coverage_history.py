@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Coverage History Archival Script
+
+Moves coverage history superseded more than --months whole months ago out of
+the database into a compressed archive database (see ``fastform.archive``):
+
+    python scripts/archive_coverage_history.py --db fastform.db --months 12
+
+The API keeps answering historical queries from both; run this from cron
+after the regular formulary updates.
+"""
+
+import argparse
+import logging
+import sqlite3
+
+from fastform.archive import archive_coverage_history
+from fastform.db import WriterLock
+from fastform.schema import create_formulary_tables
+from fastform.settings import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default="fastform.db", help="Database to archive history from")
+    parser.add_argument("--archive", default=None, help="Archive database (default: <db>.archive)")
+    parser.add_argument(
+        "--months",
+        type=int,
+        default=settings.coverage_archive_months,
+        help="Whole months of history to keep in the database",
+    )
+    args = parser.parse_args()
+
+    # Wait for generation builds, which would otherwise publish the history back
+    with WriterLock(args.db):
+        conn = sqlite3.connect(args.db)
+        try:
+            create_formulary_tables(conn)
+            archive_path = args.archive or settings.archive_db_path or f"{args.db}.archive"
+            moved = archive_coverage_history(conn, archive_path, args.months)
+        finally:
+            conn.close()
+    logger.info(f"Moved {moved:,} coverage history rows to {archive_path}")
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Synthetic Formulary Dataset Generator
+
+Builds benchmark databases far larger than the hand-written sample data. Drugs
+get class-specific name stems, brand names, NDCs, strengths, tiers and
+restriction rates; insurer plans are the sample formularies plus generated
+ones with their own profiles. Coverage comes from the regular migration, so
+the result has exactly the shape of a migrated production database.
+
+Everything is drawn from one seeded NumPy generator, so a (scale, seed) pair
+always produces the same database:
+
+    python scripts/generate_synthetic_formulary.py --scale medium --db bench.db
+    python scripts/generate_synthetic_formulary.py --drugs 25000 --formularies 120 --seed 7
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+from ingest_formulary import DRUG_RULES_COLUMNS, create_database_schema
+from migrate_to_multi_formulary import (
+    INSURER_PROFILES,
+    create_multi_formulary_schema,
+    create_sample_formularies,
+    migrate_existing_drugs,
+)
+
+from fastform.equivalence import build_equivalence_groups
+from fastform.ingest.bulk import bulk_load
+from fastform.ingest.upsert import upsert_formulary
+from fastform.schema import INGEST_LOOKUP_INDEXES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEED = 20250101
+# (drugs, insurer formularies besides the Medicare baseline)
+SCALES = {
+    "small": (1_000, 5),
+    "medium": (10_000, 50),
+    "large": (100_000, 500),
+}
+
+# (class, name stem, dosage form, route, strengths, unit, relative frequency, specialty)
+DRUG_CLASSES = [
+    (
+        "HMG-CoA reductase inhibitor",
+        "statin",
+        "tablet",
+        "oral",
+        (5, 10, 20, 40, 80),
+        "mg",
+        8,
+        False,
+    ),
+    ("ACE inhibitor", "pril", "tablet", "oral", (2.5, 5, 10, 20, 40), "mg", 7, False),
+    (
+        "Angiotensin receptor blocker",
+        "sartan",
+        "tablet",
+        "oral",
+        (25, 50, 100, 160),
+        "mg",
+        6,
+        False,
+    ),
+    ("Beta blocker", "olol", "tablet", "oral", (12.5, 25, 50, 100), "mg", 6, False),
+    ("Proton pump inhibitor", "prazole", "capsule", "oral", (10, 20, 40), "mg", 5, False),
+    ("SSRI antidepressant", "oxetine", "tablet", "oral", (10, 20, 40), "mg", 5, False),
+    ("Penicillin antibiotic", "cillin", "capsule", "oral", (250, 500, 875), "mg", 4, False),
+    ("Fluoroquinolone antibiotic", "floxacin", "tablet", "oral", (250, 500, 750), "mg", 3, False),
+    ("Benzodiazepine", "azepam", "tablet", "oral", (0.5, 1, 2, 5, 10), "mg", 3, False),
+    ("Corticosteroid", "sone", "tablet", "oral", (1, 2.5, 5, 10, 20), "mg", 3, False),
+    ("Antihistamine", "tadine", "tablet", "oral", (5, 10, 60, 180), "mg", 2, False),
+    ("Antiviral", "vir", "tablet", "oral", (100, 200, 300, 400), "mg", 3, False),
+    ("DPP-4 inhibitor", "gliptin", "tablet", "oral", (2.5, 5, 25, 50, 100), "mg", 2, False),
+    ("SGLT2 inhibitor", "gliflozin", "tablet", "oral", (5, 10, 25, 100, 300), "mg", 2, False),
+    ("Factor Xa inhibitor", "xaban", "tablet", "oral", (2.5, 5, 10, 15, 20), "mg", 2, False),
+    ("GLP-1 agonist", "glutide", "injection", "subcutaneous", (0.25, 0.5, 1, 2), "mg", 2, True),
+    ("Monoclonal antibody", "mab", "injection", "subcutaneous", (40, 80, 150, 300), "mg", 3, True),
+    ("Kinase inhibitor", "tinib", "tablet", "oral", (50, 100, 150, 250), "mg", 3, True),
+]
+
+_ONSETS = ["b", "c", "d", "f", "g", "l", "m", "n", "p", "r", "s", "t", "v", "z", "pr", "tr"]
+_VOWELS = ["a", "e", "i", "o", "u", "y"]
+SYLLABLES = [onset + vowel for onset in _ONSETS for vowel in _VOWELS]
+BRAND_SUFFIXES = ["", "", "", "ex", "ia", "on", "ra", "xa", "vo", "zen"]
+
+# Share of products sold under a brand name (specialty classes always are)
+BRAND_SHARE = 0.35
+MAX_STRENGTH_VARIANTS = 4
+LABELER_COUNT = 400
+
+# Tier probabilities for (generic, brand, specialty) products, tiers 1-5
+TIER_WEIGHTS = {
+    "generic": (0.75, 0.25, 0.0, 0.0, 0.0),
+    "brand": (0.0, 0.35, 0.40, 0.25, 0.0),
+    "specialty": (0.0, 0.0, 0.0, 0.15, 0.85),
+}
+# Restriction rates by tier (index 0 = tier 1)
+PA_RATES = np.array([0.02, 0.06, 0.18, 0.30, 0.85])
+QL_RATES = np.array([0.10, 0.15, 0.25, 0.30, 0.60])
+ST_RATES = np.array([0.01, 0.05, 0.15, 0.25, 0.30])
+
+SYNTHETIC_INSURERS = [
+    "Anthem",
+    "Kaiser Permanente",
+    "Molina Healthcare",
+    "Centene",
+    "CVS Health",
+    "WellCare",
+    "Oscar Health",
+    "Highmark",
+    "Elevance Health",
+    "Health Net",
+]
+PLAN_TYPES = ["Commercial", "Medicare Advantage", "Medicare Part D", "Medicaid"]
+PLAN_TIERS = ["Bronze", "Silver", "Gold", "Platinum", "Select", "Choice", "Value", "Premier"]
+UPDATE_FREQUENCIES = ["weekly", "bi-weekly", "monthly", "quarterly"]
+
+
+def _name(rng: np.random.Generator, syllables: int) -> str:
+    return "".join(SYLLABLES[i] for i in rng.integers(0, len(SYLLABLES), size=syllables))
+
+
+def synthetic_drugs(rng: np.random.Generator, count: int) -> list[tuple[dict, str]]:
+    """Generate ``count`` drug products as (drug_rules row, drug class) pairs."""
+    weights = np.array([drug_class[6] for drug_class in DRUG_CLASSES], dtype=float)
+    weights /= weights.sum()
+
+    products: list[tuple[dict, str]] = []
+    seen_generics: set[str] = set()
+    next_product_code = np.zeros(LABELER_COUNT, dtype=np.int64)
+    labelers = rng.choice(np.arange(10000, 99999), size=LABELER_COUNT, replace=False)
+
+    while len(products) < count:
+        class_index = rng.choice(len(DRUG_CLASSES), p=weights)
+        drug_class, stem, form, route, strengths, unit, _, specialty = DRUG_CLASSES[class_index]
+
+        generic = _name(rng, int(rng.integers(1, 3))) + stem
+        if generic in seen_generics:
+            continue
+        seen_generics.add(generic)
+
+        branded = specialty or rng.random() < BRAND_SHARE
+        brand = (_name(rng, 2) + BRAND_SUFFIXES[rng.integers(len(BRAND_SUFFIXES))]).title()
+        kind = "specialty" if specialty else "brand" if branded else "generic"
+
+        variants = min(int(rng.geometric(0.5)), MAX_STRENGTH_VARIANTS, len(strengths))
+        labeler = int(rng.integers(LABELER_COUNT))
+        for strength in sorted(rng.choice(strengths, size=variants, replace=False)):
+            product_code = next_product_code[labeler]
+            next_product_code[labeler] += 1
+            tier = int(rng.choice(5, p=TIER_WEIGHTS[kind])) + 1
+            row = {
+                "name": brand if branded else generic.title(),
+                "dosage_form": form,
+                "strength_qty": float(strength),
+                "strength_unit": unit,
+                "route": route,
+                "generic_name": generic,
+                "brand_name": brand if branded else None,
+                "ndc": f"{labelers[labeler]:05d}{product_code:04d}01",
+                "formulary_tier": tier,
+            }
+            products.append((row, drug_class))
+
+    products = products[:count]
+    tiers = np.array([row["formulary_tier"] for row, _ in products]) - 1
+    for name, rates in (
+        ("prior_authorization", PA_RATES),
+        ("quantity_limit", QL_RATES),
+        ("step_therapy", ST_RATES),
+    ):
+        flags = rng.random(len(products)) < rates[tiers]
+        for (row, _), flag in zip(products, flags.tolist(), strict=True):
+            row[name] = flag
+    return products
+
+
+def synthetic_formularies(rng: np.random.Generator, count: int) -> list[tuple[dict, dict]]:
+    """Generate ``count`` insurer plans as (formulary row, insurer profile) pairs."""
+    plans = []
+    for index in range(count):
+        insurer = SYNTHETIC_INSURERS[index % len(SYNTHETIC_INSURERS)]
+        plan_type = PLAN_TYPES[rng.integers(len(PLAN_TYPES))]
+        formulary = {
+            "plan_name": f"{insurer} {PLAN_TIERS[rng.integers(len(PLAN_TIERS))]} {index + 1}",
+            "insurer": insurer,
+            "plan_type": plan_type,
+            "coverage_year": 2025,
+            "state_coverage": "Multi-state" if rng.random() < 0.5 else "National",
+            "effective_date": "2025-01-01",
+            "update_frequency": UPDATE_FREQUENCIES[rng.integers(len(UPDATE_FREQUENCIES))],
+            "data_source": "Synthetic",
+        }
+        profile = {
+            "tier_shift": int(rng.choice([-1, 0, 0, 1])),
+            "pa_rate": round(float(rng.uniform(0.08, 0.25)), 3),
+            "ql_rate": round(float(rng.uniform(0.12, 0.28)), 3),
+            "st_rate": round(float(rng.uniform(0.05, 0.18)), 3),
+        }
+        plans.append((formulary, profile))
+    return plans
+
+
+def generate(db_path: str, drugs: int, formularies: int, seed: int = DEFAULT_SEED) -> None:
+    """Write a new synthetic database of ``drugs`` products and ``formularies`` insurer plans.
+
+    The first plans are the sample insurers with their hand-tuned profiles; the
+    rest are generated. Refuses to overwrite an existing file.
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists")
+
+    rng = np.random.default_rng(seed)
+    products = synthetic_drugs(rng, drugs)
+    sample_profiles = dict(list(INSURER_PROFILES.items())[:formularies])
+    plans = synthetic_formularies(rng, formularies - len(sample_profiles))
+
+    create_database_schema(db_path)
+    create_multi_formulary_schema(db_path)
+
+    with bulk_load(db_path, keep_indexes=INGEST_LOOKUP_INDEXES) as conn:
+        conn.executemany(
+            f"""
+            INSERT INTO drug_rules ({", ".join(DRUG_RULES_COLUMNS)})
+            VALUES ({", ".join(f":{column}" for column in DRUG_RULES_COLUMNS)})
+        """,
+            [row for row, _ in products],
+        )
+
+        formulary_ids = create_sample_formularies(conn)
+        profiles = dict(sample_profiles)
+        for formulary, profile in plans:
+            formulary_ids[formulary["plan_name"]] = upsert_formulary(conn, formulary)
+            profiles[formulary["plan_name"]] = profile
+
+        migrate_existing_drugs(conn, formulary_ids, profiles, seed)
+        conn.executemany(
+            "UPDATE drugs SET drug_class = ? WHERE ndc = ?",
+            [(drug_class, row["ndc"]) for row, drug_class in products],
+        )
+        build_equivalence_groups(conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default="fastform_synthetic.db", help="Database file to create")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--drugs", type=int, help="Override the scale's drug count")
+    parser.add_argument(
+        "--formularies", type=int, help="Override the scale's insurer formulary count"
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--overwrite", action="store_true", help="Replace an existing --db")
+    args = parser.parse_args()
+
+    drugs, formularies = SCALES[args.scale]
+    drugs = args.drugs or drugs
+    formularies = args.formularies or formularies
+    if args.overwrite and os.path.exists(args.db):
+        os.remove(args.db)
+
+    logger.info(f"Generating {drugs:,} drugs x {formularies} formularies (seed {args.seed})...")
+    start = time.perf_counter()
+    generate(args.db, drugs, formularies, args.seed)
+
+    conn = sqlite3.connect(args.db)
+    cursor = conn.execute("SELECT COUNT(*) FROM formulary_coverage")
+    coverage_count = cursor.fetchone()[0]
+    conn.close()
+
+    logger.info(f"\nSynthetic dataset ready in {time.perf_counter() - start:.1f}s!")
+    logger.info(f"  - Coverage rules: {coverage_count:,}")
+    logger.info(f"Database saved to: {args.db}")
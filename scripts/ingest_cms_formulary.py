@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+CMS Part D Formulary Ingestion Script
+
+Streams CMS "basic drugs formulary" files (plain, gzipped, or the zip CMS
+publishes) into the multi-formulary schema in chunked transactions:
+
+    python scripts/ingest_cms_formulary.py SPUF_2024_20240101.zip --db fastform.db
+
+Several files are parsed in parallel worker processes into staging databases
+and merged into the main database as each finishes:
+
+    python scripts/ingest_cms_formulary.py plans/*.txt --workers 8
+
+Progress is checkpointed in the database after every chunk (every file when
+loading several), so rerunning an interrupted load continues where it stopped
+and skips files already loaded; --restart loads them again from the start.
+
+For full refreshes, --bulk loads into an unjournaled scratch copy with the
+search indexes deferred, then renames it over the database. A failed bulk load
+leaves nothing behind to resume, so it always starts over.
+
+Files are published at:
+https://www.cms.gov/medicare/prescription-drug-coverage/prescriptiondrugcovgenin/formularyfiles
+"""
+
+import argparse
+import logging
+import sqlite3
+
+from fastform.db import WriterLock
+from fastform.ingest.bulk import BULK_BATCH_SIZE, bulk_load
+from fastform.ingest.cms import (
+    BASIC_DRUGS_MEMBER,
+    DEFAULT_BATCH_SIZE,
+    IngestStats,
+    ingest_basic_drugs,
+)
+from fastform.ingest.parallel import ingest_files
+from fastform.schema import INGEST_LOOKUP_INDEXES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def ingest(conn: sqlite3.Connection, args: argparse.Namespace) -> IngestStats:
+    resume = not (args.restart or args.bulk)
+    if len(args.paths) == 1:
+        return ingest_basic_drugs(conn, args.paths[0], args.batch_size, args.member, resume)
+    return ingest_files(conn, args.paths, args.workers, args.batch_size, args.member, resume)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "paths", nargs="+", help="CMS basic drugs formulary files (.txt, .gz or .zip)"
+    )
+    parser.add_argument("--db", default="fastform.db", help="SQLite database to load into")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Load into an unjournaled scratch copy with deferred indexes, then swap it in",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore checkpoints from earlier runs and load every file from the start",
+    )
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Parser processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--member", default=BASIC_DRUGS_MEMBER, help="Name of the file to read inside a zip"
+    )
+    args = parser.parse_args()
+    if args.batch_size is None:
+        args.batch_size = BULK_BATCH_SIZE if args.bulk else DEFAULT_BATCH_SIZE
+
+    logger.info(f"Ingesting {len(args.paths)} file(s) into {args.db}...")
+    if args.bulk:
+        with bulk_load(args.db, keep_indexes=INGEST_LOOKUP_INDEXES) as conn:
+            stats = ingest(conn, args)
+    else:
+        # In place: a generation build running meanwhile would publish over these writes
+        with WriterLock(args.db):
+            conn = sqlite3.connect(args.db)
+            stats = ingest(conn, args)
+            conn.close()
+
+    conn = sqlite3.connect(args.db)
+    cursor = conn.execute("SELECT COUNT(*) FROM formularies WHERE data_source LIKE 'cms:%'")
+    formulary_count = cursor.fetchone()[0]
+    conn.close()
+
+    logger.info("\nCMS ingestion complete!")
+    logger.info(f"  - Rows loaded: {stats.rows:,} ({stats.rows_per_s:,.0f} rows/s)")
+    logger.info(f"  - Rows skipped: {stats.skipped:,}")
+    if stats.resumed_lines:
+        logger.info(f"  - Lines already loaded by an earlier run: {stats.resumed_lines:,}")
+    logger.info(f"  - CMS formularies: {formulary_count}")
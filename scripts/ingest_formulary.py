@@ -10,20 +10,40 @@ https://www.cms.gov/medicare/prescription-drug-coverage/prescriptiondrugcovgenin
 import logging
 import sqlite3
 
+from fastform.catalog import get_catalog
+from fastform.db import new_generation
+from fastform.ingest.canonical import canonical_ndc, canonicalize_ndcs
+from fastform.ingest.upsert import upsert_sql
+from fastform.search.vector import vector_search_available
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+DRUG_RULES_COLUMNS = (
+    "name",
+    "dosage_form",
+    "strength_qty",
+    "strength_unit",
+    "route",
+    "generic_name",
+    "brand_name",
+    "ndc",
+    "formulary_tier",
+    "prior_authorization",
+    "quantity_limit",
+    "step_therapy",
+)
+
+
 def create_database_schema(db_path: str) -> None:
     """Create the enhanced database schema for formulary data."""
     conn = sqlite3.connect(db_path)
 
-    # Drop existing table to start fresh
-    conn.execute("DROP TABLE IF EXISTS drug_rules")
-
-    # Create enhanced schema for comprehensive formulary data
+    # Create enhanced schema for comprehensive formulary data. Existing rows are
+    # kept and refreshed in place so drug ids stay stable across ingests.
     conn.execute("""
-        CREATE TABLE drug_rules (
+        CREATE TABLE IF NOT EXISTS drug_rules (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
             dosage_form TEXT,
@@ -42,10 +62,14 @@ def create_database_schema(db_path: str) -> None:
     """)
 
     # Create indexes for better search performance
-    conn.execute("CREATE INDEX idx_name ON drug_rules(name)")
-    conn.execute("CREATE INDEX idx_generic_name ON drug_rules(generic_name)")
-    conn.execute("CREATE INDEX idx_brand_name ON drug_rules(brand_name)")
-    conn.execute("CREATE INDEX idx_formulary_tier ON drug_rules(formulary_tier)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_name ON drug_rules(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_generic_name ON drug_rules(generic_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_brand_name ON drug_rules(brand_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_formulary_tier ON drug_rules(formulary_tier)")
+
+    # Natural key for upserts: NDCs stored in canonical 11-digit form
+    canonicalize_ndcs(conn, "drug_rules")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_drug_rules_ndc ON drug_rules(ndc)")
 
     conn.commit()
     conn.close()
@@ -1165,18 +1189,18 @@ def load_comprehensive_formulary_data(db_path: str) -> None:
 
     conn = sqlite3.connect(db_path)
 
+    # Upsert by canonical NDC, writing only rows whose values changed
+    changes_before = conn.total_changes
     conn.executemany(
-        """
-        INSERT INTO drug_rules (
-            name, dosage_form, strength_qty, strength_unit, route,
-            generic_name, brand_name, ndc, formulary_tier,
-            prior_authorization, quantity_limit, step_therapy
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        sample_drugs,
+        upsert_sql("drug_rules", DRUG_RULES_COLUMNS, key=("ndc",)),
+        [
+            dict(zip(DRUG_RULES_COLUMNS, drug, strict=True), ndc=canonical_ndc(drug[7]))
+            for drug in sample_drugs
+        ],
     )
 
     conn.commit()
+    logger.info(f"Inserted or updated {conn.total_changes - changes_before} drugs")
 
     # Log comprehensive statistics
     cursor = conn.execute("SELECT COUNT(*) FROM drug_rules")
@@ -1225,11 +1249,19 @@ if __name__ == "__main__":
     logger.info("- Real NDC numbers and brand names")
     logger.info("- Common therapeutic categories")
 
-    # Create database schema
-    create_database_schema(db_path)
+    # Build a new generation of the database; readers keep using the current
+    # one until it is published
+    with new_generation(db_path) as build_path:
+        # Create database schema
+        create_database_schema(build_path)
+
+        # Load comprehensive formulary data
+        load_comprehensive_formulary_data(build_path)
 
-    # Load comprehensive formulary data
-    load_comprehensive_formulary_data(db_path)
+    # Prebuild the offline vector index used by mode=vector searches
+    if vector_search_available():
+        vector_index = get_catalog(db_path).vector_index
+        logger.info(f"Vector index ready ({len(vector_index.vocab)} n-grams)")
 
     logger.info("\nFormulary data ingestion complete!")
     logger.info(f"Database saved to: {db_path}")
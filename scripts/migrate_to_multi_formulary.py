@@ -4,128 +4,184 @@ Multi-Formulary Database Migration Script
 
 Migrates from single formulary to normalized multi-formulary schema.
 Creates separate tables for drugs, formularies, and coverage rules.
+
+The migration is set-based: drugs and coverage are copied with
+INSERT ... SELECT upserts, and insurer variations are applied with one cross
+join against per-(insurer, drug) random draws hashed from a fixed seed, so
+every run produces the same data.
 """
 
 import logging
 import sqlite3
-from datetime import datetime
+import time
+
+from fastform.db import new_generation
+from fastform.equivalence import build_equivalence_groups
+from fastform.ingest.canonical import canonicalize_ndcs, register_canonical_functions
+from fastform.ingest.upsert import (
+    COVERAGE_COLUMNS,
+    DRUG_COLUMNS,
+    upsert_formulary,
+    upsert_sql,
+)
+from fastform.schema import create_formulary_indexes, create_formulary_tables
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Insurer characteristics relative to the Medicare baseline
+INSURER_PROFILES = {
+    "Aetna Better Health": {"tier_shift": 0, "pa_rate": 0.15, "ql_rate": 0.20, "st_rate": 0.10},
+    "Blue Cross Blue Shield Standard": {
+        "tier_shift": 0,
+        "pa_rate": 0.18,
+        "ql_rate": 0.15,
+        "st_rate": 0.12,
+    },
+    "UnitedHealthcare Choice Plus": {
+        "tier_shift": -1,
+        "pa_rate": 0.20,
+        "ql_rate": 0.25,
+        "st_rate": 0.15,
+    },  # More restrictive
+    "Humana Gold Plus": {
+        "tier_shift": 0,
+        "pa_rate": 0.12,
+        "ql_rate": 0.18,
+        "st_rate": 0.08,
+    },  # Less restrictive
+    "Cigna HealthCare": {"tier_shift": 1, "pa_rate": 0.16, "ql_rate": 0.22, "st_rate": 0.11},
+}
+VARIATION_SEED = 2025
+# Share of specialty (tier 5) drugs each insurer still covers
+SPECIALTY_COVERAGE_RATE = 0.85
+DRAW_BATCH_SIZE = 50_000
+MASK64 = (1 << 64) - 1
+
+# drug_rules rows with canonical NDC, strength, dosage form and product key
+CREATE_RULE_PRODUCTS = """
+    CREATE TEMP TABLE rule_products AS
+    SELECT r.id AS rule_id, r.name, r.generic_name, r.brand_name,
+           canonical_ndc(r.ndc) AS ndc, canonical_dosage_form(r.dosage_form) AS dosage_form,
+           strength_qty(r.strength_qty, r.strength_unit) AS strength_qty,
+           strength_unit(r.strength_qty, r.strength_unit) AS strength_unit, r.route,
+           product_key(r.name, r.strength_qty, r.strength_unit, r.dosage_form) AS product_key
+    FROM drug_rules r
+"""
+RULE_PRODUCTS_INDEX = (
+    "CREATE INDEX temp.idx_rule_products_key ON rule_products(product_key, rule_id)"
+)
+
+# Refresh drugs by their own NDC, and add the first row of each product not
+# yet in the catalog
+MIGRATE_DRUGS = upsert_sql(
+    "drugs",
+    DRUG_COLUMNS,
+    ("ndc",),
+    touch="updated_at",
+    select="""
+        SELECT p.name, p.generic_name, p.brand_name, p.ndc, p.dosage_form,
+               p.strength_qty, p.strength_unit, p.route, p.product_key
+        FROM temp.rule_products p
+        WHERE EXISTS (SELECT 1 FROM drugs d WHERE d.ndc = p.ndc)
+           OR (
+               NOT EXISTS (
+                   SELECT 1 FROM drug_aliases a WHERE a.alias_type = 'ndc' AND a.alias = p.ndc
+               )
+               AND NOT EXISTS (SELECT 1 FROM drugs d WHERE d.product_key = p.product_key)
+               AND p.rule_id = (
+                   SELECT MIN(q.rule_id) FROM temp.rule_products q
+                   WHERE q.product_key = p.product_key
+               )
+           )
+        ORDER BY p.ndc IS NULL, p.rule_id
+    """,
+)
+
+# Each row's catalog drug: by NDC, NDC alias, then product key
+CREATE_DRUG_MAP = """
+    CREATE TEMP TABLE drug_map AS
+    SELECT p.rule_id, p.ndc, p.name,
+           COALESCE(
+               (SELECT d.id FROM drugs d WHERE d.ndc = p.ndc),
+               (SELECT MIN(a.drug_id) FROM drug_aliases a
+                WHERE a.alias_type = 'ndc' AND a.alias = p.ndc),
+               (SELECT MIN(d.id) FROM drugs d WHERE d.product_key = p.product_key)
+           ) AS drug_id,
+           r.formulary_tier, r.prior_authorization, r.quantity_limit, r.step_therapy
+    FROM temp.rule_products p
+    JOIN drug_rules r ON r.id = p.rule_id
+"""
 
-def create_multi_formulary_schema(db_path: str) -> None:
-    """Create the normalized multi-formulary database schema."""
-    conn = sqlite3.connect(db_path)
-
-    # Backup existing data
-    logger.info("Backing up existing drug_rules data...")
-    cursor = conn.execute("SELECT * FROM drug_rules")
-    existing_drugs = cursor.fetchall()
-
-    # Get column names from existing table
-    cursor = conn.execute("PRAGMA table_info(drug_rules)")
-    existing_columns = [row[1] for row in cursor.fetchall()]
-
-    logger.info(f"Found {len(existing_drugs)} existing drugs with columns: {existing_columns}")
-
-    # Drop existing table
-    conn.execute("DROP TABLE IF EXISTS drug_rules")
-
-    # Create new normalized schema
-
-    # 1. Master drug catalog (insurance-agnostic)
-    conn.execute("""
-        CREATE TABLE drugs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            generic_name TEXT,
-            brand_name TEXT,
-            ndc TEXT,
-            dosage_form TEXT,
-            strength_qty REAL,
-            strength_unit TEXT,
-            route TEXT,
-            drug_class TEXT,
-            manufacturer TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+# NDCs and spellings of rows merged into another row's drug
+INSERT_DRUG_ALIASES = """
+    INSERT OR IGNORE INTO drug_aliases (alias_type, alias, drug_id)
+    SELECT 'ndc', m.ndc, m.drug_id
+    FROM temp.drug_map m JOIN drugs d ON d.id = m.drug_id
+    WHERE m.ndc IS NOT NULL AND d.ndc IS NOT m.ndc
+      AND NOT EXISTS (
+          SELECT 1 FROM drug_aliases a WHERE a.alias_type = 'ndc' AND a.alias = m.ndc
+      )
+    UNION ALL
+    SELECT 'name', m.name, m.drug_id
+    FROM temp.drug_map m JOIN drugs d ON d.id = m.drug_id
+    WHERE d.name != m.name
+"""
 
-    # 2. Insurance formularies/plans
-    conn.execute("""
-        CREATE TABLE formularies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_name TEXT NOT NULL,
-            insurer TEXT NOT NULL,
-            plan_type TEXT,
-            coverage_year INTEGER,
-            state_coverage TEXT,
-            effective_date DATE,
-            expiration_date DATE,
-            update_frequency TEXT DEFAULT 'monthly',
-            last_updated DATETIME,
-            api_endpoint TEXT,
-            data_source TEXT,
-            is_active BOOLEAN DEFAULT 1,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+MIGRATE_BASELINE_COVERAGE = upsert_sql(
+    "formulary_coverage",
+    COVERAGE_COLUMNS,
+    ("formulary_id", "drug_id"),
+    touch="last_verified",
+    select="""
+        SELECT :formulary_id, drug_id, 1, COALESCE(formulary_tier, 1),
+               COALESCE(prior_authorization, 0), COALESCE(quantity_limit, 0),
+               COALESCE(step_therapy, 0)
+        -- One row per drug: the first of the rows merged into it
+        FROM (SELECT *, MIN(rule_id) FROM temp.drug_map GROUP BY drug_id)
+    """,
+)
+
+# Baseline x insurer profiles: shift tiers, add restrictions at the insurer's
+# rates, and drop some specialty drugs
+MIGRATE_VARIATION_COVERAGE = upsert_sql(
+    "formulary_coverage",
+    COVERAGE_COLUMNS,
+    ("formulary_id", "drug_id"),
+    touch="last_verified",
+    select="""
+        SELECT p.formulary_id, b.drug_id,
+               CASE WHEN b.formulary_tier = 5
+                    THEN v.cover_draw < :specialty_coverage_rate ELSE 1 END,
+               MAX(1, MIN(5, b.formulary_tier + p.tier_shift)),
+               b.prior_authorization OR v.pa_draw < p.pa_rate,
+               b.quantity_limit OR v.ql_draw < p.ql_rate,
+               b.step_therapy OR v.st_draw < p.st_rate
+        FROM formulary_coverage b
+        CROSS JOIN temp.insurer_profiles p
+        JOIN temp.variation_draws v
+          ON v.formulary_id = p.formulary_id AND v.drug_id = b.drug_id
+        WHERE b.formulary_id = :medicare_id
+    """,
+)
 
-    # 3. Formulary-specific coverage rules
-    conn.execute("""
-        CREATE TABLE formulary_coverage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            formulary_id INTEGER NOT NULL,
-            drug_id INTEGER NOT NULL,
-            is_covered BOOLEAN DEFAULT 1,
-            formulary_tier INTEGER,
-            prior_authorization BOOLEAN DEFAULT 0,
-            quantity_limit BOOLEAN DEFAULT 0,
-            step_therapy BOOLEAN DEFAULT 0,
-            copay_generic REAL,
-            copay_preferred REAL,
-            copay_nonpreferred REAL,
-            copay_specialty REAL,
-            notes TEXT,
-            last_verified DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (formulary_id) REFERENCES formularies(id),
-            FOREIGN KEY (drug_id) REFERENCES drugs(id),
-            UNIQUE(formulary_id, drug_id)
-        )
-    """)
 
-    # 4. Formulary update tracking
-    conn.execute("""
-        CREATE TABLE formulary_updates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            formulary_id INTEGER NOT NULL,
-            update_type TEXT, -- 'scheduled', 'manual', 'api_sync'
-            status TEXT, -- 'pending', 'in_progress', 'completed', 'failed'
-            drugs_added INTEGER DEFAULT 0,
-            drugs_modified INTEGER DEFAULT 0,
-            drugs_removed INTEGER DEFAULT 0,
-            error_message TEXT,
-            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            completed_at DATETIME,
-            FOREIGN KEY (formulary_id) REFERENCES formularies(id)
-        )
-    """)
+def create_multi_formulary_schema(db_path: str) -> None:
+    """Create the normalized multi-formulary database schema."""
+    conn = sqlite3.connect(db_path)
 
-    # Create indexes for performance
-    conn.execute("CREATE INDEX idx_drugs_name ON drugs(name)")
-    conn.execute("CREATE INDEX idx_drugs_generic ON drugs(generic_name)")
-    conn.execute("CREATE INDEX idx_drugs_brand ON drugs(brand_name)")
-    conn.execute("CREATE INDEX idx_coverage_formulary ON formulary_coverage(formulary_id)")
-    conn.execute("CREATE INDEX idx_coverage_drug ON formulary_coverage(drug_id)")
-    conn.execute("CREATE INDEX idx_coverage_tier ON formulary_coverage(formulary_tier)")
+    cursor = conn.execute("SELECT COUNT(*) FROM drug_rules")
+    logger.info(f"Found {cursor.fetchone()[0]} existing drugs in drug_rules")
 
-    conn.commit()
+    # Create new normalized schema, or bring an existing one up to date. NDCs
+    # are canonicalized before the unique natural-key index is built.
+    # drug_rules is kept; the drug search API still reads it.
+    create_formulary_tables(conn, indexes=False)
+    canonicalize_ndcs(conn, "drugs")
+    create_formulary_indexes(conn)
+    conn.close()
     logger.info("Multi-formulary schema created successfully")
 
-    return existing_drugs, existing_columns
-
 
 def create_sample_formularies(conn: sqlite3.Connection) -> dict:
     """Create sample insurance formularies."""
@@ -201,203 +257,183 @@ def create_sample_formularies(conn: sqlite3.Connection) -> dict:
     formulary_ids = {}
 
     for formulary in formularies_data:
-        cursor = conn.execute(
-            """
-            INSERT INTO formularies (
-                plan_name, insurer, plan_type, coverage_year, state_coverage,
-                effective_date, update_frequency, api_endpoint, data_source, last_updated
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                formulary["plan_name"],
-                formulary["insurer"],
-                formulary["plan_type"],
-                formulary["coverage_year"],
-                formulary["state_coverage"],
-                formulary["effective_date"],
-                formulary["update_frequency"],
-                formulary["api_endpoint"],
-                formulary["data_source"],
-                datetime.now(),
-            ),
-        )
-
-        formulary_ids[formulary["plan_name"]] = cursor.lastrowid
+        formulary_ids[formulary["plan_name"]] = upsert_formulary(conn, formulary)
 
     conn.commit()
-    logger.info(f"Created {len(formularies_data)} sample formularies")
+    logger.info(f"Created or updated {len(formularies_data)} sample formularies")
 
     return formulary_ids
 
 
 def migrate_existing_drugs(
-    conn: sqlite3.Connection, existing_drugs: list, existing_columns: list, formulary_ids: dict
+    conn: sqlite3.Connection,
+    formulary_ids: dict,
+    insurer_profiles: dict = INSURER_PROFILES,
+    seed: int = VARIATION_SEED,
 ) -> None:
     """Migrate existing drug data to new schema."""
+    register_canonical_functions(conn)
 
-    # Insert drugs into master catalog
+    # Upsert into the master catalog by canonical NDC so re-running keeps ids;
+    # rows of a product already in the catalog become aliases of its drug
     logger.info("Migrating existing drugs to master catalog...")
-
-    drug_id_mapping = {}
-
-    for drug_data in existing_drugs:
-        # Map old columns to new schema
-        drug_dict = dict(zip(existing_columns, drug_data, strict=False))
-
-        cursor = conn.execute(
-            """
-            INSERT INTO drugs (
-                name, generic_name, brand_name, ndc, dosage_form,
-                strength_qty, strength_unit, route
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                drug_dict.get("name"),
-                drug_dict.get("generic_name"),
-                drug_dict.get("brand_name"),
-                drug_dict.get("ndc"),
-                drug_dict.get("dosage_form"),
-                drug_dict.get("strength_qty"),
-                drug_dict.get("strength_unit"),
-                drug_dict.get("route"),
-            ),
-        )
-
-        new_drug_id = cursor.lastrowid
-        drug_id_mapping[drug_dict.get("id", len(drug_id_mapping) + 1)] = new_drug_id
-
+    conn.execute("DROP TABLE IF EXISTS temp.rule_products")
+    conn.execute(CREATE_RULE_PRODUCTS)
+    conn.execute(RULE_PRODUCTS_INDEX)
+    conn.execute(MIGRATE_DRUGS)
+
+    conn.execute("DROP TABLE IF EXISTS temp.drug_map")
+    conn.execute(CREATE_DRUG_MAP)
+    conn.execute(INSERT_DRUG_ALIASES)
+    rows, drugs = conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT drug_id) FROM temp.drug_map"
+    ).fetchone()
     conn.commit()
-    logger.info(f"Migrated {len(existing_drugs)} drugs to master catalog")
+    logger.info(f"Migrated {rows} drug rules to {drugs} catalog drugs")
 
     # Create formulary-specific coverage with variations
     logger.info("Creating formulary-specific coverage rules...")
 
-    medicare_id = formulary_ids["Medicare Part D Standard"]
-
     # Import existing Medicare data as baseline
-    for drug_data in existing_drugs:
-        drug_dict = dict(zip(existing_columns, drug_data, strict=False))
-        old_drug_id = drug_dict.get("id", 0)
-        new_drug_id = drug_id_mapping.get(old_drug_id)
-
-        if new_drug_id:
-            conn.execute(
-                """
-                INSERT INTO formulary_coverage (
-                    formulary_id, drug_id, is_covered, formulary_tier,
-                    prior_authorization, quantity_limit, step_therapy
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    medicare_id,
-                    new_drug_id,
-                    True,
-                    drug_dict.get("formulary_tier", 1),
-                    drug_dict.get("prior_authorization", False),
-                    drug_dict.get("quantity_limit", False),
-                    drug_dict.get("step_therapy", False),
-                ),
-            )
+    medicare_id = formulary_ids["Medicare Part D Standard"]
+    conn.execute(MIGRATE_BASELINE_COVERAGE, {"formulary_id": medicare_id})
 
     # Create realistic variations for other formularies
-    create_formulary_variations(conn, drug_id_mapping, formulary_ids)
+    create_formulary_variations(conn, formulary_ids, insurer_profiles, seed)
 
     conn.commit()
     logger.info("Created formulary-specific coverage rules")
 
 
+def uniform_draws(seed: int, key: int, ids: list[int], streams: int) -> list[list[float]]:
+    """Reproducible uniform [0, 1) draws, ``streams`` per id.
+
+    Each value is a SplitMix64 hash of (seed, key, id, stream), so a row keeps
+    its draws when other rows are added or removed between runs.
+    """
+    base = _splitmix64(((seed << 32) ^ key) & MASK64)
+    draws = []
+    for row_id in ids:
+        state = _splitmix64(base ^ (row_id & MASK64))
+        draws.append(
+            [(_splitmix64(state ^ (stream << 56)) >> 11) * 2.0**-53 for stream in range(streams)]
+        )
+    return draws
+
+
+def _splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
 def create_formulary_variations(
-    conn: sqlite3.Connection, drug_id_mapping: dict, formulary_ids: dict
+    conn: sqlite3.Connection,
+    formulary_ids: dict,
+    insurer_profiles: dict = INSURER_PROFILES,
+    seed: int = VARIATION_SEED,
 ) -> None:
-    """Create realistic formulary variations across different insurers."""
+    """Create realistic formulary variations across different insurers.
 
-    import random
+    Random draws for every (insurer, drug) pair are generated in batches and
+    staged in a temp table; one cross join of the Medicare baseline with
+    the insurer profiles then applies them.
+    """
+    medicare_id = formulary_ids["Medicare Part D Standard"]
 
-    # Get all drug IDs
-    drug_ids = list(drug_id_mapping.values())
+    conn.execute("DROP TABLE IF EXISTS temp.insurer_profiles")
+    conn.execute("""
+        CREATE TEMP TABLE insurer_profiles (
+            formulary_id INTEGER PRIMARY KEY,
+            tier_shift INTEGER,
+            pa_rate REAL,
+            ql_rate REAL,
+            st_rate REAL
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO temp.insurer_profiles VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                formulary_ids[plan_name],
+                profile["tier_shift"],
+                profile["pa_rate"],
+                profile["ql_rate"],
+                profile["st_rate"],
+            )
+            for plan_name, profile in insurer_profiles.items()
+        ],
+    )
+
+    conn.execute("DROP TABLE IF EXISTS temp.variation_draws")
+    conn.execute("""
+        CREATE TEMP TABLE variation_draws (
+            formulary_id INTEGER,
+            drug_id INTEGER,
+            pa_draw REAL,
+            ql_draw REAL,
+            st_draw REAL,
+            cover_draw REAL,
+            PRIMARY KEY (formulary_id, drug_id)
+        ) WITHOUT ROWID
+    """)
 
-    # Define insurer characteristics
-    insurer_profiles = {
-        "Aetna Better Health": {"tier_shift": 0, "pa_rate": 0.15, "ql_rate": 0.20, "st_rate": 0.10},
-        "Blue Cross Blue Shield Standard": {
-            "tier_shift": 0,
-            "pa_rate": 0.18,
-            "ql_rate": 0.15,
-            "st_rate": 0.12,
-        },
-        "UnitedHealthcare Choice Plus": {
-            "tier_shift": -1,
-            "pa_rate": 0.20,
-            "ql_rate": 0.25,
-            "st_rate": 0.15,
-        },  # More restrictive
-        "Humana Gold Plus": {
-            "tier_shift": 0,
-            "pa_rate": 0.12,
-            "ql_rate": 0.18,
-            "st_rate": 0.08,
-        },  # Less restrictive
-        "Cigna HealthCare": {"tier_shift": 1, "pa_rate": 0.16, "ql_rate": 0.22, "st_rate": 0.11},
-    }
-
-    # Get Medicare baseline data
-    medicare_id = formulary_ids["Medicare Part D Standard"]
     cursor = conn.execute(
-        """
-        SELECT drug_id, formulary_tier, prior_authorization, quantity_limit, step_therapy
-        FROM formulary_coverage 
-        WHERE formulary_id = ?
-    """,
+        "SELECT drug_id FROM formulary_coverage WHERE formulary_id = ? ORDER BY drug_id",
         (medicare_id,),
     )
+    drug_ids = [row[0] for row in cursor]
 
-    medicare_coverage = cursor.fetchall()
-
-    # Create variations for each insurer
-    for plan_name, profile in insurer_profiles.items():
+    for plan_name in insurer_profiles:
         formulary_id = formulary_ids[plan_name]
-
-        for drug_id, base_tier, base_pa, base_ql, base_st in medicare_coverage:
-            # Adjust tier based on insurer profile
-            new_tier = max(1, min(5, base_tier + profile["tier_shift"]))
-
-            # Adjust restrictions based on insurer rates
-            new_pa = base_pa or (random.random() < profile["pa_rate"])
-            new_ql = base_ql or (random.random() < profile["ql_rate"])
-            new_st = base_st or (random.random() < profile["st_rate"])
-
-            # Some drugs might not be covered by certain insurers
-            is_covered = True
-            if base_tier == 5:  # Specialty drugs
-                is_covered = random.random() < 0.85  # 15% chance not covered
-
-            conn.execute(
-                """
-                INSERT INTO formulary_coverage (
-                    formulary_id, drug_id, is_covered, formulary_tier,
-                    prior_authorization, quantity_limit, step_therapy
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-                (formulary_id, drug_id, is_covered, new_tier, new_pa, new_ql, new_st),
+        for start in range(0, len(drug_ids), DRAW_BATCH_SIZE):
+            batch = drug_ids[start : start + DRAW_BATCH_SIZE]
+            draws = uniform_draws(seed, formulary_id, batch, streams=4)
+            conn.executemany(
+                "INSERT INTO temp.variation_draws VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (formulary_id, drug_id, *drug_draws)
+                    for drug_id, drug_draws in zip(batch, draws, strict=True)
+                ),
             )
 
+    conn.execute(
+        MIGRATE_VARIATION_COVERAGE,
+        {"medicare_id": medicare_id, "specialty_coverage_rate": SPECIALTY_COVERAGE_RATE},
+    )
+
 
 if __name__ == "__main__":
     db_path = "fastform.db"
 
     logger.info("Starting multi-formulary database migration...")
 
-    # Create new schema and backup existing data
-    existing_drugs, existing_columns = create_multi_formulary_schema(db_path)
+    start = time.perf_counter()
 
-    # Create connection for data migration
-    conn = sqlite3.connect(db_path)
+    # Migrate into a new generation of the database; readers keep using the
+    # current one until it is published
+    with new_generation(db_path) as build_path:
+        # Create new schema (existing data stays in place)
+        create_multi_formulary_schema(build_path)
+
+        # Create connection for data migration
+        conn = sqlite3.connect(build_path)
+        try:
+            # Create sample formularies
+            formulary_ids = create_sample_formularies(conn)
 
-    # Create sample formularies
-    formulary_ids = create_sample_formularies(conn)
+            # Migrate existing drug data
+            migrate_existing_drugs(conn, formulary_ids)
 
-    # Migrate existing drug data
-    migrate_existing_drugs(conn, existing_drugs, existing_columns, formulary_ids)
+            # Precompute therapeutic-equivalence groups for alternative lookups
+            group_entries = build_equivalence_groups(conn)
+            conn.commit()
+        finally:
+            conn.close()
+    logger.info(f"Built {group_entries} equivalence group entries")
+
+    conn = sqlite3.connect(db_path)
 
     # Log final statistics
     cursor = conn.execute("SELECT COUNT(*) FROM drugs")
@@ -409,7 +445,7 @@ if __name__ == "__main__":
     cursor = conn.execute("SELECT COUNT(*) FROM formulary_coverage")
     coverage_count = cursor.fetchone()[0]
 
-    logger.info("\nMigration complete!")
+    logger.info(f"\nMigration complete in {time.perf_counter() - start:.1f}s!")
     logger.info("📊 Final Statistics:")
     logger.info(f"  - Drugs in catalog: {drug_count}")
     logger.info(f"  - Insurance formularies: {formulary_count}")
@@ -3,168 +3,27 @@
 Automated Formulary Update System
 
 Handles automated synchronization of formulary data from insurance providers.
+Plans are fetched concurrently (see ``fastform.updates.manager``); tune the
+limits with the update_* settings (UPDATE_MAX_CONCURRENCY etc. in the environment).
+The new data is written to a side file and swapped in atomically, so this is
+safe to run against the database a live API is serving. The API can also run
+the same updates itself with UPDATE_SCHEDULER_ENABLED=true.
 """
 
+import argparse
 import asyncio
 import logging
-import sqlite3
-from dataclasses import dataclass
-from datetime import datetime
-from enum import Enum
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-
-class UpdateStatus(Enum):
-    PENDING = "pending"
-    IN_PROGRESS = "in_progress"
-    COMPLETED = "completed"
-    FAILED = "failed"
-
-
-@dataclass
-class FormularyUpdate:
-    formulary_id: int
-    plan_name: str
-    insurer: str
-    status: UpdateStatus = UpdateStatus.PENDING
-    drugs_added: int = 0
-    drugs_modified: int = 0
-    drugs_removed: int = 0
-
-
-class FormularyUpdateManager:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-
-    async def check_for_updates(self) -> list[FormularyUpdate]:
-        """Check all formularies for available updates."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.execute("""
-            SELECT id, plan_name, insurer, update_frequency, last_updated
-            FROM formularies 
-            WHERE is_active = 1
-        """)
-
-        formularies = cursor.fetchall()
-        conn.close()
-
-        updates_needed = []
-
-        for formulary_id, plan_name, insurer, frequency, last_updated in formularies:
-            if self._should_update(last_updated, frequency):
-                update = FormularyUpdate(
-                    formulary_id=formulary_id, plan_name=plan_name, insurer=insurer
-                )
-                updates_needed.append(update)
-
-        return updates_needed
-
-    def _should_update(self, last_updated: str, frequency: str) -> bool:
-        """Determine if formulary should be updated."""
-        if not last_updated:
-            return True
-
-        # For demo, assume all need updates
-        return True
-
-    async def process_updates(self, updates: list[FormularyUpdate]) -> None:
-        """Process formulary updates."""
-        for update in updates:
-            await self._process_single_update(update)
-
-    async def _process_single_update(self, update: FormularyUpdate) -> None:
-        """Process a single formulary update."""
-        try:
-            logger.info(f"Updating {update.plan_name} ({update.insurer})")
-
-            # Simulate API call delay
-            await asyncio.sleep(1.0)
-
-            # Mock update results
-            if "Medicare" in update.plan_name:
-                update.drugs_added = 2
-                update.drugs_modified = 5
-                update.drugs_removed = 1
-            elif "Aetna" in update.insurer:
-                update.drugs_added = 1
-                update.drugs_modified = 3
-                update.drugs_removed = 0
-            elif "Blue Cross" in update.insurer:
-                update.drugs_added = 3
-                update.drugs_modified = 7
-                update.drugs_removed = 2
-            else:
-                update.drugs_added = 1
-                update.drugs_modified = 4
-                update.drugs_removed = 1
-
-            update.status = UpdateStatus.COMPLETED
-
-            # Update database timestamp
-            conn = sqlite3.connect(self.db_path)
-            conn.execute(
-                """
-                UPDATE formularies 
-                SET last_updated = ? 
-                WHERE id = ?
-            """,
-                (datetime.now().isoformat(), update.formulary_id),
-            )
-            conn.commit()
-            conn.close()
-
-            logger.info(
-                f"✅ {update.plan_name}: +{update.drugs_added}, ~{update.drugs_modified}, -{update.drugs_removed}"
-            )
-
-        except Exception as e:
-            update.status = UpdateStatus.FAILED
-            logger.error(f"❌ Failed to update {update.plan_name}: {e}")
-
-
-async def run_formulary_updates(db_path: str = "fastform.db") -> None:
-    """Run automated formulary updates."""
-    logger.info("🔄 Starting automated formulary update process...")
-
-    manager = FormularyUpdateManager(db_path)
-
-    # Check for needed updates
-    updates_needed = await manager.check_for_updates()
-
-    if not updates_needed:
-        logger.info("✅ All formularies are up to date")
-        return
-
-    logger.info(f"📋 Found {len(updates_needed)} formularies needing updates")
-
-    # Process updates
-    await manager.process_updates(updates_needed)
-
-    # Summary
-    successful = len([u for u in updates_needed if u.status == UpdateStatus.COMPLETED])
-    failed = len([u for u in updates_needed if u.status == UpdateStatus.FAILED])
-
-    logger.info("\n📊 Update Summary:")
-    logger.info(f"  ✅ Successful: {successful}")
-    logger.info(f"  ❌ Failed: {failed}")
-
-    if successful > 0:
-        total_added = sum(
-            u.drugs_added for u in updates_needed if u.status == UpdateStatus.COMPLETED
-        )
-        total_modified = sum(
-            u.drugs_modified for u in updates_needed if u.status == UpdateStatus.COMPLETED
-        )
-        total_removed = sum(
-            u.drugs_removed for u in updates_needed if u.status == UpdateStatus.COMPLETED
-        )
-
-        logger.info(
-            f"  📈 Total changes: +{total_added} drugs, ~{total_modified} modified, -{total_removed} removed"
-        )
+from fastform.updates.scheduler import update_in_side_file
 
+logging.basicConfig(level=logging.INFO)
 
 if __name__ == "__main__":
-    asyncio.run(run_formulary_updates())
+    parser = argparse.ArgumentParser(description="Sync formularies from insurer APIs")
+    parser.add_argument("--db", default="fastform.db", help="Database to update")
+    parser.add_argument(
+        "--force", action="store_true", help="Check every plan, even those not yet due"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(update_in_side_file(args.db, args.force))
@@ -0,0 +1 @@
+"""LLM-backed search helpers."""
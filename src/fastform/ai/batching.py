@@ -0,0 +1,74 @@
+"""
+Micro-batching of small upstream requests.
+
+Items submitted within a short window (or until the batch is full) are handed
+to one batch handler call, and each submitter gets back its own slot of the
+result. The extra queueing delay is bounded by the window.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        handler: Callable[[list[Any]], Awaitable[list[Any]]],
+        window_s: float,
+        max_batch: int,
+    ):
+        self.handler = handler
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._pending: list[tuple[Any, asyncio.Future[Any]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._running: set[asyncio.Task[None]] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue ``item`` for the next batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future[Any]]]) -> None:
+        # Submitters that already gave up (deadline, disconnect) are dropped
+        live = [(item, future) for item, future in batch if not future.done()]
+        if not live:
+            return
+
+        try:
+            results = await self.handler([item for item, _ in live])
+            if len(results) != len(live):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(live)}")
+        except Exception as e:
+            for _, future in live:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug(f"Resolved micro-batch of {len(live)} items")
+        for (_, future), result in zip(live, results, strict=True):
+            if not future.done():
+                future.set_result(result)
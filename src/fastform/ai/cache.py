@@ -0,0 +1,164 @@
+"""
+Two-level cache of parsed LLM answers for intelligent search.
+
+An in-memory LRU sits in front of a SQLite table, so repeated queries skip the
+completion entirely and cached answers survive restarts. Entries are keyed on
+the normalized query, the catalog generation and the model, expire after a TTL
+and are evicted least-recently-used once either level is full.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from fastform.search.retrieval import normalize
+from fastform.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Run disk eviction every this many writes rather than on each one
+EVICT_EVERY = 100
+
+
+def answer_cache_key(query: str, generation: object, model: str) -> str:
+    payload = json.dumps([normalize(query), repr(generation), model])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path: str | None,
+        ttl_s: float,
+        max_memory_entries: int,
+        max_disk_entries: int,
+    ):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: OrderedDict[str, tuple[float, list[dict[str, Any]]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn: sqlite3.Connection | None = None
+
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_answers (
+                    key TEXT PRIMARY KEY,
+                    matches TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_answers_accessed ON llm_answers(accessed_at)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> list[dict[str, Any]] | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, matches = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return matches
+                del self._memory[key]
+
+            if self._conn is None:
+                return None
+
+            row = self._conn.execute(
+                "SELECT matches, expires_at FROM llm_answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM llm_answers WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE llm_answers SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            stored: list[dict[str, Any]] = json.loads(row[0])
+            self._remember(key, row[1], stored)
+            return stored
+
+    def set(self, key: str, matches: list[dict[str, Any]]) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_s
+        with self._lock:
+            self._remember(key, expires_at, matches)
+            if self._conn is None:
+                return
+
+            self._conn.execute(
+                """
+                INSERT INTO llm_answers (key, matches, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    matches = excluded.matches,
+                    expires_at = excluded.expires_at,
+                    accessed_at = excluded.accessed_at
+            """,
+                (key, json.dumps(matches), expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict_disk(self._conn, now)
+            self._conn.commit()
+
+    def _remember(self, key: str, expires_at: float, matches: list[dict[str, Any]]) -> None:
+        self._memory[key] = (expires_at, matches)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM llm_answers WHERE expires_at <= ?", (now,))
+        count = conn.execute("SELECT COUNT(*) FROM llm_answers").fetchone()[0]
+        if count > self.max_disk_entries:
+            conn.execute(
+                """
+                DELETE FROM llm_answers WHERE key IN (
+                    SELECT key FROM llm_answers ORDER BY accessed_at LIMIT ?
+                )
+            """,
+                (count - self.max_disk_entries,),
+            )
+            logger.info(f"Evicted {count - self.max_disk_entries} cached LLM answers")
+
+    def close(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache: AnswerCache | None = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """Return the process-wide answer cache for the configured path."""
+    global _cache
+
+    if _cache is None or _cache.path != settings.llm_cache_path:
+        if _cache is not None:
+            _cache.close()
+        _cache = AnswerCache(
+            settings.llm_cache_path,
+            ttl_s=settings.llm_cache_ttl_s,
+            max_memory_entries=settings.llm_cache_memory_entries,
+            max_disk_entries=settings.llm_cache_disk_entries,
+        )
+    return _cache
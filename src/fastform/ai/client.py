@@ -0,0 +1,63 @@
+"""
+Shared async OpenAI client.
+
+Creating an ``OpenAI`` client per request pays a fresh TLS handshake every time,
+and the synchronous client blocks the event loop for the whole completion. One
+``AsyncOpenAI`` per process, backed by a pooled keep-alive httpx client, avoids
+both.
+"""
+
+import asyncio
+
+import httpx
+from openai import AsyncOpenAI
+
+from fastform.settings import settings
+
+_client: AsyncOpenAI | None = None
+_client_key: tuple[object, ...] | None = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """Return the process-wide client, creating it on first use.
+
+    The pooled connections belong to the event loop that opened them, so a new
+    client is created if the running loop (or the configured endpoint) changes.
+    """
+    global _client, _client_key
+
+    key = (
+        asyncio.get_running_loop(),
+        settings.openai_api_key,
+        settings.openai_base_url,
+    )
+    if _client is not None and _client_key == key:
+        return _client
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry_s,
+        ),
+        timeout=httpx.Timeout(settings.openai_timeout_s, connect=settings.openai_connect_timeout_s),
+    )
+    _client = AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_base_url,
+        # Newer openai releases type this against their vendored httpx fork
+        http_client=http_client,  # type: ignore[arg-type, unused-ignore]
+        max_retries=settings.openai_max_retries,
+    )
+    _client_key = key
+    return _client
+
+
+async def close_openai_client() -> None:
+    """Close the shared client and its connection pool."""
+    global _client, _client_key
+
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _client_key = None
@@ -0,0 +1,79 @@
+"""
+Incremental parsing of a JSON array that arrives in pieces.
+
+LLM completions stream a few characters at a time. ``JsonArrayStream`` tracks
+nesting and string state across ``feed`` calls and hands back each top-level
+array element as soon as its closing bracket arrives, so callers can act on
+the first match before the model has finished writing the rest.
+"""
+
+import json
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class JsonArrayStream:
+    def __init__(self) -> None:
+        self.complete = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element: list[str] = []
+
+    def feed(self, text: str) -> list[Any]:
+        """Consume the next piece of text and return the elements it completed."""
+        elements: list[Any] = []
+        for char in text:
+            if self.complete:
+                break
+
+            if not self._started:
+                # Skip any prose or code fence before the array opens
+                self._started = char == "["
+                continue
+
+            if self._in_string:
+                self._element.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._element.append(char)
+            elif char in "{[":
+                self._depth += 1
+                self._element.append(char)
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self._flush(elements)
+                    self.complete = True
+                    break
+                self._depth -= 1
+                self._element.append(char)
+                if self._depth == 0:
+                    self._flush(elements)
+            elif char == "," and self._depth == 0:
+                self._flush(elements)
+            elif self._depth > 0 or not char.isspace():
+                self._element.append(char)
+
+        return elements
+
+    def _flush(self, elements: list[Any]) -> None:
+        raw = "".join(self._element).strip()
+        self._element = []
+        if not raw:
+            return
+        try:
+            elements.append(json.loads(raw))
+        except json.JSONDecodeError:
+            logger.error(f"Skipping unparseable streamed element: {raw}")
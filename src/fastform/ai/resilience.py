@@ -0,0 +1,122 @@
+"""
+Latency and failure guards for upstream LLM calls.
+
+``CircuitBreaker`` stops calling an upstream that keeps failing and lets a
+single probe through after a cool-down; ``guard`` records the outcome of a
+call however it ends, so an abandoned probe cannot wedge the circuit. A call
+abandoned by its caller (cancelled, or a stream closed on disconnect) says
+nothing about the upstream, so it only frees the probe slot.
+``hedged`` starts a second identical
+call if the first has not finished after a delay and returns whichever
+succeeds first. Deadlines are plain ``asyncio.wait_for`` around both.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout_s: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.clock = clock
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now."""
+        if self.state == self.CLOSED:
+            return True
+        now = self.clock()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout_s:
+            # Let one probe through; its outcome closes or re-opens the circuit
+            self.state = self.HALF_OPEN
+            self.probe_started_at = now
+            return True
+        if self.state == self.HALF_OPEN and now - self.probe_started_at >= self.reset_timeout_s:
+            # The last probe never reported back; let another one through
+            self.probe_started_at = now
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """Give up a half-open probe without an outcome; the next call may probe."""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = self.clock() - self.reset_timeout_s
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Record the outcome of the enclosed call. Exceptions count as failures,
+        except cancellation and a closed stream, which only release the probe."""
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            self.release_probe()
+            raise
+        except BaseException:
+            self.record_failure()
+            raise
+        self.record_success()
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+
+async def hedged(fn: Callable[[], Awaitable[Any]], hedge_delay_s: float | None) -> Any:
+    """Await ``fn()``, issuing a second attempt if the first is still running
+    after ``hedge_delay_s``. The first successful result wins; if every attempt
+    fails, the last error is raised."""
+    if hedge_delay_s is None:
+        return await fn()
+
+    pending = {asyncio.ensure_future(fn())}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay_s)
+        if not done:
+            pending.add(asyncio.ensure_future(fn()))
+
+        error: BaseException | None = None
+        while done or pending:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        # Every attempt finished, and none of them succeeded
+        assert error is not None
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,13 +1,34 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from fastform.ai.client import close_openai_client
+from fastform.db import close_pools
 from fastform.settings import settings
+from fastform.updates.scheduler import UpdateScheduler
 
 from .routes.ai_drugs import router as ai_drugs_router
 from .routes.drugs import router as drugs_router
 from .routes.formularies import router as formularies_router
 from .routes.health import router as health_router
 
-app = FastAPI(title=settings.app_name)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    scheduler = None
+    if settings.update_scheduler_enabled:
+        scheduler = UpdateScheduler(settings.db_path)
+        scheduler.start()
+    app.state.update_scheduler = scheduler
+    yield
+    if scheduler is not None:
+        await scheduler.stop()
+    await close_openai_client()
+    close_pools()
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 app.include_router(health_router, prefix="/v1")
 app.include_router(drugs_router, prefix="/v1/drugs", tags=["drugs"])
 app.include_router(ai_drugs_router, prefix="/v1/drugs", tags=["ai-drugs"])
@@ -0,0 +1,110 @@
+"""
+Pre-serialized, pre-compressed response cache.
+
+Endpoints whose output only changes when the underlying data changes can keep
+the fully encoded JSON bytes (plus gzip and brotli variants) keyed by
+(endpoint, params, data generation) and serve them directly, skipping model
+validation, JSON encoding and compression on every hit.
+"""
+
+import gzip
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional dependency: pip install "fastform[compression]"
+    brotli = None
+
+
+@dataclass(frozen=True)
+class EncodedResponse:
+    """One response body in every content encoding we can serve."""
+
+    identity: bytes
+    gzip: bytes
+    br: bytes | None = None
+
+    @classmethod
+    def from_content(cls, content: Any) -> "EncodedResponse":
+        # Same byte layout as fastapi.responses.JSONResponse.render
+        body = json.dumps(
+            content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        return cls(
+            identity=body,
+            gzip=gzip.compress(body, compresslevel=9, mtime=0),
+            br=brotli.compress(body) if brotli is not None else None,
+        )
+
+    def select(self, accept_encoding: str) -> tuple[bytes, str | None]:
+        """Pick the smallest variant the client accepts."""
+        accepted = _parse_accept_encoding(accept_encoding)
+        if self.br is not None and "br" in accepted:
+            return self.br, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+def _parse_accept_encoding(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in {"0", "0.0", "0.00", "0.000"}:
+            continue
+        accepted.add(coding)
+    if "*" in accepted:
+        accepted.update({"br", "gzip"})
+    return accepted
+
+
+class ResponseCache:
+    """Bounded LRU of encoded responses."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, EncodedResponse] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], Any]) -> EncodedResponse:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = EncodedResponse.from_content(build())
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, request: Request, key: Hashable, build: Callable[[], Any]) -> Response:
+        """Serve the cached body for ``key``, building it with ``build`` on a miss."""
+        entry = self.get_or_build(key, build)
+        body, encoding = entry.select(request.headers.get("accept-encoding", ""))
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
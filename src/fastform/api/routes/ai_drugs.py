@@ -1,15 +1,45 @@
+import asyncio
+import json
 import logging
-import sqlite3
+import math
+from collections.abc import AsyncIterator, Awaitable
+from contextlib import AbstractContextManager, nullcontext
+from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from openai import OpenAI
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from openai import OpenAIError
+from openai.types.chat import ChatCompletionMessageParam
 from pydantic import BaseModel
 
+from fastform.ai.batching import MicroBatcher
+from fastform.ai.cache import answer_cache_key, get_answer_cache
+from fastform.ai.client import get_openai_client
+from fastform.ai.json_stream import JsonArrayStream
+from fastform.ai.resilience import CircuitBreaker, hedged
+from fastform.ai.singleflight import SingleFlight
+from fastform.catalog import DrugCatalog, get_catalog
+from fastform.search.retrieval import MIN_SCORE, normalize
 from fastform.settings import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+SEARCH_PATH_CACHE = "cache"
+SEARCH_PATH_LLM = "llm"
+SEARCH_PATH_FALLBACK = "fallback"
+
+_inflight = SingleFlight()
+_breaker = CircuitBreaker(
+    failure_threshold=settings.ai_breaker_failure_threshold,
+    reset_timeout_s=settings.ai_breaker_reset_s,
+)
+_batcher = MicroBatcher(
+    lambda items: _complete_batch(items),
+    window_s=settings.ai_batch_window_ms / 1000,
+    max_batch=settings.ai_batch_max_queries,
+)
+
 
 class IntelligentDrugSearchRequest(BaseModel):
     query: str
@@ -35,10 +65,14 @@ class DrugMatchResult(BaseModel):
 
 
 @router.post("/intelligent-search", response_model=list[DrugMatchResult])
-async def intelligent_drug_search(request: IntelligentDrugSearchRequest):
+async def intelligent_drug_search(request: IntelligentDrugSearchRequest, response: Response):
     """
     Intelligent drug search using OpenAI to handle typos, brand/generic variations,
     and provide context-aware matching with explanations.
+
+    The LLM call runs under a latency budget and a circuit breaker; when either
+    trips, locally ranked matches are returned instead. The ``X-Search-Path``
+    header reports which path served the response (cache, llm or fallback).
     """
     if not request.query.strip():
         return []
@@ -50,40 +84,222 @@ async def intelligent_drug_search(request: IntelligentDrugSearchRequest):
         )
 
     try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=settings.openai_api_key)
-
-        # Get all drugs from the database for analysis
-        conn = sqlite3.connect(settings.db_path)
-        conn.row_factory = sqlite3.Row
-
-        drug_query = """
-        SELECT id, name, dosage_form, strength_qty, strength_unit, route,
-               generic_name, brand_name, ndc, formulary_tier,
-               prior_authorization, quantity_limit, step_therapy
-        FROM drug_rules 
-        ORDER BY formulary_tier, name
-        LIMIT 50
-        """
-
-        cursor = conn.execute(drug_query)
-        all_drugs = cursor.fetchall()
-        conn.close()
-
-        # Create drug list for OpenAI analysis
-        drug_list = []
-        for drug in all_drugs:
-            drug_info = f"{drug['name']}"
-            if drug["generic_name"] and drug["generic_name"] != drug["name"]:
-                drug_info += f" ({drug['generic_name']})"
-            if drug["brand_name"]:
-                drug_info += f" - {drug['brand_name']}"
+        # Concurrent identical queries share one catalog scan and completion
+        results, path = await _inflight.do(
+            normalize(request.query), lambda: _search_matches(request.query)
+        )
+        response.headers["X-Search-Path"] = path
+        return results[: request.max_results]
+
+    except OpenAIError as e:
+        logger.error(f"OpenAI error in intelligent search: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"OpenAI service error: {str(e)}") from e
+    except Exception as e:
+        logger.error(f"Error in intelligent search: {str(e)}")
+        if "openai" in str(e).lower() or "api" in str(e).lower():
+            raise HTTPException(status_code=503, detail=f"OpenAI service error: {str(e)}")
+        else:
+            raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+
+@router.post("/intelligent-search/stream")
+async def intelligent_drug_search_stream(
+    request: IntelligentDrugSearchRequest,
+) -> StreamingResponse:
+    """
+    Streaming variant of the intelligent search as server-sent events.
+
+    Emits a ``local`` event with instant local matches first, then one ``match``
+    event per LLM-derived match as the completion streams in, and finally a
+    ``done`` event with the serving path and the ranked match ids.
+    """
+    if not settings.openai_key_found:
+        raise HTTPException(
+            status_code=503,
+            detail="OpenAI API key not configured. Please set OPENAI_API_KEY environment variable.",
+        )
+
+    return StreamingResponse(
+        _stream_search(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_search(request: IntelligentDrugSearchRequest) -> AsyncIterator[str]:
+    limit = request.max_results
+    if not request.query.strip():
+        yield _sse("done", {"path": SEARCH_PATH_LLM, "ids": []})
+        return
+
+    try:
+        catalog = get_catalog(settings.db_path)
+        candidates = catalog.retriever.top_k(request.query, settings.ai_candidate_count)
+        candidate_drugs = [drug for drug, _ in candidates]
+    except Exception as e:
+        logger.error(f"Error in streaming search: {str(e)}")
+        yield _sse("error", {"detail": f"Search error: {str(e)}"})
+        return
+
+    yield _sse("local", [result.model_dump() for result in _local_matches(candidates)[:limit]])
+
+    cache = get_answer_cache()
+    cache_key = answer_cache_key(request.query, catalog.generation, settings.openai_model)
+    matches = cache.get(cache_key)
+    if matches is not None:
+        results = _reconcile_matches(matches, catalog)[:limit]
+        for result in results:
+            yield _sse("match", result.model_dump())
+        yield _sse("done", {"path": SEARCH_PATH_CACHE, "ids": [r.id for r in results]})
+        return
+
+    if not _breaker.allow():
+        yield _sse("done", {"path": SEARCH_PATH_FALLBACK, "ids": []})
+        return
+
+    parser = JsonArrayStream()
+    matches = []
+    sent_ids: set[int] = set()
+    try:
+        # A client disconnect closes this generator inside the guard
+        with _breaker.guard():
+            async for piece in _stream_completion(request.query, candidate_drugs):
+                for match in parser.feed(piece):
+                    matches.append(match)
+                    for result in _reconcile_matches([match], catalog):
+                        if result.id in sent_ids or (limit is not None and len(sent_ids) >= limit):
+                            continue
+                        sent_ids.add(result.id)
+                        yield _sse("match", result.model_dump())
+    except (TimeoutError, OpenAIError) as e:
+        logger.warning(f"Streaming LLM search failed ({type(e).__name__}), local matches only")
+        yield _sse("done", {"path": SEARCH_PATH_FALLBACK, "ids": []})
+        return
+
+    if parser.complete:
+        cache.set(cache_key, matches)
+    results = _reconcile_matches(matches, catalog)[:limit]
+    yield _sse("done", {"path": SEARCH_PATH_LLM, "ids": [r.id for r in results]})
+
+
+async def _stream_completion(
+    query: str, candidate_drugs: list[dict[str, Any]]
+) -> AsyncIterator[str]:
+    """Yield completion text as it arrives, within the search latency budget."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.ai_search_budget_ms / 1000
+    client = get_openai_client()
+
+    stream = await asyncio.wait_for(
+        client.chat.completions.create(
+            model=settings.openai_model,
+            messages=_build_messages(query, candidate_drugs),
+            max_tokens=500,
+            temperature=0.1,
+            stream=True,
+        ),
+        timeout=settings.ai_search_budget_ms / 1000,
+    )
+    try:
+        chunks = stream.__aiter__()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+            except StopAsyncIteration:
+                return
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+
+async def _search_matches(query: str) -> tuple[list[DrugMatchResult], str]:
+    """Return the matches and which path served them: cache, llm or fallback."""
+    # Send only the most plausible drugs for this query to the model
+    catalog = get_catalog(settings.db_path)
+    candidates = catalog.retriever.top_k(query, settings.ai_candidate_count)
+    candidate_drugs = [drug for drug, _ in candidates]
+
+    # Parsed answers are cached per (query, catalog generation, model)
+    cache = get_answer_cache()
+    cache_key = answer_cache_key(query, catalog.generation, settings.openai_model)
+    matches = cache.get(cache_key)
+    if matches is not None:
+        return _reconcile_matches(matches, catalog), SEARCH_PATH_CACHE
+
+    if not _breaker.allow():
+        logger.warning("LLM circuit open, serving local matches")
+        return _local_matches(candidates), SEARCH_PATH_FALLBACK
+
+    hedge_delay_s = (
+        settings.ai_hedge_delay_ms / 1000 if settings.ai_hedge_delay_ms is not None else None
+    )
+    # A batched completion records its outcome once for all the queries it serves
+    guard: AbstractContextManager[None] = (
+        nullcontext() if settings.ai_batch_window_ms > 0 else _breaker.guard()
+    )
+    try:
+        with guard:
+            matches = await asyncio.wait_for(
+                hedged(lambda: _complete(query, candidate_drugs), hedge_delay_s),
+                timeout=settings.ai_search_budget_ms / 1000,
+            )
+    except (TimeoutError, OpenAIError) as e:
+        logger.warning(f"LLM search failed ({type(e).__name__}), serving local matches")
+        return _local_matches(candidates), SEARCH_PATH_FALLBACK
+
+    if matches is None:
+        matches = []
+    else:
+        cache.set(cache_key, matches)
+
+    return _reconcile_matches(matches, catalog), SEARCH_PATH_LLM
+
+
+def _complete(
+    query: str, candidate_drugs: list[dict[str, Any]]
+) -> Awaitable[list[dict[str, Any]] | None]:
+    # Optionally share one completion with other queries arriving in the same window
+    if settings.ai_batch_window_ms > 0:
+        return _batcher.submit((query, candidate_drugs))
+    return _complete_matches(query, candidate_drugs)
+
+
+def _local_matches(candidates: list[tuple[dict[str, Any], float]]) -> list[DrugMatchResult]:
+    """Rank the locally retrieved candidates when the LLM is unavailable."""
+    return [
+        DrugMatchResult(**drug, match_confidence=round(score, 2), match_reason="Local match")
+        for drug, score in candidates
+        if score >= MIN_SCORE
+    ]
+
+
+def _format_drug_list(candidate_drugs: list[dict[str, Any]]) -> list[str]:
+    # Create drug list for OpenAI analysis
+    drug_list = []
+    for drug in candidate_drugs:
+        drug_info = f"{drug['name']}"
+        if drug["generic_name"] and drug["generic_name"] != drug["name"]:
+            drug_info += f" ({drug['generic_name']})"
+        if drug["brand_name"]:
+            drug_info += f" - {drug['brand_name']}"
+        if drug_info not in drug_list:
             drug_list.append(drug_info)
+    return drug_list
+
 
-        drug_names = "\\n".join(drug_list)
+def _build_prompt(query: str, candidate_drugs: list[dict[str, Any]]) -> str:
+    drug_names = "\n".join(_format_drug_list(candidate_drugs))
 
-        # Create OpenAI prompt for intelligent matching
-        prompt = f"""You are a pharmaceutical expert. Given this user query: "{request.query}"
+    # Create OpenAI prompt for intelligent matching
+    return f"""You are a pharmaceutical expert. Given this user query: "{query}"
 
 Find the best matching medications from this formulary list:
 {drug_names}
@@ -102,63 +318,143 @@ Handle common issues:
 
 Only include matches with confidence >= 0.5. Return empty array if no good matches."""
 
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+
+def _build_messages(
+    query: str, candidate_drugs: list[dict[str, Any]]
+) -> list[ChatCompletionMessageParam]:
+    return [
+        {
+            "role": "system",
+            "content": "You are a pharmaceutical expert. Return only valid JSON arrays.",
+        },
+        {"role": "user", "content": _build_prompt(query, candidate_drugs)},
+    ]
+
+
+async def _complete_matches(
+    query: str, candidate_drugs: list[dict[str, Any]]
+) -> list[dict[str, Any]] | None:
+    """Ask the model for matches; returns None if the reply is not valid JSON."""
+    client = get_openai_client()
+
+    # Call OpenAI API
+    response = await client.chat.completions.create(
+        model=settings.openai_model,
+        messages=_build_messages(query, candidate_drugs),
+        max_tokens=500,
+        temperature=0.1,
+    )
+
+    ai_response = (response.choices[0].message.content or "").strip()
+
+    # Parse OpenAI response
+    try:
+        matches: list[dict[str, Any]] = json.loads(ai_response)
+        return matches
+    except json.JSONDecodeError:
+        logger.error(f"Failed to parse OpenAI response: {ai_response}")
+        return None
+
+
+def _build_batch_prompt(items: list[tuple[str, list[dict[str, Any]]]]) -> str:
+    sections = []
+    for index, (query, candidate_drugs) in enumerate(items):
+        drug_names = "\n".join(f"- {line}" for line in _format_drug_list(candidate_drugs))
+        sections.append(f'Query {index}: "{query}"\nCandidates:\n{drug_names}')
+    queries = "\n\n".join(sections)
+
+    return f"""You are a pharmaceutical expert. For each numbered user query below, find the
+best matching medications from that query's own candidate list.
+
+{queries}
+
+Return a JSON object mapping each query number to an array of its top 5 matches:
+{{
+  "0": [{{"medication_name": "Exact name from list", "confidence": 0.95, "reason": "Exact match"}}],
+  "1": []
+}}
+
+Handle misspellings, brand/generic names, abbreviations and partial names.
+Only include matches with confidence >= 0.5. Use an empty array if a query has no good matches."""
+
+
+async def _complete_batch(
+    items: list[tuple[str, list[dict[str, Any]]]],
+) -> list[list[dict[str, Any]] | None]:
+    """Resolve several queries with one structured completion.
+
+    Returns one entry per item, None where the reply had no usable answer.
+    The upstream call's outcome is recorded once, however many queries it serves.
+    """
+    with _breaker.guard():
+        if len(items) == 1:
+            return [await _complete_matches(*items[0])]
+
+        client = get_openai_client()
+        response = await client.chat.completions.create(
+            model=settings.openai_model,
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a pharmaceutical expert. Return only valid JSON arrays.",
+                    "content": "You are a pharmaceutical expert. Return only valid JSON objects.",
                 },
-                {"role": "user", "content": prompt},
+                {"role": "user", "content": _build_batch_prompt(items)},
             ],
-            max_tokens=500,
+            max_tokens=min(300 * len(items), 4000),
             temperature=0.1,
+            response_format={"type": "json_object"},
         )
 
-        ai_response = response.choices[0].message.content.strip()
-
-        # Parse OpenAI response
-        import json
-
-        try:
-            matches = json.loads(ai_response)
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse OpenAI response: {ai_response}")
-            matches = []
-
-        # Match AI suggestions to actual database records
-        results = []
-        for match in matches:
-            medication_name = match.get("medication_name", "").lower()
-            confidence = float(match.get("confidence", 0.0))
-            reason = match.get("reason", "AI suggested match")
-
-            # Find matching drugs in database
-            for drug_row in all_drugs:
-                if (
-                    drug_row["name"].lower() in medication_name
-                    or medication_name in drug_row["name"].lower()
-                ):
-                    result = DrugMatchResult(
-                        **dict(drug_row), match_confidence=confidence, match_reason=reason
-                    )
-                    results.append(result)
-                    break
-
-        # Remove duplicates and sort by confidence
-        seen_ids = set()
-        unique_results = []
-        for result in sorted(results, key=lambda x: x.match_confidence, reverse=True):
-            if result.id not in seen_ids:
-                unique_results.append(result)
-                seen_ids.add(result.id)
-
-        return unique_results[: request.max_results]
+    ai_response = (response.choices[0].message.content or "").strip()
+    try:
+        answers = json.loads(ai_response)
+    except json.JSONDecodeError:
+        logger.error(f"Failed to parse batched OpenAI response: {ai_response}")
+        return [None] * len(items)
 
-    except Exception as e:
-        logger.error(f"Error in intelligent search: {str(e)}")
-        if "openai" in str(e).lower() or "api" in str(e).lower():
-            raise HTTPException(status_code=503, detail=f"OpenAI service error: {str(e)}")
-        else:
-            raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+    if not isinstance(answers, dict):
+        return [None] * len(items)
+    return [
+        answers.get(str(index)) if isinstance(answers.get(str(index)), list) else None
+        for index in range(len(items))
+    ]
+
+
+def _match_confidence(value: object) -> float | None:
+    """A suggestion's confidence clamped to [0, 1], or None if it is not a number."""
+    if isinstance(value, bool) or not isinstance(value, int | float | str):
+        return None
+    try:
+        confidence = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(confidence):
+        return None
+    return min(max(confidence, 0.0), 1.0)
+
+
+def _reconcile_matches(
+    matches: list[dict[str, Any]], catalog: DrugCatalog
+) -> list[DrugMatchResult]:
+    """Map AI suggestions to catalog rows through the per-generation name index."""
+    best: dict[int, tuple[float, int, dict[str, Any], str]] = {}
+    for order, match in enumerate(matches):
+        if not isinstance(match, dict):
+            continue
+        medication_name = str(match.get("medication_name", ""))
+        confidence = _match_confidence(match.get("confidence", 0.0))
+        if confidence is None:
+            continue
+        reason = str(match.get("reason") or "AI suggested match")
+
+        # Every strength variant of the suggested drug, best first
+        for drug_row, score in catalog.name_index.resolve(medication_name, confidence):
+            current = best.get(drug_row["id"])
+            if current is None or score > current[0]:
+                best[drug_row["id"]] = (score, order, drug_row, reason)
+
+    ranked = sorted(best.values(), key=lambda item: (-item[0], item[1]))
+    return [
+        DrugMatchResult(**drug_row, match_confidence=round(score, 4), match_reason=reason)
+        for score, _, drug_row, reason in ranked
+    ]
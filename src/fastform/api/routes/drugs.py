@@ -1,8 +1,13 @@
+import asyncio
 import sqlite3
+from typing import Any, Literal
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 
+from fastform.catalog import get_catalog
+from fastform.db import connect
+from fastform.search.vector import VectorSearchUnavailable
 from fastform.settings import settings
 
 router = APIRouter()
@@ -12,6 +17,8 @@ class DrugSearchRequest(BaseModel):
     query: str
     limit: int = 50
     formulary_id: int | None = None
+    # "text": SQL LIKE matching; "vector": offline n-gram similarity (typo tolerant)
+    mode: Literal["text", "vector"] = "text"
 
 
 class DrugItem(BaseModel):
@@ -28,6 +35,24 @@ class DrugItem(BaseModel):
     step_therapy: bool = False
     formulary_name: str | None = None
     insurer: str | None = None
+    # Catalog drug (drugs.id) for /{drug_id}/alternatives; ``id`` is the drug_rules row
+    drug_id: int | None = None
+
+
+class DrugAlternative(BaseModel):
+    id: int
+    name: str
+    generic_name: str | None = None
+    brand_name: str | None = None
+    strength: str | None = None
+    dosage_form: str | None = None
+    route: str | None = None
+    drug_class: str | None = None
+    formulary_tier: int | None = None
+    prior_authorization: bool = False
+    quantity_limit: bool = False
+    step_therapy: bool = False
+    equivalence: str  # 'generic' (same ingredient and route) or 'class'
 
 
 @router.post("/search", response_model=list[DrugItem])
@@ -38,15 +63,18 @@ async def search_drugs(request: DrugSearchRequest):
     if not request.query.strip():
         return []
 
-    try:
-        conn = sqlite3.connect(settings.db_path)
+    if request.mode == "vector":
+        # Building the index on first use takes seconds; keep the event loop free
+        return await asyncio.to_thread(_vector_search, request)
 
+    try:
         # Clean search query
         clean_query = " ".join(request.query.lower().strip().split())
 
-        # Query the drug_rules table (current schema)
+        # Query the drug_rules table (current schema). Rows are unique by
+        # canonical NDC, so matches need no deduplication.
         search_query = """
-            SELECT DISTINCT
+            SELECT
                 id,
                 name,
                 generic_name,
@@ -100,8 +128,9 @@ async def search_drugs(request: DrugSearchRequest):
             request.limit,
         ]
 
-        cursor = conn.execute(search_query, params)
-        rows = cursor.fetchall()
+        with connect(settings.db_path) as conn:
+            rows = conn.execute(search_query, params).fetchall()
+            drug_ids = _catalog_drug_ids(conn, [row[4] for row in rows])
 
         results = []
         for row in rows:
@@ -120,11 +149,211 @@ async def search_drugs(request: DrugSearchRequest):
                     step_therapy=bool(row[10]),
                     formulary_name=row[11],
                     insurer=row[12],
+                    drug_id=drug_ids.get(row[4]),
                 )
             )
 
-        conn.close()
         return results
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
+
+
+def _catalog_drug_ids(conn: sqlite3.Connection, ndcs: list[str | None]) -> dict[str, int]:
+    """Map drug_rules NDCs to catalog drug ids, directly or through NDC aliases."""
+    drug_ids: dict[str, int] = {}
+    lookups = (
+        "SELECT ndc, id FROM drugs WHERE ndc IN ({})",
+        "SELECT alias, drug_id FROM drug_aliases WHERE alias_type = 'ndc' AND alias IN ({})",
+    )
+    for lookup in lookups:
+        wanted = list({ndc for ndc in ndcs if ndc and ndc not in drug_ids})
+        if not wanted:
+            break
+        try:
+            rows = conn.execute(lookup.format(", ".join("?" * len(wanted))), wanted).fetchall()
+        except sqlite3.OperationalError:
+            # Database without the drug catalog (or without aliases yet)
+            break
+        for ndc, drug_id in rows:
+            drug_ids.setdefault(ndc, drug_id)
+    return drug_ids
+
+
+# Labels of the drug_rules catalog, the Medicare baseline formulary
+BASELINE_FORMULARY_NAME = "Medicare Part D"
+BASELINE_INSURER = "CMS"
+
+FORMULARY_COVERAGE_BY_NDC = """
+    SELECT d.ndc, fc.drug_id, fc.formulary_tier, fc.prior_authorization,
+           fc.quantity_limit, fc.step_therapy
+    FROM formulary_coverage fc
+    JOIN drugs d ON d.id = fc.drug_id
+    WHERE fc.formulary_id = :formulary_id AND fc.is_covered = 1
+    UNION ALL
+    SELECT a.alias, fc.drug_id, fc.formulary_tier, fc.prior_authorization,
+           fc.quantity_limit, fc.step_therapy
+    FROM formulary_coverage fc
+    JOIN drug_aliases a ON a.drug_id = fc.drug_id AND a.alias_type = 'ndc'
+    WHERE fc.formulary_id = :formulary_id AND fc.is_covered = 1
+"""
+
+
+def _vector_search(request: DrugSearchRequest) -> list[DrugItem]:
+    """Vector search over the catalog, limited to drugs the formulary covers if one is given.
+
+    Blocking (it may build the index), so run it in a worker thread.
+    """
+    coverage: dict[str, list[Any]] = {}
+    try:
+        catalog = get_catalog(settings.db_path)
+        index = catalog.vector_index
+        with connect(settings.db_path) as conn:
+            if request.formulary_id is None:
+                formulary_name, insurer = BASELINE_FORMULARY_NAME, BASELINE_INSURER
+                rows = None
+            else:
+                formulary = conn.execute(
+                    "SELECT plan_name, insurer FROM formularies WHERE id = ?",
+                    (request.formulary_id,),
+                ).fetchone()
+                if formulary is None:
+                    raise HTTPException(
+                        status_code=404, detail=f"Formulary {request.formulary_id} not found"
+                    )
+                formulary_name, insurer = formulary
+                for ndc, *values in conn.execute(
+                    FORMULARY_COVERAGE_BY_NDC, {"formulary_id": request.formulary_id}
+                ):
+                    coverage.setdefault(ndc, values)
+                rows = [i for i, drug in enumerate(catalog.drugs) if drug["ndc"] in coverage]
+
+            hits = index.search(request.query, request.limit, rows=rows)
+            drugs = [catalog.drugs[i] for i, _ in hits]
+            drug_ids = (
+                _catalog_drug_ids(conn, [drug["ndc"] for drug in drugs])
+                if request.formulary_id is None
+                else {}
+            )
+    except HTTPException:
+        raise
+    except VectorSearchUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
+
+    results = []
+    for drug in drugs:
+        strength = None
+        if drug["strength_qty"] is not None and drug["strength_unit"] is not None:
+            strength = f"{drug['strength_qty']}{drug['strength_unit']}"
+        elif drug["strength_qty"] is not None:
+            strength = str(drug["strength_qty"])
+        else:
+            strength = drug["strength_unit"]
+        if drug["ndc"] in coverage:
+            # The requested formulary's terms, not the baseline's
+            drug_id, tier, prior_authorization, quantity_limit, step_therapy = coverage[drug["ndc"]]
+        else:
+            drug_id = drug_ids.get(drug["ndc"])
+            tier = drug["formulary_tier"]
+            prior_authorization = drug["prior_authorization"]
+            quantity_limit = drug["quantity_limit"]
+            step_therapy = drug["step_therapy"]
+        results.append(
+            DrugItem(
+                id=drug["id"],
+                name=drug["name"],
+                generic_name=drug["generic_name"],
+                brand_name=drug["brand_name"],
+                ndc=drug["ndc"],
+                strength=strength,
+                dosage_form=drug["dosage_form"],
+                formulary_tier=tier,
+                prior_authorization=bool(prior_authorization),
+                quantity_limit=bool(quantity_limit),
+                step_therapy=bool(step_therapy),
+                formulary_name=formulary_name,
+                insurer=insurer,
+                drug_id=drug_id,
+            )
+        )
+    return results
+
+
+@router.get("/{drug_id}/alternatives", response_model=list[DrugAlternative])
+async def get_drug_alternatives(
+    drug_id: int,
+    formulary_id: int = Query(..., description="Formulary to find covered alternatives in"),
+) -> list[DrugAlternative]:
+    """
+    Get the cheapest covered equivalents of a drug within a formulary.
+
+    Reads the equivalence groups precomputed at ingest, so this is a keyed
+    lookup rather than a self-join over the catalog.
+    """
+    try:
+        query = """
+            SELECT
+                d.id,
+                d.name,
+                d.generic_name,
+                d.brand_name,
+                CASE
+                    WHEN d.strength_qty IS NOT NULL AND d.strength_unit IS NOT NULL
+                    THEN CAST(d.strength_qty AS TEXT) || d.strength_unit
+                    WHEN d.strength_qty IS NOT NULL
+                    THEN CAST(d.strength_qty AS TEXT)
+                    ELSE d.strength_unit
+                END as strength,
+                d.dosage_form,
+                d.route,
+                d.drug_class,
+                b.formulary_tier,
+                b.prior_authorization,
+                b.quantity_limit,
+                b.step_therapy,
+                e.group_type
+            FROM drug_equivalence e
+            JOIN equivalence_best b
+                ON b.group_key = e.group_key AND b.formulary_id = ?
+            JOIN drugs d ON d.id = b.drug_id
+            WHERE e.drug_id = ? AND b.drug_id != ?
+            ORDER BY CASE e.group_type WHEN 'generic' THEN 0 ELSE 1 END, b.rank
+        """
+
+        with connect(settings.db_path) as conn:
+            if not conn.execute("SELECT 1 FROM drugs WHERE id = ?", (drug_id,)).fetchone():
+                raise HTTPException(status_code=404, detail=f"Drug {drug_id} not found")
+            rows = conn.execute(query, (formulary_id, drug_id, drug_id)).fetchall()
+
+        alternatives = []
+        seen_ids = set()
+        for row in rows:
+            if row[0] in seen_ids:
+                continue
+            seen_ids.add(row[0])
+            alternatives.append(
+                DrugAlternative(
+                    id=row[0],
+                    name=row[1],
+                    generic_name=row[2],
+                    brand_name=row[3],
+                    strength=row[4],
+                    dosage_form=row[5],
+                    route=row[6],
+                    drug_class=row[7],
+                    formulary_tier=row[8],
+                    prior_authorization=bool(row[9]),
+                    quantity_limit=bool(row[10]),
+                    step_therapy=bool(row[11]),
+                    equivalence=row[12],
+                )
+            )
+
+        return alternatives
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
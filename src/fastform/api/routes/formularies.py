@@ -3,11 +3,15 @@ Formularies API routes for FastForm.
 """
 
 import sqlite3
+from typing import Any
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
 
+from ...archive import read_coverage_history
+from ...db import connect, data_generation
 from ...settings import Settings
+from ..response_cache import response_cache
 
 router = APIRouter()
 settings = Settings()
@@ -25,6 +29,38 @@ class FormularyInfo(BaseModel):
     coverage_count: int  # Number of drugs covered
 
 
+class FormularyUpdateRecord(BaseModel):
+    """One recorded sync of a formulary from its source."""
+
+    id: int
+    update_type: str | None = None
+    status: str | None = None
+    drugs_added: int = 0
+    drugs_modified: int = 0
+    drugs_removed: int = 0
+    rows_parsed: int | None = None
+    bytes_fetched: int | None = None
+    fetch_ms: float | None = None
+    parse_ms: float | None = None
+    apply_ms: float | None = None
+    error_message: str | None = None
+    started_at: str | None = None
+    completed_at: str | None = None
+
+
+class CoverageHistoryEntry(BaseModel):
+    """Coverage values a formulary had for a drug until they were superseded."""
+
+    drug_id: int
+    is_covered: bool | None = None
+    formulary_tier: int | None = None
+    prior_authorization: bool | None = None
+    quantity_limit: bool | None = None
+    step_therapy: bool | None = None
+    valid_from: str | None = None
+    valid_to: str | None = None
+
+
 class FormularyStats(BaseModel):
     """Formulary statistics model."""
 
@@ -36,6 +72,7 @@ class FormularyStats(BaseModel):
 
 @router.get("/", response_model=list[FormularyInfo])
 async def get_formularies(
+    request: Request,
     active_only: bool = Query(True, description="Only return active formularies"),
     insurer: str | None = Query(None, description="Filter by insurer name"),
 ):
@@ -43,68 +80,73 @@ async def get_formularies(
     Get list of available formularies for dropdown selection.
 
     Returns formulary options that users can select to search
-    against specific insurance coverage.
+    against specific insurance coverage. The encoded response is cached
+    per data generation.
     """
     try:
-        conn = sqlite3.connect(settings.db_path)
-
-        # Build query with optional filters
-        where_clauses = []
-        params = []
-
-        if active_only:
-            where_clauses.append("f.is_active = 1")
-
-        if insurer:
-            where_clauses.append("LOWER(f.insurer) LIKE LOWER(?)")
-            params.append(f"%{insurer}%")
-
-        where_clause = ""
-        if where_clauses:
-            where_clause = "WHERE " + " AND ".join(where_clauses)
+        key = ("formularies", active_only, insurer, data_generation(settings.db_path))
+        return response_cache.respond(request, key, lambda: _load_formularies(active_only, insurer))
 
-        query = f"""
-            SELECT 
-                f.id,
-                f.plan_name,
-                f.insurer,
-                
-                f.update_frequency,
-                f.last_updated,
-                f.is_active,
-                COUNT(fc.drug_id) as coverage_count
-            FROM formularies f
-            LEFT JOIN formulary_coverage fc ON f.id = fc.formulary_id
-            {where_clause}
-            GROUP BY f.id, f.plan_name, f.insurer,  
-                     f.update_frequency, f.last_updated, f.is_active
-            ORDER BY f.insurer, f.plan_name
-        """
-
-        cursor = conn.execute(query, params)
-        formularies = []
-
-        for row in cursor.fetchall():
-            formulary = FormularyInfo(
-                id=row[0],
-                plan_name=row[1],
-                insurer=row[2],
-                update_frequency=row[3],
-                last_updated=row[4],
-                is_active=bool(row[5]),
-                coverage_count=row[6],
-            )
-            formularies.append(formulary)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
+
+
+def _load_formularies(active_only: bool, insurer: str | None) -> list[dict[str, Any]]:
+    # Build query with optional filters
+    where_clauses = []
+    params = []
+
+    if active_only:
+        where_clauses.append("f.is_active = 1")
+
+    if insurer:
+        where_clauses.append("LOWER(f.insurer) LIKE LOWER(?)")
+        params.append(f"%{insurer}%")
+
+    where_clause = ""
+    if where_clauses:
+        where_clause = "WHERE " + " AND ".join(where_clauses)
+
+    query = f"""
+        SELECT 
+            f.id,
+            f.plan_name,
+            f.insurer,
+            
+            f.update_frequency,
+            f.last_updated,
+            f.is_active,
+            COUNT(fc.drug_id) as coverage_count
+        FROM formularies f
+        LEFT JOIN formulary_coverage fc ON f.id = fc.formulary_id
+        {where_clause}
+        GROUP BY f.id, f.plan_name, f.insurer,  
+                 f.update_frequency, f.last_updated, f.is_active
+        ORDER BY f.insurer, f.plan_name
+    """
 
-        conn.close()
-        return formularies
+    with connect(settings.db_path) as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    formularies = []
+    for row in rows:
+        formularies.append(
+            {
+                "id": row[0],
+                "plan_name": row[1],
+                "insurer": row[2],
+                "update_frequency": row[3],
+                "last_updated": row[4],
+                "is_active": bool(row[5]),
+                "coverage_count": row[6],
+            }
+        )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return formularies
 
 
 @router.get("/stats", response_model=FormularyStats)
-async def get_formulary_stats():
+async def get_formulary_stats(request: Request):
     """
     Get overall formulary system statistics.
 
@@ -112,8 +154,15 @@ async def get_formulary_stats():
     including counts of formularies, drugs, and coverage rules.
     """
     try:
-        conn = sqlite3.connect(settings.db_path)
+        key = ("stats", data_generation(settings.db_path))
+        return response_cache.respond(request, key, _load_formulary_stats)
 
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
+
+
+def _load_formulary_stats() -> dict[str, Any]:
+    with connect(settings.db_path) as conn:
         # Get formulary counts
         cursor = conn.execute("SELECT COUNT(*) FROM formularies")
         total_formularies = cursor.fetchone()[0]
@@ -129,17 +178,12 @@ async def get_formulary_stats():
         cursor = conn.execute("SELECT COUNT(*) FROM formulary_coverage")
         total_coverage_rules = cursor.fetchone()[0]
 
-        conn.close()
-
-        return FormularyStats(
-            total_formularies=total_formularies,
-            active_formularies=active_formularies,
-            total_drugs=total_drugs,
-            total_coverage_rules=total_coverage_rules,
-        )
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return {
+        "total_formularies": total_formularies,
+        "active_formularies": active_formularies,
+        "total_drugs": total_drugs,
+        "total_coverage_rules": total_coverage_rules,
+    }
 
 
 @router.get("/{formulary_id}", response_model=FormularyInfo)
@@ -151,8 +195,6 @@ async def get_formulary_details(formulary_id: int):
     including coverage statistics and metadata.
     """
     try:
-        conn = sqlite3.connect(settings.db_path)
-
         query = """
             SELECT 
                 f.id,
@@ -170,11 +212,10 @@ async def get_formulary_details(formulary_id: int):
                      f.update_frequency, f.last_updated, f.is_active
         """
 
-        cursor = conn.execute(query, (formulary_id,))
-        row = cursor.fetchone()
+        with connect(settings.db_path) as conn:
+            row = conn.execute(query, (formulary_id,)).fetchone()
 
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail=f"Formulary {formulary_id} not found")
 
         formulary = FormularyInfo(
@@ -187,10 +228,80 @@ async def get_formulary_details(formulary_id: int):
             coverage_count=row[6],
         )
 
-        conn.close()
         return formulary
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
+@router.get("/{formulary_id}/updates", response_model=list[FormularyUpdateRecord])
+async def get_formulary_updates(
+    formulary_id: int,
+    limit: int = Query(50, ge=1, le=1000, description="Most recent runs to return"),
+) -> list[FormularyUpdateRecord]:
+    """
+    Get the update history of a formulary, most recent first.
+
+    Each run records its outcome, change counts, payload size and
+    fetch/parse/apply timings, for tracking ingest speed and stale plans.
+    """
+    try:
+        with connect(settings.db_path) as conn:
+            if not conn.execute(
+                "SELECT 1 FROM formularies WHERE id = ?", (formulary_id,)
+            ).fetchone():
+                raise HTTPException(status_code=404, detail=f"Formulary {formulary_id} not found")
+
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"""
+                SELECT {", ".join(FormularyUpdateRecord.model_fields)}
+                FROM formulary_updates
+                WHERE formulary_id = ?
+                ORDER BY started_at DESC, id DESC
+                LIMIT ?
+            """,
+                (formulary_id, limit),
+            ).fetchall()
+
+        return [FormularyUpdateRecord(**dict(row)) for row in rows]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
+
+
+@router.get("/{formulary_id}/coverage/history", response_model=list[CoverageHistoryEntry])
+async def get_coverage_history(
+    formulary_id: int,
+    drug_id: int | None = Query(None, description="Only this drug's history"),
+    since: str | None = Query(
+        None, description="Only values superseded at or after this time (YYYY-MM-DD[ HH:MM:SS])"
+    ),
+    limit: int = Query(100, ge=1, le=10000, description="Most recent entries to return"),
+) -> list[CoverageHistoryEntry]:
+    """
+    Get superseded coverage of a formulary, most recently superseded first.
+
+    Current coverage is not included. Old history lives in the compressed
+    archive database and is read from there transparently.
+    """
+    try:
+        with connect(settings.db_path) as conn:
+            if not conn.execute(
+                "SELECT 1 FROM formularies WHERE id = ?", (formulary_id,)
+            ).fetchone():
+                raise HTTPException(status_code=404, detail=f"Formulary {formulary_id} not found")
+
+            archive_path = settings.archive_db_path or f"{settings.db_path}.archive"
+            entries = read_coverage_history(conn, archive_path, formulary_id, drug_id, since)
+
+        return [CoverageHistoryEntry(**entry) for entry in entries[:limit]]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}") from e
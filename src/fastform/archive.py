@@ -0,0 +1,187 @@
+"""
+Archival tier for coverage history.
+
+Every change to a ``formulary_coverage`` row leaves its previous values in
+``coverage_history`` (see the triggers in ``fastform.schema``), so the coverage
+table only holds current data. History grows with every sync, though, and
+would come to dominate the database and its backups.
+
+``archive_coverage_history`` moves rows superseded more than N whole months ago
+into a separate archive database, as one zlib-compressed blob per
+(formulary, month superseded). ``read_coverage_history`` reads both tiers, so
+historical queries do not need to know where a row lives.
+
+Moving a period is one transaction across the main and the attached archive
+database. SQLite only commits that atomically in rollback-journal mode; in WAL
+mode a crash can leave rows in both tiers, and a rerun merges them into the
+existing blob without duplicating them.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from itertools import groupby
+from typing import Any
+
+from fastform.settings import settings
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = (
+    "drug_id",
+    "is_covered",
+    "formulary_tier",
+    "prior_authorization",
+    "quantity_limit",
+    "step_therapy",
+    "valid_from",
+    "valid_to",
+)
+COMPRESSION_LEVEL = 9
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {schema}.coverage_archive (
+        formulary_id INTEGER NOT NULL,
+        period TEXT NOT NULL, -- 'YYYY-MM' the rows were superseded in
+        row_count INTEGER NOT NULL,
+        data BLOB NOT NULL, -- zlib-compressed JSON list of HISTORY_COLUMNS rows
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (formulary_id, period)
+    ) WITHOUT ROWID
+"""
+
+
+def encode_rows(rows: list[tuple[Any, ...]]) -> bytes:
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+
+
+def decode_rows(data: bytes) -> list[tuple[Any, ...]]:
+    return [tuple(row) for row in json.loads(zlib.decompress(data))]
+
+
+def archive_cutoff(conn: sqlite3.Connection, months: int, now: str = "now") -> str:
+    """Start of the month ``months`` before ``now``; history superseded earlier is archived."""
+    cutoff: str = conn.execute(
+        "SELECT datetime(?, 'start of month', ?)", (now, f"-{months} months")
+    ).fetchone()[0]
+    return cutoff
+
+
+def archive_coverage_history(
+    conn: sqlite3.Connection,
+    archive_path: str,
+    months: int | None = None,
+    now: str = "now",
+) -> int:
+    """Move history superseded before ``archive_cutoff`` into ``archive_path``.
+
+    Returns the number of rows moved. The archive database is created if missing.
+    """
+    months = settings.coverage_archive_months if months is None else months
+    cutoff = archive_cutoff(conn, months, now)
+
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    try:
+        conn.execute(ARCHIVE_SCHEMA.format(schema="archive"))
+        moved = periods = 0
+        with conn:
+            cursor = conn.execute(
+                f"""
+                SELECT formulary_id, strftime('%Y-%m', valid_to), {", ".join(HISTORY_COLUMNS)}
+                FROM coverage_history
+                WHERE valid_to < ?
+                ORDER BY formulary_id, valid_to, id
+            """,
+                (cutoff,),
+            )
+            for (formulary_id, period), group in groupby(cursor, key=lambda row: row[:2]):
+                rows = [row[2:] for row in group]
+                existing = conn.execute(
+                    """
+                    SELECT data FROM archive.coverage_archive
+                    WHERE formulary_id = ? AND period = ?
+                """,
+                    (formulary_id, period),
+                ).fetchone()
+                if existing:
+                    # Left over from an interrupted run: merge without duplicates
+                    archived = decode_rows(existing[0])
+                    seen = set(archived)
+                    rows = archived + [row for row in rows if row not in seen]
+                    rows.sort(key=lambda row: row[-1])
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO archive.coverage_archive (
+                        formulary_id, period, row_count, data
+                    )
+                    VALUES (?, ?, ?, ?)
+                """,
+                    (formulary_id, period, len(rows), encode_rows(rows)),
+                )
+                periods += 1
+
+            moved = conn.execute(
+                "DELETE FROM coverage_history WHERE valid_to < ?", (cutoff,)
+            ).rowcount
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+    logger.info(f"Archived {moved:,} coverage history rows in {periods} periods before {cutoff}")
+    return moved
+
+
+def read_coverage_history(
+    conn: sqlite3.Connection,
+    archive_path: str,
+    formulary_id: int,
+    drug_id: int | None = None,
+    since: str | None = None,
+) -> list[dict[str, Any]]:
+    """Superseded coverage of a formulary from both tiers, most recently superseded first.
+
+    ``since`` limits the result to values superseded at or after that time.
+    """
+    where = ["formulary_id = ?"]
+    params: list[Any] = [formulary_id]
+    if drug_id is not None:
+        where.append("drug_id = ?")
+        params.append(drug_id)
+    if since is not None:
+        where.append("valid_to >= ?")
+        params.append(since)
+    rows = set(
+        conn.execute(
+            f"""
+            SELECT {", ".join(HISTORY_COLUMNS)} FROM coverage_history
+            WHERE {" AND ".join(where)}
+        """,
+            params,
+        )
+    )
+
+    if os.path.exists(archive_path):
+        archive = sqlite3.connect(f"file:{archive_path}?mode=ro", uri=True)
+        try:
+            blobs = archive.execute(
+                """
+                SELECT data FROM coverage_archive
+                WHERE formulary_id = ? AND period >= ?
+            """,
+                (formulary_id, since[:7] if since else ""),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Archive file without the table: nothing archived yet
+            blobs = []
+        finally:
+            archive.close()
+        for (data,) in blobs:
+            rows.update(
+                row
+                for row in decode_rows(data)
+                if (drug_id is None or row[0] == drug_id) and (since is None or row[-1] >= since)
+            )
+
+    ordered = sorted(rows, key=lambda row: (row[-1], row[-2] or "", row[0]), reverse=True)
+    return [dict(zip(HISTORY_COLUMNS, row, strict=True)) for row in ordered]
@@ -0,0 +1,79 @@
+"""
+In-memory drug catalog snapshot.
+
+The catalog is loaded once per data generation and shared by every request.
+Derived search structures hang off the snapshot and are built lazily, so they
+are rebuilt exactly when the underlying data changes.
+"""
+
+import sqlite3
+import threading
+from functools import cached_property
+from typing import Any
+
+from fastform.db import Generation, connect, data_generation
+from fastform.search.name_index import NameIndex
+from fastform.search.retrieval import CandidateRetriever
+from fastform.search.vector import VectorIndex, load_or_build
+from fastform.settings import settings
+
+CATALOG_QUERY = """
+    SELECT id, name, dosage_form, strength_qty, strength_unit, route,
+           generic_name, brand_name, ndc, formulary_tier,
+           prior_authorization, quantity_limit, step_therapy
+    FROM drug_rules
+    ORDER BY formulary_tier, name
+"""
+
+
+class DrugCatalog:
+    """Immutable snapshot of ``drug_rules`` for one data generation."""
+
+    def __init__(self, db_path: str, generation: Generation, drugs: list[dict[str, Any]]):
+        self.db_path = db_path
+        self.generation = generation
+        self.drugs = tuple(drugs)
+
+    @cached_property
+    def retriever(self) -> CandidateRetriever:
+        return CandidateRetriever(self.drugs)
+
+    @cached_property
+    def name_index(self) -> NameIndex:
+        return NameIndex(self.drugs)
+
+    @cached_property
+    def vector_index(self) -> VectorIndex:
+        """Character n-gram TF-IDF index, memory-mapped from disk when already built."""
+        path = settings.vector_index_path or f"{self.db_path}.vectors"
+        return load_or_build(path, self.drugs, repr(self.generation))
+
+
+_catalogs: dict[str, DrugCatalog] = {}
+_lock = threading.Lock()
+
+
+def load_catalog(db_path: str, generation: Generation | None = None) -> DrugCatalog:
+    """Read the full catalog from the database."""
+    if generation is None:
+        generation = data_generation(db_path)
+
+    with connect(db_path) as conn:
+        conn.row_factory = sqlite3.Row
+        drugs = [dict(row) for row in conn.execute(CATALOG_QUERY)]
+    return DrugCatalog(db_path, generation, drugs)
+
+
+def get_catalog(db_path: str) -> DrugCatalog:
+    """Return the cached catalog, reloading it if the data generation changed."""
+    generation = data_generation(db_path)
+    catalog = _catalogs.get(db_path)
+    if catalog is not None and catalog.generation == generation:
+        return catalog
+
+    with _lock:
+        catalog = _catalogs.get(db_path)
+        if catalog is None or catalog.generation != generation:
+            catalog = load_catalog(db_path, generation)
+            _catalogs[db_path] = catalog
+    return catalog
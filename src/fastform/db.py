@@ -0,0 +1,352 @@
+"""
+Database file helpers shared by the API routes.
+
+Rebuilds never modify the file readers are using. Each build writes a new
+generation file next to the database (``fastform.db`` -> ``fastform.7.db``),
+and publishing it atomically renames a symlink ``fastform.db -> fastform.7.db``
+into place. Anything that opens ``fastform.db`` follows the link (SQLite keeps
+the journal next to the target), so a database that was never rebuilt this way
+is still just a plain file.
+
+Readers borrow connections from a per-database ``ConnectionPool``. A pool
+notices a new generation on the next checkout: idle connections to the old
+file are closed then, busy ones when they are returned, and once the grace
+period has passed retired generation files nobody holds are deleted.
+
+Writers serialize on an advisory lock file next to the database
+(``fastform.db.lock``, see ``WriterLock``). A generation build holds it from
+the copy until the publish, and in-place writers hold it while they write, so
+a build never publishes over changes made to the live file while it ran.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, suppress
+
+from fastform.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+Generation = tuple[tuple[int, int, int, bytes], ...]
+
+# Header fields SQLite changes on every commit: the file change counter of a
+# database, and the salt of a WAL file (new each time the WAL restarts)
+_CHANGE_COUNTER = (24, 4)
+_WAL_SALT = (16, 8)
+
+
+def data_generation(db_path: str) -> Generation:
+    """Identify the current contents of a SQLite database file.
+
+    Derived from the inode, modification time, size and change counter of the
+    database and its WAL file, so any committed write or file swap yields a new
+    value, even one that leaves the size alone within the mtime resolution.
+    Callers use it as part of cache keys for data that only changes between
+    ingests.
+    """
+    path = current_database(db_path)
+    parts = []
+    for part, (offset, length) in ((path, _CHANGE_COUNTER), (f"{path}-wal", _WAL_SALT)):
+        try:
+            with open(part, "rb") as f:
+                st = os.fstat(f.fileno())
+                f.seek(offset)
+                counter = f.read(length)
+        except FileNotFoundError:
+            parts.append((0, 0, 0, b""))
+            continue
+        parts.append((st.st_ino, st.st_mtime_ns, st.st_size, counter))
+    return tuple(parts)
+
+
+def current_database(db_path: str) -> str:
+    """The file ``db_path`` currently refers to (its generation file, if published)."""
+    return os.path.realpath(db_path)
+
+
+def generation_path(db_path: str, number: int) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.{number}{ext}"
+
+
+def _generation_pattern(db_path: str) -> re.Pattern[str]:
+    root, ext = os.path.splitext(os.path.basename(db_path))
+    return re.compile(rf"{re.escape(root)}\.(\d+){re.escape(ext)}")
+
+
+def list_generations(db_path: str) -> dict[int, str]:
+    """Generation files of ``db_path`` on disk, by number."""
+    directory = os.path.dirname(os.path.abspath(db_path))
+    pattern = _generation_pattern(db_path)
+    generations = {}
+    for name in os.listdir(directory):
+        match = pattern.fullmatch(name)
+        if match:
+            generations[int(match.group(1))] = os.path.join(directory, name)
+    return generations
+
+
+class WriterLock:
+    """Exclusive advisory lock for writing ``db_path`` or building a new generation.
+
+    Use as ``with WriterLock(db_path):``, or ``acquire(blocking=False)`` from
+    async code. Only writers that take the lock are serialized; the lock is
+    released when the process holding it exits.
+    """
+
+    def __init__(self, db_path: str):
+        self.path = f"{db_path}.lock"
+        self._fd: int | None = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Take the lock; without ``blocking``, return False if another writer holds it."""
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "WriterLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.release()
+
+
+def begin_generation(db_path: str, copy: bool = True) -> str:
+    """Reserve the next generation file for ``db_path`` and return its path.
+
+    The file starts as a copy of the current data, or empty if ``copy`` is
+    False or there is no database yet. It is invisible to readers until
+    ``publish_generation``. Hold the ``WriterLock`` of ``db_path`` from here
+    until the publish.
+    """
+    number = max(list_generations(db_path), default=0) + 1
+    while True:
+        path = generation_path(db_path, number)
+        try:
+            # Exclusive create, so concurrent builders never share a file
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            break
+        except FileExistsError:
+            number += 1
+
+    if copy and os.path.exists(db_path):
+        try:
+            copy_database(db_path, path)
+        except BaseException:
+            remove_database(path)
+            raise
+    return path
+
+
+def publish_generation(build_path: str, db_path: str) -> None:
+    """Sync a built generation file and atomically point ``db_path`` at it."""
+    _fsync(build_path)
+    if os.path.exists(db_path) and not os.path.islink(db_path):
+        # A plain database file being replaced for the first time: its -wal
+        # would otherwise linger, so it must leave WAL mode (checkpointing) first.
+        live = sqlite3.connect(db_path)
+        try:
+            mode = live.execute("PRAGMA journal_mode = DELETE").fetchone()[0]
+        finally:
+            live.close()
+        if mode != "delete":
+            raise RuntimeError(f"{db_path} is in use; new data left at {build_path}")
+
+    link_path = f"{db_path}.link-{os.getpid()}"
+    with suppress(FileNotFoundError):
+        os.remove(link_path)
+    os.symlink(os.path.basename(build_path), link_path)
+    os.replace(link_path, db_path)
+    _fsync(os.path.dirname(os.path.abspath(db_path)))
+    logger.info(f"Published {os.path.basename(build_path)} as {db_path}")
+
+    collect_generations(db_path)
+
+
+@contextmanager
+def new_generation(db_path: str, copy: bool = True) -> Iterator[str]:
+    """Yield the path of a new generation to build, then publish it.
+
+    If the body raises, the file is removed and readers never see it. Other
+    writers of ``db_path`` wait until the generation is published.
+    """
+    with WriterLock(db_path):
+        build_path = begin_generation(db_path, copy)
+        try:
+            yield build_path
+        except BaseException:
+            remove_database(build_path)
+            raise
+        publish_generation(build_path, db_path)
+
+
+def collect_generations(
+    db_path: str, grace_s: float | None = None, keep: frozenset[str] = frozenset()
+) -> list[str]:
+    """Delete generations older than the current one that were retired at least
+    ``grace_s`` ago. Paths in ``keep`` (still held by this process) are kept.
+    Open connections in other processes keep working on a deleted file."""
+    if not os.path.islink(db_path):
+        return []
+    grace_s = settings.db_generation_grace_s if grace_s is None else grace_s
+    generations = list_generations(db_path)
+    current = current_database(db_path)
+    current_number = next((n for n, path in generations.items() if path == current), None)
+    if current_number is None:
+        return []
+
+    removed = []
+    numbers = sorted(n for n in generations if n <= current_number)
+    now = time.time()
+    for number, successor in zip(numbers, numbers[1:], strict=False):
+        # A generation was retired when its successor, last written just
+        # before being published, went live
+        retired_at = os.stat(generations[successor]).st_mtime
+        path = generations[number]
+        if now - retired_at >= grace_s and path not in keep:
+            remove_database(path)
+            removed.append(path)
+    if removed:
+        logger.info(f"Removed {len(removed)} retired generations of {db_path}")
+    return removed
+
+
+def copy_database(db_path: str, target_path: str) -> None:
+    """Copy a live database to ``target_path`` with the backup API, in rollback-journal mode."""
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        # A copy of a WAL database is itself in WAL mode
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.close()
+
+
+def remove_database(path: str) -> None:
+    """Remove a database file and its journal files, if present."""
+    for stale in (path, f"{path}-journal", f"{path}-wal", f"{path}-shm"):
+        with suppress(FileNotFoundError):
+            os.remove(stale)
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ConnectionPool:
+    """Reusable read connections to the current generation of one database."""
+
+    def __init__(self, db_path: str, max_idle: int | None = None):
+        self.db_path = db_path
+        self.max_idle = settings.db_pool_size if max_idle is None else max_idle
+        self._path: str | None = None
+        self._idle: list[sqlite3.Connection] = []
+        self._in_use: Counter[str] = Counter()
+        self._gc_at: float | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        path = current_database(self.db_path)
+        stale: list[sqlite3.Connection] = []
+        with self._lock:
+            if path != self._path:
+                if self._path is not None:
+                    self._gc_at = time.monotonic() + settings.db_generation_grace_s
+                stale, self._idle, self._path = self._idle, [], path
+            conn = self._idle.pop() if self._idle else None
+            self._in_use[path] += 1
+            collect = self._gc_at is not None and time.monotonic() >= self._gc_at
+            if collect:
+                self._gc_at = None
+                keep = frozenset(p for p, count in self._in_use.items() if count)
+
+        for old in stale:
+            old.close()
+        if collect:
+            collect_generations(self.db_path, keep=keep)
+
+        try:
+            if conn is None:
+                # Opened on the generation file itself, so it stays on this generation
+                conn = sqlite3.connect(path, check_same_thread=False)
+            conn.row_factory = None
+            yield conn
+        finally:
+            keep_open = False
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._in_use[path] -= 1
+                if conn is not None and path == self._path and len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    keep_open = True
+            if conn is not None and not keep_open:
+                conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+
+def connect(db_path: str) -> AbstractContextManager[sqlite3.Connection]:
+    """Borrow a read connection to the current generation of ``db_path``.
+
+    Use as ``with connect(settings.db_path) as conn:``; the connection goes
+    back to the pool afterwards, so never close it.
+    """
+    return get_pool(db_path).connection()
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
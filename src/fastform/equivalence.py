@@ -0,0 +1,107 @@
+"""
+Therapeutic-equivalence groups for covered-alternative lookup.
+
+Drugs are grouped at ingest time by (generic_name, route) and by drug_class.
+For every (group, formulary) pair the best covered members are ranked once and
+stored, so the API can answer "what is the cheapest covered equivalent?" with
+a primary-key lookup instead of a self-join over the catalog.
+
+The tables are derived data: every bulk write of drugs or coverage (migration,
+CMS ingest, insurer syncs) rebuilds them once it has committed.
+"""
+
+import sqlite3
+
+# Members kept per (group, formulary); one extra so the queried drug itself can
+# be skipped without losing the runner-up.
+ALTERNATIVES_PER_GROUP = 3
+
+EQUIVALENCE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS drug_equivalence (
+        drug_id INTEGER NOT NULL,
+        group_key TEXT NOT NULL,
+        group_type TEXT NOT NULL, -- 'generic' or 'class'
+        PRIMARY KEY (drug_id, group_key)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS equivalence_best (
+        group_key TEXT NOT NULL,
+        formulary_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        drug_id INTEGER NOT NULL,
+        formulary_tier INTEGER,
+        prior_authorization BOOLEAN DEFAULT 0,
+        quantity_limit BOOLEAN DEFAULT 0,
+        step_therapy BOOLEAN DEFAULT 0,
+        PRIMARY KEY (group_key, formulary_id, rank)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def build_equivalence_groups(conn: sqlite3.Connection) -> int:
+    """Rebuild equivalence groups and the ranked best members per formulary.
+
+    Requires the multi-formulary schema (``drugs`` and ``formulary_coverage``).
+    Returns the number of (group, formulary, rank) entries written.
+    """
+    for statement in EQUIVALENCE_SCHEMA:
+        conn.execute(statement)
+
+    conn.execute("DELETE FROM drug_equivalence")
+    conn.execute("DELETE FROM equivalence_best")
+
+    # Same active ingredient and route of administration
+    conn.execute("""
+        INSERT OR IGNORE INTO drug_equivalence (drug_id, group_key, group_type)
+        SELECT id,
+               'generic:' || LOWER(TRIM(generic_name)) || '|' || LOWER(COALESCE(TRIM(route), '')),
+               'generic'
+        FROM drugs
+        WHERE generic_name IS NOT NULL AND TRIM(generic_name) != ''
+    """)
+
+    # Same therapeutic class
+    conn.execute("""
+        INSERT OR IGNORE INTO drug_equivalence (drug_id, group_key, group_type)
+        SELECT id, 'class:' || LOWER(TRIM(drug_class)), 'class'
+        FROM drugs
+        WHERE drug_class IS NOT NULL AND TRIM(drug_class) != ''
+    """)
+
+    # Cheapest first: lowest tier, then fewest restrictions
+    cursor = conn.execute(
+        """
+        INSERT INTO equivalence_best (
+            group_key, formulary_id, rank, drug_id, formulary_tier,
+            prior_authorization, quantity_limit, step_therapy
+        )
+        SELECT group_key, formulary_id, rank, drug_id, formulary_tier,
+               prior_authorization, quantity_limit, step_therapy
+        FROM (
+            SELECT
+                e.group_key,
+                fc.formulary_id,
+                fc.drug_id,
+                fc.formulary_tier,
+                fc.prior_authorization,
+                fc.quantity_limit,
+                fc.step_therapy,
+                ROW_NUMBER() OVER (
+                    PARTITION BY e.group_key, fc.formulary_id
+                    ORDER BY fc.formulary_tier, fc.prior_authorization,
+                             fc.step_therapy, fc.quantity_limit, fc.drug_id
+                ) AS rank
+            FROM drug_equivalence e
+            JOIN formulary_coverage fc ON fc.drug_id = e.drug_id
+            WHERE fc.is_covered = 1
+        )
+        WHERE rank <= ?
+    """,
+        (ALTERNATIVES_PER_GROUP,),
+    )
+
+    conn.commit()
+    return cursor.rowcount
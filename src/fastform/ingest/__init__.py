@@ -0,0 +1 @@
+"""Bulk loaders for external formulary data."""
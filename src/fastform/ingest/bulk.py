@@ -0,0 +1,88 @@
+"""
+Bulk-load mode for large ingests.
+
+A bulk load never writes to the live database. It copies the current database
+into a new generation file (see ``fastform.db``), turns journaling and fsyncs
+off there, drops the non-unique secondary indexes the loader does not need for
+lookups, and hands the connection to the loader. Afterwards the indexes are
+rebuilt in one pass each, ``ANALYZE`` refreshes the planner statistics, and the
+new generation is synced and published.
+
+With the journal off a crash mid-load can corrupt the new file, but never the
+live database; the unpublished file is simply discarded. Writes made to the
+live database while a bulk load runs would not be in the new generation, so
+the load holds the database's ``WriterLock`` throughout and other writers wait.
+"""
+
+import logging
+import sqlite3
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from fastform.db import WriterLock, begin_generation, publish_generation, remove_database
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 100_000
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",  # 256 MiB
+]
+
+
+@contextmanager
+def bulk_load(db_path: str, keep_indexes: tuple[str, ...] = ()) -> Iterator[sqlite3.Connection]:
+    """Yield a connection to a new generation of ``db_path`` tuned for loading.
+
+    Secondary indexes not named in ``keep_indexes`` are dropped for the load and
+    rebuilt before the generation is published. If the body raises, the new
+    file is removed and ``db_path`` is left untouched.
+    """
+    with WriterLock(db_path):
+        build_path = begin_generation(db_path)
+
+        conn = sqlite3.connect(build_path)
+        loaded = False
+        try:
+            for pragma in BULK_PRAGMAS:
+                conn.execute(pragma)
+            deferred = _drop_secondary_indexes(conn, keep_indexes)
+
+            yield conn
+
+            conn.commit()
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+            for name, sql in deferred:
+                # The loader may already have rebuilt some of them
+                if name not in existing:
+                    conn.execute(sql)
+            conn.execute("ANALYZE")
+            conn.commit()
+            conn.execute("PRAGMA journal_mode = DELETE")
+            loaded = True
+        finally:
+            conn.close()
+            if not loaded:
+                remove_database(build_path)
+
+        publish_generation(build_path, db_path)
+    logger.info(f"Bulk load complete; rebuilt {len(deferred)} deferred indexes")
+
+
+def _drop_secondary_indexes(
+    conn: sqlite3.Connection, keep_indexes: tuple[str, ...]
+) -> list[tuple[str, str]]:
+    # Unique indexes enforce natural keys during the load; those backing
+    # PRIMARY KEY/UNIQUE constraints have no SQL. Both are kept.
+    indexes = conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+    """).fetchall()
+    deferred = [(name, sql) for name, sql in indexes if name not in keep_indexes]
+    for name, _ in deferred:
+        conn.execute(f'DROP INDEX "{name}"')
+    conn.commit()
+    return deferred
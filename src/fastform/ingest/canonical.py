@@ -0,0 +1,191 @@
+"""
+Canonical natural keys for ingested rows.
+
+NDCs arrive in the three 10-digit labeler-product-package layouts (4-4-2,
+5-3-2, 5-4-1) and in the 11-digit 5-4-2 form CMS uses. Everything is keyed on
+the 11-digit form, so the same package matches no matter which source it
+came from.
+
+A package NDC is too fine a key for the catalog: one product ships in many
+packages, and sources without NDCs spell names, strengths and dosage forms
+differently. Every drug also gets a product key built from its normalized
+name, strength and dosage form (``"lipitor|20mg|tablet"``), or from its RxCUI
+when that is all a source provides. Rows whose key matches an existing drug
+are merged into it, and their NDC and spelling are kept in ``drug_aliases``.
+"""
+
+import re
+import sqlite3
+
+# Hyphenated segment lengths -> zero-padded 5-4-2 widths
+_NDC_WIDTHS = (5, 4, 2)
+_NDC_LAYOUTS = {(4, 4, 2), (5, 3, 2), (5, 4, 1), (5, 4, 2)}
+
+
+def canonical_ndc(ndc: str | None) -> str | None:
+    """Return the 11-digit form of ``ndc``, or None if it cannot be determined.
+
+    Unhyphenated 10-digit NDCs are ambiguous and return None.
+    """
+    if ndc is None:
+        return None
+    ndc = ndc.strip()
+
+    if "-" not in ndc:
+        return ndc if len(ndc) == 11 and ndc.isdigit() else None
+
+    segments = ndc.split("-")
+    if tuple(len(segment) for segment in segments) not in _NDC_LAYOUTS:
+        return None
+    if not all(segment.isdigit() for segment in segments):
+        return None
+    return "".join(
+        segment.zfill(width) for segment, width in zip(segments, _NDC_WIDTHS, strict=True)
+    )
+
+
+# Unit spellings -> canonical unit
+_UNITS = {
+    "mg": "mg",
+    "mgs": "mg",
+    "milligram": "mg",
+    "milligrams": "mg",
+    "mcg": "mcg",
+    "ug": "mcg",
+    "µg": "mcg",
+    "microgram": "mcg",
+    "micrograms": "mcg",
+    "g": "g",
+    "gm": "g",
+    "gram": "g",
+    "grams": "g",
+    "ml": "ml",
+    "milliliter": "ml",
+    "milliliters": "ml",
+    "l": "l",
+    "meq": "meq",
+    "unit": "unit",
+    "units": "unit",
+    "u": "unit",
+    "iu": "unit",
+    "%": "%",
+    "percent": "%",
+}
+# Mass units compared in milligrams, so 500mcg and 0.5mg are one strength
+_MG_FACTORS = {"mcg": 0.001, "mg": 1.0, "g": 1000.0}
+
+# Dosage form words -> canonical word
+_DOSAGE_FORM_WORDS = {
+    "tab": "tablet",
+    "tabs": "tablet",
+    "tablets": "tablet",
+    "cap": "capsule",
+    "caps": "capsule",
+    "capsules": "capsule",
+    "inj": "injection",
+    "injectable": "injection",
+    "soln": "solution",
+    "sol": "solution",
+    "susp": "suspension",
+    "oint": "ointment",
+    "crm": "cream",
+    "supp": "suppository",
+    "er": "extended release",
+    "xr": "extended release",
+    "dr": "delayed release",
+    "odt": "orally disintegrating tablet",
+}
+
+_STRENGTH_PATTERN = re.compile(r"\s*(\d+(?:\.\d+)?)\s*(.*)")
+
+
+def canonical_name(name: str | None) -> str | None:
+    """Lowercase ``name`` and reduce it to space-separated alphanumeric tokens."""
+    tokens = re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", (name or "").lower())
+    return " ".join(tokens) or None
+
+
+def canonical_unit(unit: str | None) -> str | None:
+    """Return the canonical spelling of a (possibly compound, e.g. mg/ml) unit."""
+    if unit is None or not unit.strip():
+        return None
+    parts = [part.strip().lower().rstrip(".") for part in unit.split("/")]
+    return "/".join(_UNITS.get(part, part) for part in parts)
+
+
+def canonical_strength(
+    qty: float | str | None, unit: str | None
+) -> tuple[float | None, str | None]:
+    """Return ``(qty, unit)`` with a numeric quantity and canonical unit spelling.
+
+    A strength given as text in ``unit`` alone (``"20 MG"``) is split up.
+    """
+    if qty is None and unit is not None:
+        match = _STRENGTH_PATTERN.fullmatch(unit)
+        if match:
+            qty, unit = match.groups()
+    if isinstance(qty, str):
+        try:
+            qty = float(qty.strip())
+        except ValueError:
+            qty = None
+    return (float(qty) if qty is not None else None), canonical_unit(unit)
+
+
+def canonical_dosage_form(form: str | None) -> str | None:
+    """Return ``form`` lowercased with abbreviations spelled out (``"TAB ER"``)."""
+    name = canonical_name(form)
+    if name is None:
+        return None
+    return " ".join(_DOSAGE_FORM_WORDS.get(word, word) for word in name.split())
+
+
+def product_key(
+    name: str | None,
+    strength_qty: float | str | None,
+    strength_unit: str | None,
+    dosage_form: str | None,
+) -> str | None:
+    """Key identifying a drug product across packages and spellings, or None without a name."""
+    name = canonical_name(name)
+    if name is None:
+        return None
+    qty, unit = canonical_strength(strength_qty, strength_unit)
+    base, _, per = (unit or "").partition("/")
+    if qty is not None and base in _MG_FACTORS:
+        qty, base = qty * _MG_FACTORS[base], "mg"
+    unit = f"{base}/{per}" if per else base
+    strength = f"{qty:.6g}{unit}" if qty is not None else unit
+    return f"{name}|{strength}|{canonical_dosage_form(dosage_form) or ''}"
+
+
+def register_canonical_functions(conn: sqlite3.Connection) -> None:
+    """Make the canonicalization functions callable from SQL on ``conn``.
+
+    Registers ``canonical_ndc(ndc)``, ``canonical_dosage_form(form)``,
+    ``strength_qty(qty, unit)`` and ``strength_unit(qty, unit)`` (the parts of
+    the canonical strength) and ``product_key(name, qty, unit, form)``.
+    """
+    conn.create_function("canonical_ndc", 1, canonical_ndc, deterministic=True)
+    conn.create_function("canonical_dosage_form", 1, canonical_dosage_form, deterministic=True)
+    conn.create_function(
+        "strength_qty", 2, lambda qty, unit: canonical_strength(qty, unit)[0], deterministic=True
+    )
+    conn.create_function(
+        "strength_unit", 2, lambda qty, unit: canonical_strength(qty, unit)[1], deterministic=True
+    )
+    conn.create_function("product_key", 4, product_key, deterministic=True)
+
+
+def canonicalize_ndcs(conn: sqlite3.Connection, table: str) -> int:
+    """Rewrite ``table.ndc`` to canonical form in place; returns rows changed.
+
+    NDCs that cannot be canonicalized are left as they are.
+    """
+    register_canonical_functions(conn)
+    cursor = conn.execute(f"""
+        UPDATE {table} SET ndc = canonical_ndc(ndc)
+        WHERE canonical_ndc(ndc) IS NOT NULL AND canonical_ndc(ndc) != ndc
+    """)
+    conn.commit()
+    return cursor.rowcount
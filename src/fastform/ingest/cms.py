@@ -0,0 +1,486 @@
+"""
+Streaming ingester for CMS Part D formulary files.
+
+CMS publishes the Prescription Drug Plan Formulary files as a zip of
+pipe-delimited text files; the national "basic drugs formulary" file alone has
+millions of rows. Rows flow through a chain of generators
+
+    open (zip member) -> decode -> parse -> validate -> batch
+
+so only one batch is held in memory at a time, whatever the file size. Each
+batch is written in its own transaction: it is copied into a temporary staging
+table and merged into the multi-formulary schema with set-based
+``INSERT ... SELECT`` statements.
+
+The same transaction records a checkpoint in ``ingest_progress``: the file's
+sha256 and how many of its lines the committed chunks consumed. If the load is
+interrupted, running it again on the same file skips those lines unparsed and
+continues with the next chunk; a changed file starts over, and a file that was
+loaded completely is not read again.
+
+The basic drugs file identifies drugs only by NDC and RxCUI. An RxCUI names one
+clinical product, so it serves as the product key: the first unknown NDC
+(canonical 11-digit form) of an RxCUI adds a catalog drug with a placeholder
+``RxCUI <id>`` name, and its other NDCs become aliases of that drug. Coverage
+rows are only rewritten when a value changed.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import logging
+import sqlite3
+import time
+import zipfile
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import IO, NamedTuple
+
+from fastform.equivalence import build_equivalence_groups
+from fastform.ingest.canonical import canonical_ndc
+from fastform.schema import (
+    INGEST_LOOKUP_INDEXES,
+    create_formulary_indexes,
+    create_formulary_tables,
+)
+
+logger = logging.getLogger(__name__)
+
+BASIC_DRUGS_MEMBER = "basic drugs formulary"
+DEFAULT_BATCH_SIZE = 10_000
+# Log throughput every this many batches
+PROGRESS_EVERY = 50
+# Invalid rows logged individually before only counting them
+MAX_LOGGED_INVALID = 10
+HASH_CHUNK_SIZE = 1 << 20
+
+REQUIRED_COLUMNS = (
+    "FORMULARY_ID",
+    "CONTRACT_YEAR",
+    "RXCUI",
+    "NDC",
+    "TIER_LEVEL_VALUE",
+    "QUANTITY_LIMIT_YN",
+    "PRIOR_AUTHORIZATION_YN",
+    "STEP_THERAPY_YN",
+)
+
+_FLAGS = {"Y": True, "N": False, "": False}
+
+
+class CoverageRow(NamedTuple):
+    formulary_id: str
+    contract_year: int
+    rxcui: str
+    ndc: str
+    tier: int
+    quantity_limit: bool
+    prior_authorization: bool
+    step_therapy: bool
+
+
+@dataclass
+class IngestStats:
+    rows: int = 0
+    skipped: int = 0
+    batches: int = 0
+    # Data lines read, and those a previous, interrupted run had already committed
+    lines: int = 0
+    resumed_lines: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows / self.elapsed_s if self.elapsed_s else 0.0
+
+
+@dataclass
+class IngestProgress:
+    """Checkpoint of one source file, as stored in ``ingest_progress``."""
+
+    source: str
+    member: str
+    source_hash: str
+    lines_committed: int = 0
+    chunks_committed: int = 0
+    rows_committed: int = 0
+    rows_skipped: int = 0
+    completed: bool = False
+
+
+# Columns of a staged CoverageRow, in field order
+STAGE_COLUMNS = """
+    formulary_id TEXT NOT NULL,
+    contract_year INTEGER,
+    rxcui TEXT,
+    ndc TEXT NOT NULL,
+    tier INTEGER,
+    quantity_limit BOOLEAN,
+    prior_authorization BOOLEAN,
+    step_therapy BOOLEAN
+"""
+STAGE_SCHEMA = f"CREATE TEMP TABLE IF NOT EXISTS cms_stage ({STAGE_COLUMNS})"
+
+INSERT_FORMULARIES = """
+    INSERT INTO formularies (
+        plan_name, insurer, plan_type, coverage_year, data_source, last_updated
+    )
+    SELECT 'CMS Formulary ' || s.formulary_id, 'CMS Part D', 'Medicare Part D',
+           MAX(s.contract_year), 'cms:' || s.formulary_id, CURRENT_TIMESTAMP
+    FROM {stage} s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM formularies f WHERE f.data_source = 'cms:' || s.formulary_id
+    )
+    GROUP BY s.formulary_id
+"""
+
+# Same value as product_key('RxCUI <rxcui>', NULL, NULL, NULL)
+RXCUI_PRODUCT_KEY = "'rxcui ' || {rxcui} || '||'"
+
+INSERT_DRUGS = f"""
+    INSERT INTO drugs (name, ndc, product_key)
+    SELECT 'RxCUI ' || MIN(s.rxcui), MIN(s.ndc),
+           CASE WHEN MIN(s.rxcui) != '' THEN {RXCUI_PRODUCT_KEY.format(rxcui="MIN(s.rxcui)")} END
+    FROM {{stage}} s
+    WHERE NOT EXISTS (SELECT 1 FROM drugs d WHERE d.ndc = s.ndc)
+      AND NOT EXISTS (
+          SELECT 1 FROM drug_aliases a WHERE a.alias_type = 'ndc' AND a.alias = s.ndc
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM drugs d WHERE d.product_key = {RXCUI_PRODUCT_KEY.format(rxcui="s.rxcui")}
+      )
+    GROUP BY COALESCE(NULLIF(s.rxcui, ''), s.ndc)
+    ON CONFLICT (ndc) DO NOTHING
+"""
+
+INSERT_NDC_ALIASES = f"""
+    INSERT INTO drug_aliases (alias_type, alias, drug_id)
+    SELECT 'ndc', s.ndc, MIN(d.id)
+    FROM {{stage}} s
+    JOIN drugs d ON d.product_key = {RXCUI_PRODUCT_KEY.format(rxcui="s.rxcui")}
+    WHERE s.rxcui != ''
+      AND NOT EXISTS (SELECT 1 FROM drugs p WHERE p.ndc = s.ndc)
+      AND NOT EXISTS (
+          SELECT 1 FROM drug_aliases a WHERE a.alias_type = 'ndc' AND a.alias = s.ndc
+      )
+    GROUP BY s.ndc
+"""
+
+UPSERT_COVERAGE = """
+    INSERT INTO formulary_coverage (
+        formulary_id, drug_id, is_covered, formulary_tier,
+        prior_authorization, quantity_limit, step_therapy, last_verified
+    )
+    SELECT f.id, COALESCE(d.id, a.drug_id), 1, s.tier,
+           s.prior_authorization, s.quantity_limit, s.step_therapy, CURRENT_TIMESTAMP
+    FROM {stage} s
+    JOIN formularies f ON f.data_source = 'cms:' || s.formulary_id
+    LEFT JOIN drugs d ON d.ndc = s.ndc
+    LEFT JOIN drug_aliases a ON a.alias_type = 'ndc' AND a.alias = s.ndc AND d.id IS NULL
+    WHERE COALESCE(d.id, a.drug_id) IS NOT NULL
+    ON CONFLICT (formulary_id, drug_id) DO UPDATE SET
+        is_covered = 1,
+        formulary_tier = excluded.formulary_tier,
+        prior_authorization = excluded.prior_authorization,
+        quantity_limit = excluded.quantity_limit,
+        step_therapy = excluded.step_therapy,
+        last_verified = excluded.last_verified
+    WHERE formulary_coverage.is_covered IS NOT 1
+       OR formulary_coverage.formulary_tier IS NOT excluded.formulary_tier
+       OR formulary_coverage.prior_authorization IS NOT excluded.prior_authorization
+       OR formulary_coverage.quantity_limit IS NOT excluded.quantity_limit
+       OR formulary_coverage.step_therapy IS NOT excluded.step_therapy
+"""
+
+
+@contextmanager
+def open_text(path: str | Path, member: str = BASIC_DRUGS_MEMBER) -> Iterator[IO[str]]:
+    """Open a plain, gzipped or zipped CMS file as text without extracting it.
+
+    For zip archives the first member whose name contains ``member`` is read;
+    CMS nests a zip per file inside the quarterly release, which is followed.
+    """
+    with ExitStack() as stack:
+        binary: IO[bytes] | gzip.GzipFile
+        if zipfile.is_zipfile(path):
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            binary = _open_member(stack, archive, member)
+        elif str(path).endswith(".gz"):
+            binary = stack.enter_context(gzip.open(path, "rb"))
+        else:
+            binary = stack.enter_context(open(path, "rb"))
+        yield stack.enter_context(
+            io.TextIOWrapper(binary, encoding="utf-8-sig", errors="replace", newline="")
+        )
+
+
+def _open_member(stack: ExitStack, archive: zipfile.ZipFile, member: str) -> IO[bytes]:
+    wanted = member.lower().replace("_", " ")
+    while True:
+        names = [name for name in archive.namelist() if not name.endswith("/")]
+        matches = [name for name in names if wanted in name.lower().replace("_", " ")]
+        if not matches and len(names) == 1:
+            matches = names
+        if not matches:
+            raise ValueError(f"No '{member}' file in {archive.filename or 'archive'}")
+
+        opened = stack.enter_context(archive.open(matches[0]))
+        if not matches[0].lower().endswith(".zip"):
+            return opened
+        archive = stack.enter_context(zipfile.ZipFile(opened))
+
+
+class LineCounter:
+    """Iterate over ``lines``, counting how many have been read."""
+
+    def __init__(self, lines: Iterable[str]):
+        self._lines = iter(lines)
+        self.count = 0
+
+    def __iter__(self) -> "LineCounter":
+        return self
+
+    def __next__(self) -> str:
+        line = next(self._lines)
+        self.count += 1
+        return line
+
+
+def parse_rows(lines: Iterable[str], skip: int = 0) -> Iterator[dict[str, str]]:
+    """Split pipe-delimited lines into dicts keyed by the upper-cased header.
+
+    The first ``skip`` lines after the header are passed over without parsing.
+    """
+    lines = iter(lines)
+    reader = csv.reader(lines, delimiter="|", quoting=csv.QUOTE_NONE)
+    header = [column.strip().upper() for column in next(reader, [])]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"CMS file is missing columns: {', '.join(missing)}")
+
+    # Without quoting every record is one line, so the reader stays aligned
+    next(islice(lines, skip, skip), None)
+    for values in reader:
+        if values:
+            yield dict(zip(header, values, strict=False))
+
+
+def validate_rows(
+    rows: Iterable[dict[str, str]], stats: IngestStats, first_line: int = 2
+) -> Iterator[CoverageRow]:
+    """Convert parsed rows to ``CoverageRow``; invalid rows are counted and skipped."""
+    for line_number, row in enumerate(rows, start=first_line):
+        try:
+            yield _coverage_row(row)
+        except (KeyError, ValueError) as e:
+            stats.skipped += 1
+            if stats.skipped <= MAX_LOGGED_INVALID:
+                logger.warning(f"Skipping line {line_number}: {e}")
+
+
+def _coverage_row(row: dict[str, str]) -> CoverageRow:
+    formulary_id = row["FORMULARY_ID"].strip()
+    if not formulary_id:
+        raise ValueError("missing FORMULARY_ID")
+
+    ndc = canonical_ndc(row["NDC"])
+    if ndc is None:
+        raise ValueError(f"invalid NDC {row['NDC']!r}")
+
+    tier = int(row["TIER_LEVEL_VALUE"])
+    if tier < 1:
+        raise ValueError(f"invalid tier {tier}")
+
+    return CoverageRow(
+        formulary_id=formulary_id,
+        contract_year=int(row["CONTRACT_YEAR"]),
+        rxcui=row["RXCUI"].strip(),
+        ndc=ndc,
+        tier=tier,
+        quantity_limit=_flag(row["QUANTITY_LIMIT_YN"]),
+        prior_authorization=_flag(row["PRIOR_AUTHORIZATION_YN"]),
+        step_therapy=_flag(row["STEP_THERAPY_YN"]),
+    )
+
+
+def _flag(value: str) -> bool:
+    try:
+        return _FLAGS[value.strip().upper()]
+    except KeyError:
+        raise ValueError(f"invalid Y/N flag {value!r}") from None
+
+
+def batched(rows: Iterable[CoverageRow], size: int) -> Iterator[list[CoverageRow]]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def write_batch(conn: sqlite3.Connection, batch: list[CoverageRow]) -> None:
+    """Merge one batch into the multi-formulary tables (caller owns the transaction)."""
+    conn.execute("DELETE FROM temp.cms_stage")
+    conn.executemany("INSERT INTO temp.cms_stage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    merge_stage(conn, "temp.cms_stage")
+
+
+def merge_stage(conn: sqlite3.Connection, stage: str) -> None:
+    """Merge staged coverage rows from table ``stage`` into the multi-formulary tables.
+
+    New formularies and drugs are created first; staged rows are then mapped to
+    drug ids by NDC, or NDC alias, through the shared ``drugs`` catalog.
+    """
+    conn.execute(INSERT_FORMULARIES.format(stage=stage))
+    conn.execute(INSERT_DRUGS.format(stage=stage))
+    conn.execute(INSERT_NDC_ALIASES.format(stage=stage))
+    conn.execute(UPSERT_COVERAGE.format(stage=stage))
+
+
+def file_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def progress_key(path: str | Path, member: str = BASIC_DRUGS_MEMBER) -> tuple[str, str]:
+    """The ``(source, member)`` a checkpoint of ``path`` is stored under."""
+    return str(Path(path).resolve()), member if zipfile.is_zipfile(path) else ""
+
+
+def load_progress(
+    conn: sqlite3.Connection, path: str | Path, member: str = BASIC_DRUGS_MEMBER
+) -> IngestProgress:
+    """Return the checkpoint of ``path``, or a fresh one if the file changed since."""
+    source, member = progress_key(path, member)
+    progress = IngestProgress(source, member, file_sha256(path))
+
+    row = conn.execute(
+        """
+        SELECT source_hash, lines_committed, chunks_committed, rows_committed,
+               rows_skipped, completed
+        FROM ingest_progress WHERE source = ? AND member = ?
+        """,
+        (source, member),
+    ).fetchone()
+    if row is not None and row[0] == progress.source_hash:
+        (
+            progress.lines_committed,
+            progress.chunks_committed,
+            progress.rows_committed,
+            progress.rows_skipped,
+        ) = row[1:5]
+        progress.completed = bool(row[5])
+    return progress
+
+
+def save_progress(conn: sqlite3.Connection, progress: IngestProgress) -> None:
+    """Record a checkpoint (in the caller's transaction, with the data it covers)."""
+    conn.execute(
+        """
+        INSERT INTO ingest_progress (
+            source, member, source_hash, lines_committed, chunks_committed,
+            rows_committed, rows_skipped, completed
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, member) DO UPDATE SET
+            source_hash = excluded.source_hash,
+            lines_committed = excluded.lines_committed,
+            chunks_committed = excluded.chunks_committed,
+            rows_committed = excluded.rows_committed,
+            rows_skipped = excluded.rows_skipped,
+            completed = excluded.completed,
+            started_at = CASE WHEN excluded.lines_committed = 0
+                              THEN CURRENT_TIMESTAMP ELSE started_at END,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (
+            progress.source,
+            progress.member,
+            progress.source_hash,
+            progress.lines_committed,
+            progress.chunks_committed,
+            progress.rows_committed,
+            progress.rows_skipped,
+            progress.completed,
+        ),
+    )
+
+
+def ingest_basic_drugs(
+    conn: sqlite3.Connection,
+    path: str | Path,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    member: str = BASIC_DRUGS_MEMBER,
+    resume: bool = True,
+) -> IngestStats:
+    """Stream a CMS basic drugs formulary file into the database.
+
+    With ``resume`` a file whose previous load was interrupted continues after
+    its last committed chunk, and a file already loaded in full is skipped;
+    otherwise the file is loaded from the start.
+    """
+    create_formulary_tables(conn, indexes=False)
+    create_formulary_indexes(conn, INGEST_LOOKUP_INDEXES)
+    conn.execute(STAGE_SCHEMA)
+
+    stats = IngestStats()
+    start = time.perf_counter()
+    progress = load_progress(conn, path, member)
+    if not resume:
+        progress = IngestProgress(progress.source, progress.member, progress.source_hash)
+    if progress.completed:
+        logger.info(f"{path} was already ingested completely; nothing to do")
+        return stats
+
+    if progress.lines_committed:
+        stats.resumed_lines = progress.lines_committed
+        logger.info(
+            f"Resuming {path} after {progress.lines_committed:,} lines "
+            f"({progress.chunks_committed:,} chunks committed)"
+        )
+    else:
+        with conn:
+            save_progress(conn, progress)
+
+    skipped_before = progress.rows_skipped
+    with open_text(path, member) as text:
+        lines = LineCounter(text)
+        rows = parse_rows(lines, skip=progress.lines_committed)
+        valid = validate_rows(rows, stats, first_line=progress.lines_committed + 2)
+        for batch in batched(valid, batch_size):
+            # The pipeline is lazy, so the counter stops at this batch's last line
+            progress.lines_committed = lines.count - 1
+            progress.chunks_committed += 1
+            progress.rows_committed += len(batch)
+            progress.rows_skipped = skipped_before + stats.skipped
+            with conn:
+                write_batch(conn, batch)
+                save_progress(conn, progress)
+            stats.rows += len(batch)
+            stats.batches += 1
+            if stats.batches % PROGRESS_EVERY == 0:
+                elapsed = time.perf_counter() - start
+                logger.info(f"Ingested {stats.rows:,} rows ({stats.rows / elapsed:,.0f} rows/s)")
+
+        progress.lines_committed = max(lines.count - 1, 0)
+        stats.lines = progress.lines_committed - stats.resumed_lines
+        progress.rows_skipped = skipped_before + stats.skipped
+        progress.completed = True
+        with conn:
+            save_progress(conn, progress)
+
+    # Search indexes are built (or, if they exist, were maintained) last
+    create_formulary_indexes(conn)
+    build_equivalence_groups(conn)
+
+    stats.elapsed_s = time.perf_counter() - start
+    logger.info(
+        f"Ingested {stats.rows:,} rows in {stats.elapsed_s:.1f}s "
+        f"({stats.rows_per_s:,.0f} rows/s), skipped {stats.skipped:,} invalid rows"
+    )
+    return stats
@@ -0,0 +1,214 @@
+"""
+Parallel multi-file ingestion through per-file staging databases.
+
+Parsing and validating CMS files is CPU-bound, while SQLite admits one writer
+at a time. Each input file is therefore parsed in a worker process into its own
+throwaway staging database. The coordinator merges finished staging files into
+the main database one by one with ``ATTACH`` and set-based ``INSERT ... SELECT``
+statements, mapping NDCs to drug ids through the shared ``drugs`` catalog, while
+the remaining workers keep parsing.
+
+Each merge records its file as completed in ``ingest_progress`` in the same
+transaction, so after an interruption a rerun skips the files already merged.
+Workers hash their file before parsing it and skip it if it is unchanged since
+its merge, so the hashing is spread over the pool too. Staging files are
+throwaway, so a file is checkpointed only as a whole.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from fastform.equivalence import build_equivalence_groups
+from fastform.ingest.cms import (
+    BASIC_DRUGS_MEMBER,
+    DEFAULT_BATCH_SIZE,
+    STAGE_COLUMNS,
+    IngestProgress,
+    IngestStats,
+    LineCounter,
+    batched,
+    file_sha256,
+    merge_stage,
+    open_text,
+    parse_rows,
+    progress_key,
+    save_progress,
+    validate_rows,
+)
+from fastform.schema import (
+    INGEST_LOOKUP_INDEXES,
+    create_formulary_indexes,
+    create_formulary_tables,
+)
+
+logger = logging.getLogger(__name__)
+
+STAGING_SCHEMA = [
+    f"CREATE TABLE staged_coverage ({STAGE_COLUMNS})",
+]
+# Built after loading so the merge's GROUP BYs read the rows in key order
+STAGING_INDEXES = [
+    "CREATE INDEX idx_staged_formulary ON staged_coverage(formulary_id)",
+    "CREATE INDEX idx_staged_ndc ON staged_coverage(ndc)",
+]
+
+
+def stage_file(
+    path: str | Path,
+    staging_path: str | Path,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    member: str = BASIC_DRUGS_MEMBER,
+) -> IngestStats:
+    """Parse one CMS file into a new staging database (runs in a worker process)."""
+    stats = IngestStats()
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(staging_path)
+    try:
+        # Staging files are discarded on failure, so durability buys nothing
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        for statement in STAGING_SCHEMA:
+            conn.execute(statement)
+
+        with open_text(path, member) as text:
+            lines = LineCounter(text)
+            for batch in batched(validate_rows(parse_rows(lines), stats), batch_size):
+                conn.executemany(
+                    "INSERT INTO staged_coverage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch
+                )
+                stats.rows += len(batch)
+                stats.batches += 1
+            stats.lines = max(lines.count - 1, 0)
+
+        for statement in STAGING_INDEXES:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+    stats.elapsed_s = time.perf_counter() - start
+    return stats
+
+
+def stage_changed_file(
+    path: str | Path,
+    staging_path: str | Path,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    member: str = BASIC_DRUGS_MEMBER,
+    merged_hash: str | None = None,
+) -> tuple[str, IngestStats | None]:
+    """Hash one CMS file and, unless it is ``merged_hash``, stage it (runs in a worker).
+
+    Returns the file's hash and the staging stats, or None if it was skipped.
+    """
+    source_hash = file_sha256(path)
+    if source_hash == merged_hash:
+        return source_hash, None
+    return source_hash, stage_file(path, staging_path, batch_size, member)
+
+
+def merged_hash(conn: sqlite3.Connection, path: str | Path, member: str) -> str | None:
+    """Hash ``path`` had when it was last merged completely, if it ever was."""
+    row = conn.execute(
+        "SELECT source_hash FROM ingest_progress WHERE source = ? AND member = ? AND completed",
+        progress_key(path, member),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def merge_staging(
+    conn: sqlite3.Connection, staging_path: str | Path, progress: IngestProgress | None = None
+) -> None:
+    """Merge one staging database into ``conn`` in a single transaction.
+
+    ``progress``, if given, is saved in the same transaction.
+    """
+    conn.execute("ATTACH DATABASE ? AS staging", (str(staging_path),))
+    try:
+        with conn:
+            merge_stage(conn, "staging.staged_coverage")
+            if progress is not None:
+                save_progress(conn, progress)
+    finally:
+        conn.execute("DETACH DATABASE staging")
+
+
+def ingest_files(
+    conn: sqlite3.Connection,
+    paths: list[str | Path],
+    workers: int | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    member: str = BASIC_DRUGS_MEMBER,
+    resume: bool = True,
+) -> IngestStats:
+    """Parse ``paths`` in parallel and merge each into ``conn`` as it finishes.
+
+    Staging files are written next to the main database file. With ``resume``
+    files already merged completely by an earlier run are skipped.
+    """
+    total = IngestStats()
+    start = time.perf_counter()
+
+    create_formulary_tables(conn, indexes=False)
+    create_formulary_indexes(conn, INGEST_LOOKUP_INDEXES)
+    merged = {path: merged_hash(conn, path, member) if resume else None for path in paths}
+    workers = min(workers or os.cpu_count() or 1, len(paths)) or 1
+    main_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    staging_parent = Path(main_file).parent if main_file else None
+
+    ingested = 0
+    with (
+        tempfile.TemporaryDirectory(dir=staging_parent) as staging_dir,
+        ProcessPoolExecutor(max_workers=workers) as pool,
+    ):
+        futures = {}
+        for index, path in enumerate(paths):
+            staging_path = Path(staging_dir) / f"staging-{index}.db"
+            future = pool.submit(
+                stage_changed_file, path, staging_path, batch_size, member, merged[path]
+            )
+            futures[future] = (path, staging_path)
+
+        for future in as_completed(futures):
+            path, staging_path = futures[future]
+            source_hash, stats = future.result()
+            if stats is None:
+                logger.info(f"Skipping {path}: already ingested completely")
+                continue
+            progress = IngestProgress(
+                *progress_key(path, member),
+                source_hash,
+                lines_committed=stats.lines,
+                chunks_committed=1,
+                rows_committed=stats.rows,
+                rows_skipped=stats.skipped,
+                completed=True,
+            )
+            merge_staging(conn, staging_path, progress)
+            staging_path.unlink()
+
+            ingested += 1
+            total.rows += stats.rows
+            total.skipped += stats.skipped
+            total.batches += stats.batches
+            total.lines += stats.lines
+            logger.info(
+                f"Merged {path}: {stats.rows:,} rows (parsed at {stats.rows_per_s:,.0f} rows/s)"
+            )
+
+    # Search indexes are built (or, if they exist, were maintained) last
+    create_formulary_indexes(conn)
+    build_equivalence_groups(conn)
+
+    total.elapsed_s = time.perf_counter() - start
+    logger.info(
+        f"Ingested {total.rows:,} rows from {ingested} files with {workers} workers in "
+        f"{total.elapsed_s:.1f}s ({total.rows_per_s:,.0f} rows/s)"
+    )
+    return total
@@ -0,0 +1,197 @@
+"""
+Natural-key upserts into the multi-formulary schema.
+
+Refreshing data must not rebuild tables: drug and formulary ids are cached by
+clients, and rewriting every row bloats the WAL. Drugs are keyed by canonical
+NDC, formularies by (plan_name, insurer) and coverage by (formulary_id,
+drug_id). Each upsert only writes when a value actually changed, so
+re-running an identical load touches no rows.
+
+A drug whose NDC is new but whose product key matches a catalog drug is not
+inserted; its NDC and spelling become aliases of that drug instead.
+"""
+
+import sqlite3
+from collections.abc import Iterable
+from typing import Any
+
+from fastform.ingest.canonical import (
+    canonical_dosage_form,
+    canonical_ndc,
+    canonical_strength,
+    product_key,
+)
+
+DRUG_COLUMNS = (
+    "name",
+    "generic_name",
+    "brand_name",
+    "ndc",
+    "dosage_form",
+    "strength_qty",
+    "strength_unit",
+    "route",
+    "product_key",
+)
+
+FORMULARY_COLUMNS = (
+    "plan_name",
+    "insurer",
+    "plan_type",
+    "coverage_year",
+    "state_coverage",
+    "effective_date",
+    "update_frequency",
+    "api_endpoint",
+    "data_source",
+)
+
+COVERAGE_COLUMNS = (
+    "formulary_id",
+    "drug_id",
+    "is_covered",
+    "formulary_tier",
+    "prior_authorization",
+    "quantity_limit",
+    "step_therapy",
+)
+
+
+def upsert_sql(
+    table: str,
+    columns: tuple[str, ...],
+    key: tuple[str, ...],
+    touch: str | None = None,
+    select: str | None = None,
+) -> str:
+    """Build an ``INSERT ... ON CONFLICT (key) DO UPDATE`` that skips unchanged rows.
+
+    Values are bound by name, or taken from ``select`` (whose result columns
+    follow ``columns``) for set-based upserts. ``touch`` names a timestamp
+    column set on insert and on every real change.
+    """
+    updated = [column for column in columns if column not in key]
+    changed = " OR ".join(f"{table}.{column} IS NOT excluded.{column}" for column in updated)
+    assignments = [f"{column} = excluded.{column}" for column in updated]
+    insert_columns = list(columns)
+    values = [f":{column}" for column in columns]
+    if touch:
+        # Timestamp of the last real change, not of the last refresh
+        assignments.append(f"{touch} = CURRENT_TIMESTAMP")
+        insert_columns.append(touch)
+        values.append("CURRENT_TIMESTAMP")
+    if select is None:
+        source = f"VALUES ({', '.join(values)})"
+    else:
+        # WHERE true keeps SQLite from parsing ON CONFLICT as a join constraint
+        extra = ", CURRENT_TIMESTAMP" if touch else ""
+        source = f"SELECT *{extra} FROM ({select}) WHERE true"
+    return f"""
+        INSERT INTO {table} ({", ".join(insert_columns)})
+        {source}
+        ON CONFLICT ({", ".join(key)}) DO UPDATE SET {", ".join(assignments)}
+        WHERE {changed}
+    """
+
+
+UPSERT_DRUG = upsert_sql("drugs", DRUG_COLUMNS, ("ndc",), touch="updated_at")
+UPSERT_FORMULARY = upsert_sql(
+    "formularies", FORMULARY_COLUMNS, ("plan_name", "insurer"), touch="last_updated"
+)
+UPSERT_COVERAGE = upsert_sql(
+    "formulary_coverage", COVERAGE_COLUMNS, ("formulary_id", "drug_id"), touch="last_verified"
+)
+
+
+def canonical_drug(drug: dict[str, Any]) -> dict[str, Any]:
+    """``DRUG_COLUMNS`` of ``drug`` with NDC, strength and dosage form canonicalized."""
+    values = {column: drug.get(column) for column in DRUG_COLUMNS}
+    values["ndc"] = canonical_ndc(values["ndc"])
+    values["strength_qty"], values["strength_unit"] = canonical_strength(
+        values["strength_qty"], values["strength_unit"]
+    )
+    values["dosage_form"] = canonical_dosage_form(values["dosage_form"])
+    values["product_key"] = product_key(
+        values["name"], values["strength_qty"], values["strength_unit"], values["dosage_form"]
+    )
+    return values
+
+
+def find_drug(conn: sqlite3.Connection, ndc: str | None, key: str | None) -> int | None:
+    """Id of the catalog drug with NDC (or NDC alias) ``ndc``, else product key ``key``."""
+    if ndc is not None:
+        row = conn.execute(
+            """
+            SELECT id FROM drugs WHERE ndc = :ndc
+            UNION ALL
+            SELECT drug_id FROM drug_aliases WHERE alias_type = 'ndc' AND alias = :ndc
+            LIMIT 1
+        """,
+            {"ndc": ndc},
+        ).fetchone()
+        if row:
+            drug_id: int = row[0]
+            return drug_id
+    if key is not None:
+        row = conn.execute("SELECT MIN(id) FROM drugs WHERE product_key = ?", (key,)).fetchone()
+        product_drug_id: int | None = row[0]
+        return product_drug_id
+    return None
+
+
+def add_drug_aliases(conn: sqlite3.Connection, drug_id: int, values: dict[str, Any]) -> None:
+    """Record the NDC and name of ``values`` as aliases of ``drug_id`` where they differ."""
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO drug_aliases (alias_type, alias, drug_id)
+        SELECT 'ndc', :ndc, id FROM drugs
+        WHERE id = :drug_id AND :ndc IS NOT NULL AND ndc IS NOT :ndc
+        UNION ALL
+        SELECT 'name', :name, id FROM drugs
+        WHERE id = :drug_id AND :name IS NOT NULL AND name IS NOT :name
+    """,
+        {"drug_id": drug_id, "ndc": values["ndc"], "name": values["name"]},
+    )
+
+
+def upsert_drug(conn: sqlite3.Connection, drug: dict[str, Any]) -> int:
+    """Insert or update a drug by canonical NDC and return its id.
+
+    Other drugs are merged into the catalog drug with the same product key,
+    or inserted if there is none.
+    """
+    values = canonical_drug(drug)
+
+    if values["ndc"] is not None:
+        row = conn.execute("SELECT id FROM drugs WHERE ndc = ?", (values["ndc"],)).fetchone()
+        if row:
+            # The drug's own NDC: refresh its attributes in place
+            conn.execute(UPSERT_DRUG, values)
+            own_id: int = row[0]
+            return own_id
+
+    drug_id = find_drug(conn, values["ndc"], values["product_key"])
+    if drug_id is None:
+        drug_id = conn.execute(UPSERT_DRUG, values).lastrowid
+        assert drug_id is not None
+        return drug_id
+    add_drug_aliases(conn, drug_id, values)
+    return drug_id
+
+
+def upsert_formulary(conn: sqlite3.Connection, formulary: dict[str, Any]) -> int:
+    """Insert or update a formulary by (plan_name, insurer) and return its id."""
+    values = {column: formulary.get(column) for column in FORMULARY_COLUMNS}
+    conn.execute(UPSERT_FORMULARY, values)
+    formulary_id: int = conn.execute(
+        "SELECT id FROM formularies WHERE plan_name = ? AND insurer = ?",
+        (values["plan_name"], values["insurer"]),
+    ).fetchone()[0]
+    return formulary_id
+
+
+def upsert_coverage(conn: sqlite3.Connection, rows: Iterable[dict[str, Any]]) -> None:
+    """Insert or update coverage rows by (formulary_id, drug_id)."""
+    conn.executemany(
+        UPSERT_COVERAGE, ({column: row.get(column) for column in COVERAGE_COLUMNS} for row in rows)
+    )
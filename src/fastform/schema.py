@@ -0,0 +1,282 @@
+"""
+Normalized multi-formulary schema.
+
+Shared by the migration script and the ingesters so every writer creates the
+same tables and indexes.
+"""
+
+import sqlite3
+
+from fastform.ingest.canonical import register_canonical_functions
+
+MULTI_FORMULARY_TABLES = [
+    # 1. Master drug catalog (insurance-agnostic)
+    """
+    CREATE TABLE IF NOT EXISTS drugs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        generic_name TEXT,
+        brand_name TEXT,
+        ndc TEXT,
+        dosage_form TEXT,
+        strength_qty REAL,
+        strength_unit TEXT,
+        route TEXT,
+        drug_class TEXT,
+        manufacturer TEXT,
+        product_key TEXT, -- see fastform.ingest.canonical.product_key
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # 2. Insurance formularies/plans
+    """
+    CREATE TABLE IF NOT EXISTS formularies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        plan_name TEXT NOT NULL,
+        insurer TEXT NOT NULL,
+        plan_type TEXT,
+        coverage_year INTEGER,
+        state_coverage TEXT,
+        effective_date DATE,
+        expiration_date DATE,
+        update_frequency TEXT DEFAULT 'monthly',
+        last_updated DATETIME,
+        last_checked DATETIME,
+        api_endpoint TEXT,
+        source_etag TEXT,
+        source_last_modified TEXT,
+        source_hash TEXT,
+        data_source TEXT,
+        is_active BOOLEAN DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # 3. Formulary-specific coverage rules
+    """
+    CREATE TABLE IF NOT EXISTS formulary_coverage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        formulary_id INTEGER NOT NULL,
+        drug_id INTEGER NOT NULL,
+        is_covered BOOLEAN DEFAULT 1,
+        formulary_tier INTEGER,
+        prior_authorization BOOLEAN DEFAULT 0,
+        quantity_limit BOOLEAN DEFAULT 0,
+        step_therapy BOOLEAN DEFAULT 0,
+        copay_generic REAL,
+        copay_preferred REAL,
+        copay_nonpreferred REAL,
+        copay_specialty REAL,
+        notes TEXT,
+        last_verified DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (formulary_id) REFERENCES formularies(id),
+        FOREIGN KEY (drug_id) REFERENCES drugs(id),
+        UNIQUE(formulary_id, drug_id)
+    )
+    """,
+    # 4. Formulary update tracking
+    """
+    CREATE TABLE IF NOT EXISTS formulary_updates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        formulary_id INTEGER NOT NULL,
+        update_type TEXT, -- 'scheduled', 'manual', 'api_sync'
+        status TEXT, -- 'pending', 'in_progress', 'completed', 'failed'
+        drugs_added INTEGER DEFAULT 0,
+        drugs_modified INTEGER DEFAULT 0,
+        drugs_removed INTEGER DEFAULT 0,
+        rows_parsed INTEGER,
+        bytes_fetched INTEGER,
+        fetch_ms REAL,
+        parse_ms REAL,
+        apply_ms REAL,
+        error_message TEXT,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        completed_at DATETIME,
+        FOREIGN KEY (formulary_id) REFERENCES formularies(id)
+    )
+    """,
+    # 5. Other NDCs and spellings merged into a catalog drug
+    """
+    CREATE TABLE IF NOT EXISTS drug_aliases (
+        alias_type TEXT NOT NULL, -- 'ndc' (canonical) or 'name' (as spelled by the source)
+        alias TEXT NOT NULL,
+        drug_id INTEGER NOT NULL,
+        PRIMARY KEY (alias_type, alias, drug_id),
+        FOREIGN KEY (drug_id) REFERENCES drugs(id)
+    ) WITHOUT ROWID
+    """,
+    # 6. Ingest checkpoints, so an interrupted file load resumes where it stopped
+    """
+    CREATE TABLE IF NOT EXISTS ingest_progress (
+        source TEXT NOT NULL, -- absolute path of the file
+        member TEXT NOT NULL, -- file read inside a zip ('' otherwise)
+        source_hash TEXT NOT NULL, -- sha256 of the file
+        lines_committed INTEGER DEFAULT 0, -- data lines consumed by committed chunks
+        chunks_committed INTEGER DEFAULT 0,
+        rows_committed INTEGER DEFAULT 0,
+        rows_skipped INTEGER DEFAULT 0,
+        completed BOOLEAN DEFAULT 0,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source, member)
+    )
+    """,
+    # 7. Superseded coverage values, written by the triggers below. Rows
+    # superseded long ago are moved to the archive (see fastform.archive).
+    """
+    CREATE TABLE IF NOT EXISTS coverage_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        formulary_id INTEGER NOT NULL,
+        drug_id INTEGER NOT NULL,
+        is_covered BOOLEAN,
+        formulary_tier INTEGER,
+        prior_authorization BOOLEAN,
+        quantity_limit BOOLEAN,
+        step_therapy BOOLEAN,
+        valid_from DATETIME, -- last_verified of the superseded row
+        valid_to DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+_HISTORY_INSERT = """
+    INSERT INTO coverage_history (
+        formulary_id, drug_id, is_covered, formulary_tier,
+        prior_authorization, quantity_limit, step_therapy, valid_from
+    )
+    VALUES (
+        OLD.formulary_id, OLD.drug_id, OLD.is_covered, OLD.formulary_tier,
+        OLD.prior_authorization, OLD.quantity_limit, OLD.step_therapy, OLD.last_verified
+    );
+"""
+
+# Keep the previous values whenever a coverage row changes or is deleted, so
+# formulary_coverage only ever holds current data
+COVERAGE_HISTORY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_coverage_history_update
+    AFTER UPDATE ON formulary_coverage
+    WHEN OLD.is_covered IS NOT NEW.is_covered
+      OR OLD.formulary_tier IS NOT NEW.formulary_tier
+      OR OLD.prior_authorization IS NOT NEW.prior_authorization
+      OR OLD.quantity_limit IS NOT NEW.quantity_limit
+      OR OLD.step_therapy IS NOT NEW.step_therapy
+    BEGIN {_HISTORY_INSERT} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_coverage_history_delete
+    AFTER DELETE ON formulary_coverage
+    BEGIN {_HISTORY_INSERT} END
+    """,
+]
+
+# Columns added after the first release, by table, for upgrading older files
+ADDED_COLUMNS = {
+    "drugs": [
+        ("product_key", "TEXT"),
+    ],
+    "formularies": [
+        # Sync bookkeeping: when the source was last checked, and its validators
+        ("last_checked", "DATETIME"),
+        ("source_etag", "TEXT"),
+        ("source_last_modified", "TEXT"),
+        ("source_hash", "TEXT"),
+    ],
+    "formulary_updates": [
+        # Per-run throughput, for spotting slow or stalled sources
+        ("rows_parsed", "INTEGER"),
+        ("bytes_fetched", "INTEGER"),
+        ("fetch_ms", "REAL"),
+        ("parse_ms", "REAL"),
+        ("apply_ms", "REAL"),
+    ],
+}
+
+# Statements filling in an added column for existing rows
+ADDED_COLUMN_BACKFILLS = {
+    ("drugs", "product_key"): (
+        "UPDATE drugs SET product_key = product_key(name, strength_qty, strength_unit, dosage_form)"
+    ),
+}
+
+# Secondary indexes by name
+MULTI_FORMULARY_INDEXES = {
+    "idx_drugs_name": "CREATE INDEX IF NOT EXISTS idx_drugs_name ON drugs(name)",
+    "idx_drugs_generic": "CREATE INDEX IF NOT EXISTS idx_drugs_generic ON drugs(generic_name)",
+    "idx_drugs_brand": "CREATE INDEX IF NOT EXISTS idx_drugs_brand ON drugs(brand_name)",
+    # Natural keys for upserts (canonical NDC; plan within insurer)
+    "idx_drugs_ndc": "CREATE UNIQUE INDEX IF NOT EXISTS idx_drugs_ndc ON drugs(ndc)",
+    "idx_drugs_product": ("CREATE INDEX IF NOT EXISTS idx_drugs_product ON drugs(product_key)"),
+    "idx_drug_aliases_drug": (
+        "CREATE INDEX IF NOT EXISTS idx_drug_aliases_drug ON drug_aliases(drug_id)"
+    ),
+    "idx_formularies_plan": (
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_formularies_plan ON formularies(plan_name, insurer)"
+    ),
+    "idx_formularies_source": (
+        "CREATE INDEX IF NOT EXISTS idx_formularies_source ON formularies(data_source)"
+    ),
+    "idx_coverage_formulary": (
+        "CREATE INDEX IF NOT EXISTS idx_coverage_formulary ON formulary_coverage(formulary_id)"
+    ),
+    "idx_coverage_drug": (
+        "CREATE INDEX IF NOT EXISTS idx_coverage_drug ON formulary_coverage(drug_id)"
+    ),
+    "idx_coverage_tier": (
+        "CREATE INDEX IF NOT EXISTS idx_coverage_tier ON formulary_coverage(formulary_tier)"
+    ),
+    "idx_history_coverage": (
+        "CREATE INDEX IF NOT EXISTS idx_history_coverage"
+        " ON coverage_history(formulary_id, drug_id, valid_to)"
+    ),
+    "idx_history_superseded": (
+        "CREATE INDEX IF NOT EXISTS idx_history_superseded ON coverage_history(valid_to)"
+    ),
+    "idx_updates_formulary": (
+        "CREATE INDEX IF NOT EXISTS idx_updates_formulary"
+        " ON formulary_updates(formulary_id, started_at)"
+    ),
+}
+
+# Indexes the ingest merge statements look rows up by. Loaders create these
+# before inserting and leave the rest until the data is in.
+INGEST_LOOKUP_INDEXES = (
+    "idx_drugs_ndc",
+    "idx_drugs_product",
+    "idx_formularies_plan",
+    "idx_formularies_source",
+)
+
+
+def create_formulary_tables(conn: sqlite3.Connection, indexes: bool = True) -> None:
+    """Create any missing multi-formulary tables, and their indexes unless ``indexes`` is False."""
+    for statement in MULTI_FORMULARY_TABLES:
+        conn.execute(statement)
+    add_missing_columns(conn)
+    for statement in COVERAGE_HISTORY_TRIGGERS:
+        conn.execute(statement)
+    if indexes:
+        create_formulary_indexes(conn)
+    conn.commit()
+
+
+def add_missing_columns(conn: sqlite3.Connection) -> None:
+    """Add any ``ADDED_COLUMNS`` a database created by an older version lacks."""
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, declaration in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+                backfill = ADDED_COLUMN_BACKFILLS.get((table, name))
+                if backfill:
+                    register_canonical_functions(conn)
+                    conn.execute(backfill)
+
+
+def create_formulary_indexes(
+    conn: sqlite3.Connection, names: tuple[str, ...] | None = None
+) -> None:
+    """Create the named secondary indexes (all of them by default) if missing."""
+    for name in MULTI_FORMULARY_INDEXES if names is None else names:
+        conn.execute(MULTI_FORMULARY_INDEXES[name])
+    conn.commit()
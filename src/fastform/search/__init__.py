@@ -0,0 +1 @@
+"""Local (in-process) drug search structures."""
@@ -0,0 +1,106 @@
+"""
+Name index for reconciling LLM suggestions to catalog rows.
+
+Built once per catalog generation. A suggested medication name is resolved
+through three tiers, stopping at the first that matches:
+
+- exact: the normalized suggestion equals a drug, generic or brand name
+- token: every word of a catalog name appears in the suggestion
+  ("Ibuprofen 200mg tablets" -> Ibuprofen)
+- prefix: the suggestion is a prefix of a catalog name or vice versa
+
+All strength variants of the matched names are returned; variants whose
+strength is mentioned in the suggestion rank first.
+"""
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any
+
+from fastform.search.retrieval import normalize
+
+TIER_WEIGHTS = {"exact": 1.0, "token": 0.95, "prefix": 0.85}
+# Strength variants other than the one the suggestion names
+OTHER_STRENGTH_WEIGHT = 0.9
+MIN_PREFIX_LENGTH = 4
+
+_STRENGTH_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(mg|mcg|g|ml|units?|%)")
+_UNIT_WORDS = {"mg", "mcg", "g", "ml", "unit", "units"}
+
+
+def suggestion_strengths(text: str) -> set[float]:
+    """Numeric strengths mentioned in a suggestion ("Tylenol 500 mg" -> {500.0})."""
+    return {float(value) for value, _ in _STRENGTH_PATTERN.findall(text.lower())}
+
+
+class NameIndex:
+    def __init__(self, drugs: tuple[dict[str, Any], ...] | list[dict[str, Any]]):
+        self.drugs = drugs
+
+        rows_by_name: dict[str, list[int]] = defaultdict(list)
+        for index, drug in enumerate(drugs):
+            keys = {normalize(drug.get(field)) for field in ("name", "generic_name", "brand_name")}
+            for key in keys:
+                if key:
+                    rows_by_name[key].append(index)
+
+        self._rows_by_name = dict(rows_by_name)
+        self._names_by_token: dict[str, list[str]] = defaultdict(list)
+        for key in self._rows_by_name:
+            for token in set(key.split()):
+                self._names_by_token[token].append(key)
+        self._sorted_names = sorted(self._rows_by_name)
+
+    def _lookup(self, suggestion: str) -> tuple[str, set[int]]:
+        key = normalize(suggestion)
+        if not key:
+            return "", set()
+
+        rows = self._rows_by_name.get(key)
+        if rows:
+            return "exact", set(rows)
+
+        words = {token for token in key.split() if not token.isdigit()} - _UNIT_WORDS
+        matched: set[int] = set()
+        for token in words:
+            for name in self._names_by_token.get(token, ()):
+                if set(name.split()) <= words:
+                    matched.update(self._rows_by_name[name])
+        if matched:
+            return "token", matched
+
+        if len(key) >= MIN_PREFIX_LENGTH:
+            # Names extending the suggestion ("metfor" -> "metformin")
+            position = bisect_left(self._sorted_names, key)
+            while position < len(self._sorted_names):
+                name = self._sorted_names[position]
+                if not name.startswith(key):
+                    break
+                matched.update(self._rows_by_name[name])
+                position += 1
+            # Names the suggestion extends ("amoxicillin trihydrate" -> "amoxicillin")
+            for length in range(MIN_PREFIX_LENGTH, len(key)):
+                matched.update(self._rows_by_name.get(key[:length], ()))
+        if matched:
+            return "prefix", matched
+
+        return "", set()
+
+    def resolve(self, suggestion: str, confidence: float) -> list[tuple[dict[str, Any], float]]:
+        """Return (drug, confidence) for every row the suggestion resolves to, best first."""
+        tier, rows = self._lookup(suggestion)
+        if not rows:
+            return []
+
+        strengths = suggestion_strengths(suggestion)
+        resolved = []
+        for index in rows:
+            drug = self.drugs[index]
+            score = confidence * TIER_WEIGHTS[tier]
+            if strengths and drug.get("strength_qty") not in strengths:
+                score *= OTHER_STRENGTH_WEIGHT
+            resolved.append((index, score))
+
+        resolved.sort(key=lambda item: (-item[1], item[0]))
+        return [(self.drugs[index], score) for index, score in resolved]
@@ -0,0 +1,172 @@
+"""
+Candidate retrieval for the intelligent search.
+
+Scores every drug in the catalog against a free-text query with cheap local
+signals (character trigram overlap, prefix, a phonetic key and a synonym map)
+so only the most plausible drugs are sent to the LLM.
+"""
+
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Any
+
+# Common clinical abbreviations and international names
+SYNONYMS = {
+    "apap": "acetaminophen",
+    "paracetamol": "acetaminophen",
+    "asa": "aspirin",
+    "hctz": "hydrochlorothiazide",
+    "ntg": "nitroglycerin",
+    "mtx": "methotrexate",
+    "salbutamol": "albuterol",
+    "amox": "amoxicillin",
+    "nph": "insulin nph",
+    "lisinopril hctz": "lisinopril hydrochlorothiazide",
+}
+
+# Scores for the non-trigram signals
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.9
+PHONETIC_SCORE = 0.85
+# Query tokens count slightly less than the full query
+TOKEN_WEIGHT = 0.9
+MIN_SCORE = 0.25
+
+_PHONETIC_RULES = (
+    ("ph", "f"),
+    ("ck", "k"),
+    ("qu", "kw"),
+    ("x", "ks"),
+    ("y", "i"),
+    ("z", "s"),
+    ("c", "k"),
+)
+
+
+def normalize(text: str | None) -> str:
+    """Lowercase and reduce to space-separated alphanumeric tokens."""
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def trigrams(compact: str) -> set[str]:
+    padded = f"$${compact}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def phonetic_key(compact: str) -> str:
+    """Collapse spellings that sound alike (ibuprofin/ibuprofen, tylanol/tylenol)."""
+    word = re.sub(r"[^a-z]", "", compact)
+    if not word:
+        return ""
+    for old, new in _PHONETIC_RULES:
+        word = word.replace(old, new)
+    rest = re.sub(r"[aeiouhw]", "", word[1:])
+    return re.sub(r"(.)\1+", r"\1", word[0] + rest)
+
+
+class CandidateRetriever:
+    """Trigram/prefix/phonetic index over drug name, generic and brand terms."""
+
+    def __init__(self, drugs: tuple[dict[str, Any], ...] | list[dict[str, Any]]):
+        self.drugs = drugs
+
+        # A drug answers to its own names and to every name of drugs sharing
+        # its generic, so brand queries reach unbranded rows too.
+        group_terms: dict[str, set[str]] = defaultdict(set)
+        drug_group: list[str] = []
+        for drug in drugs:
+            group = normalize(drug.get("generic_name")) or normalize(drug.get("name"))
+            drug_group.append(group)
+            for field in ("name", "generic_name", "brand_name"):
+                normalized = normalize(drug.get(field))
+                if not normalized:
+                    continue
+                group_terms[group].add(normalized.replace(" ", ""))
+                # Words of multi-word names ("insulin glargine", "proair hfa")
+                for word in normalized.split():
+                    if len(word) >= 4 and not word.isdigit():
+                        group_terms[group].add(word)
+
+        term_drugs: dict[str, list[int]] = defaultdict(list)
+        for index, group in enumerate(drug_group):
+            for term in group_terms[group]:
+                term_drugs[term].append(index)
+
+        self._terms = sorted(term_drugs)
+        self._term_drugs = [term_drugs[term] for term in self._terms]
+        self._term_gram_counts = []
+        self._gram_index: dict[str, list[int]] = defaultdict(list)
+        self._phonetic_index: dict[str, list[int]] = defaultdict(list)
+        for term_id, term in enumerate(self._terms):
+            grams = trigrams(term)
+            self._term_gram_counts.append(len(grams))
+            for gram in grams:
+                self._gram_index[gram].append(term_id)
+            self._phonetic_index[phonetic_key(term)].append(term_id)
+
+    def _query_variants(self, query: str) -> dict[str, float]:
+        normalized = normalize(query)
+        variants = {normalized: 1.0}
+        for token in normalized.split():
+            if len(token) >= 3 and token not in variants:
+                variants[token] = TOKEN_WEIGHT
+        for variant, weight in list(variants.items()):
+            if variant in SYNONYMS:
+                variants.setdefault(SYNONYMS[variant], weight)
+        return {v.replace(" ", ""): w for v, w in variants.items() if v}
+
+    def _score_terms(self, query: str) -> dict[int, float]:
+        scores: dict[int, float] = {}
+
+        def bump(term_id: int, score: float) -> None:
+            if score > scores.get(term_id, 0.0):
+                scores[term_id] = score
+
+        for compact, weight in self._query_variants(query).items():
+            grams = trigrams(compact)
+            shared_counts = Counter(
+                term_id for gram in grams for term_id in self._gram_index.get(gram, ())
+            )
+            for term_id, shared in shared_counts.items():
+                union = len(grams) + self._term_gram_counts[term_id] - shared
+                bump(term_id, weight * shared / union)
+
+            if len(compact) >= 3:
+                start = bisect_left(self._terms, compact)
+                for term_id in range(start, len(self._terms)):
+                    term = self._terms[term_id]
+                    if not term.startswith(compact):
+                        break
+                    bump(term_id, weight * (EXACT_SCORE if term == compact else PREFIX_SCORE))
+
+                for term_id in self._phonetic_index.get(phonetic_key(compact), ()):
+                    bump(term_id, weight * PHONETIC_SCORE)
+
+        return scores
+
+    def score(self, query: str) -> dict[int, float]:
+        """Best score per drug index for the query."""
+        drug_scores: dict[int, float] = {}
+        for term_id, score in self._score_terms(query).items():
+            for index in self._term_drugs[term_id]:
+                if score > drug_scores.get(index, 0.0):
+                    drug_scores[index] = score
+        return drug_scores
+
+    def top_k(
+        self, query: str, k: int, min_score: float = MIN_SCORE
+    ) -> list[tuple[dict[str, Any], float]]:
+        """Return up to ``k`` (drug, score) pairs, best first.
+
+        Ties keep catalog order. If nothing clears ``min_score`` the first ``k``
+        drugs are returned, so the LLM still sees something to reason over.
+        """
+        scored = [
+            (score, index) for index, score in self.score(query).items() if score >= min_score
+        ]
+        if not scored:
+            return [(drug, 0.0) for drug in self.drugs[:k]]
+        best = heapq.nsmallest(k, scored, key=lambda item: (-item[0], item[1]))
+        return [(self.drugs[index], score) for score, index in best]
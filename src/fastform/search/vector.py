@@ -0,0 +1,234 @@
+"""
+Offline vector similarity search over the drug catalog.
+
+Every drug's name, generic and brand are embedded as L2-normalized character
+n-gram TF-IDF vectors (a SciPy sparse matrix). The matrix is persisted to a
+single memory-mapped file per data generation, so restarts and extra workers
+share the pages instead of rebuilding. Queries are vectorized the same way and
+scored against the whole catalog with one sparse matrix product per batch.
+"""
+
+import json
+import logging
+import math
+import os
+import struct
+from collections import Counter
+from typing import Any
+
+from fastform.search.retrieval import normalize
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional dependency: pip install "fastform[vector]"
+    np = None  # type: ignore[assignment]
+    sparse = None
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZES = (2, 3, 4)
+MIN_SIMILARITY = 0.1
+FORMAT_VERSION = 1
+_HEADER_SIZE = struct.Struct("<Q")
+_ALIGN = 8
+
+
+class VectorSearchUnavailable(RuntimeError):
+    pass
+
+
+def vector_search_available() -> bool:
+    return np is not None and sparse is not None
+
+
+def char_ngrams(text: str) -> Counter[str]:
+    grams: Counter[str] = Counter()
+    for word in normalize(text).split():
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            for i in range(len(padded) - size + 1):
+                grams[padded[i : i + size]] += 1
+    return grams
+
+
+def drug_text(drug: dict[str, Any]) -> str:
+    return " ".join(drug.get(field) or "" for field in ("name", "generic_name", "brand_name"))
+
+
+class VectorIndex:
+    def __init__(self, generation: str, vocab: dict[str, int], idf: Any, matrix: Any):
+        self.generation = generation
+        self.vocab = vocab
+        self.idf = idf
+        self.matrix = matrix  # (n_drugs x n_features), rows L2-normalized
+
+    @classmethod
+    def build(
+        cls, drugs: tuple[dict[str, Any], ...] | list[dict[str, Any]], generation: str
+    ) -> "VectorIndex":
+        if not vector_search_available():
+            raise VectorSearchUnavailable("Vector search requires numpy and scipy")
+
+        counts = [char_ngrams(drug_text(drug)) for drug in drugs]
+        vocab: dict[str, int] = {}
+        for grams in counts:
+            for gram in grams:
+                vocab.setdefault(gram, len(vocab))
+
+        rows, cols, values = [], [], []
+        for row, grams in enumerate(counts):
+            for gram, count in grams.items():
+                rows.append(row)
+                cols.append(vocab[gram])
+                values.append(1.0 + math.log(count))
+
+        tf = sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float32), (rows, cols)),
+            shape=(len(drugs), len(vocab)),
+            dtype=np.float32,
+        )
+        df = np.bincount(tf.indices, minlength=len(vocab))
+        idf = (np.log((1 + len(drugs)) / (1 + df)) + 1.0).astype(np.float32)
+        matrix = _l2_normalize(tf.multiply(idf).tocsr())
+        return cls(generation, vocab, idf, matrix)
+
+    def vectorize(self, queries: list[str]) -> Any:
+        rows, cols, values = [], [], []
+        for row, query in enumerate(queries):
+            for gram, count in char_ngrams(query).items():
+                col = self.vocab.get(gram)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    values.append((1.0 + math.log(count)) * float(self.idf[col]))
+        vectors = sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float32), (rows, cols)),
+            shape=(len(queries), len(self.vocab)),
+            dtype=np.float32,
+        )
+        return _l2_normalize(vectors)
+
+    def search_many(
+        self,
+        queries: list[str],
+        k: int,
+        min_similarity: float = MIN_SIMILARITY,
+        rows: list[int] | None = None,
+    ) -> list[list[tuple[int, float]]]:
+        """Cosine top-k (row index, similarity) for each query, best first.
+
+        ``rows``, if given, limits the candidates to those row indexes.
+        """
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if not queries or k <= 0 or matrix.shape[0] == 0:
+            return [[] for _ in queries]
+
+        scores = (self.vectorize(queries) @ matrix.T).toarray()
+        k = min(k, scores.shape[1])
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.lexsort((top, -row[top]))]
+            results.append(
+                [
+                    (int(i) if rows is None else rows[i], float(row[i]))
+                    for i in top
+                    if row[i] >= min_similarity
+                ]
+            )
+        return results
+
+    def search(self, query: str, k: int, rows: list[int] | None = None) -> list[tuple[int, float]]:
+        return self.search_many([query], k, rows=rows)[0]
+
+    def save(self, path: str) -> None:
+        """Write the index to ``path`` atomically in a memory-mappable layout."""
+        arrays = {
+            "idf": self.idf,
+            "data": self.matrix.data.astype(np.float32),
+            "indices": self.matrix.indices.astype(np.int32),
+            "indptr": self.matrix.indptr.astype(np.int64),
+        }
+        header: dict[str, Any] = {
+            "version": FORMAT_VERSION,
+            "generation": self.generation,
+            "shape": list(self.matrix.shape),
+            "vocab": self.vocab,
+            "arrays": {},
+        }
+        # Offsets are relative to the end of the header, which is padded to _ALIGN
+        offset = 0
+        for name, array in arrays.items():
+            header["arrays"][name] = [offset, array.dtype.str, len(array)]
+            offset += _aligned(array.nbytes)
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        header_bytes += b" " * (_aligned(len(header_bytes)) - len(header_bytes))
+
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER_SIZE.pack(len(header_bytes)))
+            f.write(header_bytes)
+            for array in arrays.values():
+                raw = array.tobytes()
+                f.write(raw + b"\0" * (_aligned(len(raw)) - len(raw)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex | None":
+        """Memory-map a saved index; returns None if missing or unreadable."""
+        if not vector_search_available():
+            raise VectorSearchUnavailable("Vector search requires numpy and scipy")
+        try:
+            with open(path, "rb") as f:
+                (header_size,) = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))
+                header = json.loads(f.read(header_size))
+        except (OSError, ValueError, struct.error):
+            return None
+        if header.get("version") != FORMAT_VERSION:
+            return None
+
+        base = _HEADER_SIZE.size + header_size
+        arrays = {}
+        for name, (offset, dtype, length) in header["arrays"].items():
+            if length == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode="r", offset=base + offset, shape=(length,)
+            )
+
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(header["shape"]),
+            copy=False,
+        )
+        return cls(header["generation"], header["vocab"], arrays["idf"], matrix)
+
+
+def load_or_build(
+    path: str, drugs: tuple[dict[str, Any], ...] | list[dict[str, Any]], generation: str
+) -> VectorIndex:
+    """Reuse the persisted index for this generation, rebuilding it if stale."""
+    index = VectorIndex.load(path)
+    if index is not None and index.generation == generation:
+        return index
+
+    index = VectorIndex.build(drugs, generation)
+    try:
+        index.save(path)
+    except OSError as e:
+        logger.warning(f"Could not persist vector index to {path}: {e}")
+    logger.info(f"Built vector index for {len(drugs)} drugs ({len(index.vocab)} n-grams)")
+    return index
+
+
+def _aligned(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _l2_normalize(matrix: Any) -> Any:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr().astype(np.float32)
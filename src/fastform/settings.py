@@ -8,11 +8,60 @@ class Settings(BaseSettings):
 
     # Database file path (can be overridden in tests or via env)
     db_path: str = "fastform.db"
+    # Pooled read connections per database, and how long retired generation
+    # files (fastform.<n>.db) are kept for readers still using them
+    db_pool_size: int = 8
+    db_generation_grace_s: float = 60.0
+    # Memory-mapped vector index for mode=vector search (default: <db_path>.vectors)
+    vector_index_path: str | None = None
+    # Compressed archive of coverage history (default: <db_path>.archive), and
+    # how many months of superseded coverage stay in the main database
+    archive_db_path: str | None = None
+    coverage_archive_months: int = 12
 
     # External integrations / secrets
     openai_api_key: str | None = None
     fastform_api_token: str | None = None
 
+    # OpenAI client (one pooled client per process)
+    openai_base_url: str | None = None
+    openai_model: str = "gpt-3.5-turbo"
+    openai_timeout_s: float = 30.0
+    openai_connect_timeout_s: float = 5.0
+    openai_max_connections: int = 20
+    openai_max_keepalive_connections: int = 10
+    openai_keepalive_expiry_s: float = 60.0
+    openai_max_retries: int = 1
+
+    # Intelligent search: drugs sent to the LLM after local prefiltering
+    ai_candidate_count: int = 25
+    # Latency budget for the LLM path before falling back to local matches
+    ai_search_budget_ms: int = 4000
+    # Start a second identical completion after this delay (None disables hedging)
+    ai_hedge_delay_ms: int | None = None
+    ai_breaker_failure_threshold: int = 5
+    ai_breaker_reset_s: float = 30.0
+    # Micro-batch queries arriving within this window into one completion (0 disables)
+    ai_batch_window_ms: int = 0
+    ai_batch_max_queries: int = 8
+
+    # Cache of parsed LLM answers (memory LRU in front of SQLite; empty path = memory only)
+    llm_cache_path: str | None = "fastform_llm_cache.db"
+    llm_cache_ttl_s: float = 7 * 24 * 3600
+    llm_cache_memory_entries: int = 1024
+    llm_cache_disk_entries: int = 100_000
+
+    # Formulary update runner: requests in flight overall, and per-insurer rate limit
+    update_max_concurrency: int = 8
+    update_insurer_rate_per_s: float = 2.0
+    update_insurer_burst: int = 2
+    update_timeout_s: float = 30.0
+    # In-app scheduler (off by default; scripts/update_formularies.py works either way)
+    update_scheduler_enabled: bool = False
+    update_jitter_s: float = 300.0
+    update_min_interval_s: float = 300.0
+    update_max_interval_s: float = 3600.0
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
     @property
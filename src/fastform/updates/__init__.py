@@ -0,0 +1 @@
+"""Synchronization of formulary data from insurer APIs."""
@@ -0,0 +1,575 @@
+"""
+Concurrent formulary updates.
+
+Plans are fetched concurrently: a global semaphore caps the requests in flight
+and a token bucket per insurer keeps each API under its rate limit. Every
+fetched drug list (or fetch failure) goes onto a queue drained by a single
+writer task, so SQLite never sees more than one writer however many fetches
+are running.
+
+An insurer API returns the plan's complete drug list as JSON::
+
+    {"drugs": [{"ndc": "00071015523", "name": "Lipitor", "formulary_tier": 3,
+                "prior_authorization": false, ...}]}
+
+Covered drugs missing from the list are marked not covered. Listed drugs are
+matched to the shared catalog by NDC and their catalog attributes are left
+alone: a plan's list is a coverage list, not a drug record, so only drugs
+new to the catalog are added from it.
+
+Plans are only checked once their ``update_frequency`` has elapsed since
+``last_checked``. Checks are conditional: the stored ETag and Last-Modified go
+out as If-None-Match / If-Modified-Since, and a 304 or a body whose SHA-256
+matches the stored ``source_hash`` skips parsing and applying altogether; only
+the check time, validators and history row are written.
+
+Every check is recorded in ``formulary_updates`` with its outcome, sizes and
+fetch/parse/apply timings, so slow sources and stale plans show up in the
+history. The columns this relies on are added to older databases by the
+multi-formulary migration, not here.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any
+
+import httpx
+
+from fastform.equivalence import build_equivalence_groups
+from fastform.ingest.canonical import canonical_ndc
+from fastform.ingest.upsert import find_drug, upsert_coverage, upsert_drug
+from fastform.settings import settings
+from fastform.updates.ratelimit import TokenBucket
+
+# datetime.UTC is Python 3.11+
+UTC = timezone.utc  # noqa: UP017
+
+logger = logging.getLogger(__name__)
+
+# Coverage values compared to classify a listed drug as added or modified
+COVERAGE_FIELDS = (
+    "is_covered",
+    "formulary_tier",
+    "prior_authorization",
+    "quantity_limit",
+    "step_therapy",
+)
+
+UPDATE_INTERVALS = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "bi-weekly": timedelta(weeks=2),
+    "monthly": timedelta(days=30),
+    "quarterly": timedelta(days=91),
+}
+# Schema default for update_frequency
+DEFAULT_UPDATE_INTERVAL = UPDATE_INTERVALS["monthly"]
+
+
+class UpdateStatus(Enum):
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    UNCHANGED = "unchanged"
+    FAILED = "failed"
+
+
+@dataclass
+class FormularyUpdate:
+    formulary_id: int
+    plan_name: str
+    insurer: str
+    api_endpoint: str | None = None
+    status: UpdateStatus = UpdateStatus.PENDING
+    drugs_added: int = 0
+    drugs_modified: int = 0
+    drugs_removed: int = 0
+    error_message: str | None = None
+    started_at: str | None = None
+    bytes_fetched: int | None = None
+    rows_parsed: int | None = None
+    fetch_ms: float | None = None
+    parse_ms: float | None = None
+    apply_ms: float | None = None
+    # Validators of the last fetched payload; replaced by each successful fetch
+    source_etag: str | None = None
+    source_last_modified: str | None = None
+    source_hash: str | None = None
+
+
+# Fetched updates with their parsed drugs (None if there are none to apply),
+# then None once every fetch has finished
+UpdateQueue = asyncio.Queue[tuple[FormularyUpdate, list[dict[str, Any]] | None] | None]
+
+
+def utc_timestamp() -> str:
+    """Current time in SQLite's CURRENT_TIMESTAMP format."""
+    return datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def due_at(last_checked: str | None, frequency: str | None) -> datetime | None:
+    """When a formulary next needs checking; None if it never has been."""
+    if not last_checked:
+        return None
+    try:
+        checked_at = datetime.fromisoformat(last_checked)
+    except ValueError:
+        return None
+    if checked_at.tzinfo is None:
+        # CURRENT_TIMESTAMP values are UTC
+        checked_at = checked_at.replace(tzinfo=UTC)
+    return checked_at + UPDATE_INTERVALS.get(frequency or "", DEFAULT_UPDATE_INTERVAL)
+
+
+def parse_payload(
+    content: bytes, previous_hash: str | None
+) -> tuple[str, list[dict[str, Any]] | None]:
+    """Hash a fetched payload and parse its drug list, unless the hash is unchanged."""
+    payload_hash = hashlib.sha256(content).hexdigest()
+    if payload_hash == previous_hash:
+        return payload_hash, None
+    return payload_hash, json.loads(content)["drugs"]
+
+
+def apply_formulary_drugs(
+    conn: sqlite3.Connection, formulary_id: int, drugs: list[dict[str, Any]]
+) -> tuple[int, int, int]:
+    """Make ``drugs`` the formulary's covered list; returns (added, modified, removed)."""
+    current = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f"""
+            SELECT drug_id, {", ".join(COVERAGE_FIELDS)}
+            FROM formulary_coverage WHERE formulary_id = ?
+        """,
+            (formulary_id,),
+        )
+    }
+
+    added = modified = 0
+    listed: set[int] = set()
+    rows = []
+    for drug in drugs:
+        drug_id = find_drug(conn, canonical_ndc(drug.get("ndc")), None)
+        if drug_id is None:
+            drug_id = upsert_drug(conn, drug)
+        row = {
+            "formulary_id": formulary_id,
+            "drug_id": drug_id,
+            "is_covered": 1,
+            "formulary_tier": drug.get("formulary_tier"),
+            "prior_authorization": int(bool(drug.get("prior_authorization"))),
+            "quantity_limit": int(bool(drug.get("quantity_limit"))),
+            "step_therapy": int(bool(drug.get("step_therapy"))),
+        }
+        previous = current.get(drug_id)
+        if drug_id not in listed:
+            if previous is None or not previous[0]:
+                added += 1
+            elif previous != tuple(row[field] for field in COVERAGE_FIELDS):
+                modified += 1
+        listed.add(drug_id)
+        rows.append(row)
+    upsert_coverage(conn, rows)
+
+    removed = [
+        (formulary_id, drug_id)
+        for drug_id, values in current.items()
+        if values[0] and drug_id not in listed
+    ]
+    conn.executemany(
+        """
+        UPDATE formulary_coverage SET is_covered = 0, last_verified = CURRENT_TIMESTAMP
+        WHERE formulary_id = ? AND drug_id = ?
+    """,
+        removed,
+    )
+    return added, modified, len(removed)
+
+
+def record_source(conn: sqlite3.Connection, update: FormularyUpdate) -> None:
+    conn.execute(
+        """
+        UPDATE formularies
+        SET last_checked = CURRENT_TIMESTAMP,
+            source_etag = ?, source_last_modified = ?, source_hash = ?
+        WHERE id = ?
+    """,
+        (
+            update.source_etag,
+            update.source_last_modified,
+            update.source_hash,
+            update.formulary_id,
+        ),
+    )
+
+
+def record_update(conn: sqlite3.Connection, update: FormularyUpdate) -> None:
+    conn.execute(
+        """
+        INSERT INTO formulary_updates (
+            formulary_id, update_type, status, drugs_added, drugs_modified,
+            drugs_removed, rows_parsed, bytes_fetched, fetch_ms, parse_ms, apply_ms,
+            error_message, started_at, completed_at
+        ) VALUES (?, 'api_sync', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """,
+        (
+            update.formulary_id,
+            update.status.value,
+            update.drugs_added,
+            update.drugs_modified,
+            update.drugs_removed,
+            update.rows_parsed,
+            update.bytes_fetched,
+            update.fetch_ms,
+            update.parse_ms,
+            update.apply_ms,
+            update.error_message,
+            update.started_at,
+        ),
+    )
+
+
+def record_checks(conn: sqlite3.Connection, updates: list[FormularyUpdate]) -> None:
+    """Record checks that changed no coverage: the validators of unchanged
+    sources and a history row for every check."""
+    for update in updates:
+        if update.status == UpdateStatus.UNCHANGED:
+            record_source(conn, update)
+        record_update(conn, update)
+
+
+class FormularyUpdateManager:
+    def __init__(
+        self,
+        db_path: str,
+        max_concurrency: int | None = None,
+        insurer_rate_per_s: float | None = None,
+        insurer_burst: int | None = None,
+    ):
+        self.db_path = db_path
+        self.max_concurrency = max_concurrency or settings.update_max_concurrency
+        self.insurer_rate_per_s = insurer_rate_per_s or settings.update_insurer_rate_per_s
+        self.insurer_burst = insurer_burst or settings.update_insurer_burst
+        self._buckets: dict[str, TokenBucket] = {}
+
+    async def check_for_updates(self, force: bool = False) -> list[FormularyUpdate]:
+        """Return the active formularies due for a check (all of them if ``force``)."""
+        formularies = await asyncio.to_thread(self._active_formularies)
+
+        now = datetime.now(UTC)
+        return [
+            FormularyUpdate(
+                formulary_id=row["id"],
+                plan_name=row["plan_name"],
+                insurer=row["insurer"],
+                api_endpoint=row["api_endpoint"],
+                source_etag=row["source_etag"],
+                source_last_modified=row["source_last_modified"],
+                source_hash=row["source_hash"],
+            )
+            for row in formularies
+            if force or self._should_update(row["last_checked"], row["update_frequency"], now)
+        ]
+
+    def _active_formularies(self) -> list[sqlite3.Row]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            return conn.execute("""
+                SELECT id, plan_name, insurer, api_endpoint, update_frequency, last_checked,
+                       source_etag, source_last_modified, source_hash
+                FROM formularies
+                WHERE is_active = 1
+            """).fetchall()
+        finally:
+            conn.close()
+
+    def _should_update(
+        self, last_checked: str | None, frequency: str | None, now: datetime
+    ) -> bool:
+        """Whether the formulary's update interval has elapsed since its last check."""
+        due = due_at(last_checked, frequency)
+        return due is None or due <= now
+
+    def seconds_until_due(self) -> float:
+        """Time until the next active formulary is due for a check (0 if one already is).
+
+        Blocking; call it from a worker thread.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT last_checked, update_frequency FROM formularies WHERE is_active = 1"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        now = datetime.now(UTC)
+        wait = math.inf
+        for last_checked, frequency in rows:
+            due = due_at(last_checked, frequency)
+            if due is None:
+                return 0.0
+            wait = min(wait, max(0.0, (due - now).total_seconds()))
+        return wait
+
+    def _bucket(self, insurer: str) -> TokenBucket:
+        bucket = self._buckets.get(insurer)
+        if bucket is None:
+            bucket = TokenBucket(self.insurer_rate_per_s, self.insurer_burst)
+            self._buckets[insurer] = bucket
+        return bucket
+
+    async def process_updates(
+        self,
+        updates: list[FormularyUpdate],
+        begin_write: Callable[[], Awaitable[str]] | None = None,
+    ) -> None:
+        """Fetch all updates concurrently and apply them through a single writer.
+
+        Changes go to ``db_path``, or to the database whose path ``begin_write``
+        returns; it is awaited once, when the first changed source has been
+        fetched. If no source changed it is never called, and only the checks
+        are recorded in ``db_path``.
+
+        If the writer dies, the fetches still running are cancelled and its
+        error is raised, rather than leaving them blocked on the full queue.
+        """
+        queue: UpdateQueue = asyncio.Queue(maxsize=self.max_concurrency)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        writer = asyncio.create_task(self._write_updates(queue, begin_write))
+        try:
+            async with httpx.AsyncClient(timeout=settings.update_timeout_s) as client:
+                await _unless_writer_fails(
+                    asyncio.gather(
+                        *(
+                            self._fetch_update(client, semaphore, queue, update)
+                            for update in updates
+                        )
+                    ),
+                    writer,
+                )
+            await _unless_writer_fails(queue.put(None), writer)
+            await writer
+        finally:
+            if not writer.done():
+                writer.cancel()
+                with suppress(asyncio.CancelledError):
+                    await writer
+
+    async def _fetch_update(
+        self,
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        queue: UpdateQueue,
+        update: FormularyUpdate,
+    ) -> None:
+        update.status = UpdateStatus.IN_PROGRESS
+        update.started_at = utc_timestamp()
+        drugs = None
+        try:
+            if not update.api_endpoint:
+                raise ValueError("No API endpoint configured")
+            # Wait for the insurer's rate limit before taking a global slot, so a
+            # throttled insurer never holds slots other insurers could use
+            await self._bucket(update.insurer).acquire()
+            headers = {}
+            if update.source_etag:
+                headers["If-None-Match"] = update.source_etag
+            if update.source_last_modified:
+                headers["If-Modified-Since"] = update.source_last_modified
+            async with semaphore:
+                logger.info(f"Updating {update.plan_name} ({update.insurer})")
+                start = time.perf_counter()
+                response = await client.get(update.api_endpoint, headers=headers)
+                update.fetch_ms = (time.perf_counter() - start) * 1000
+            update.bytes_fetched = len(response.content)
+
+            if response.status_code == 304:
+                update.status = UpdateStatus.UNCHANGED
+            else:
+                response.raise_for_status()
+                # Large payloads would stall request handling sharing this event loop
+                start = time.perf_counter()
+                update.source_hash, drugs = await asyncio.to_thread(
+                    parse_payload, response.content, update.source_hash
+                )
+                update.parse_ms = (time.perf_counter() - start) * 1000
+                if drugs is None:
+                    update.status = UpdateStatus.UNCHANGED
+                else:
+                    update.rows_parsed = len(drugs)
+            # A 304 need not repeat the validators, so keep the stored ones
+            update.source_etag = response.headers.get("ETag", update.source_etag)
+            update.source_last_modified = response.headers.get(
+                "Last-Modified", update.source_last_modified
+            )
+        except Exception as e:
+            update.status = UpdateStatus.FAILED
+            update.error_message = str(e) or type(e).__name__
+        await queue.put((update, drugs))
+
+    async def _write_updates(
+        self, queue: UpdateQueue, begin_write: Callable[[], Awaitable[str]] | None = None
+    ) -> None:
+        # Checks with nothing to apply are held back until an update brings
+        # data, so a run in which nothing changed never calls begin_write
+        held: list[FormularyUpdate] = []
+        conn: sqlite3.Connection | None = None
+        try:
+            changed = False
+            while (item := await queue.get()) is not None:
+                update, drugs = item
+                if conn is None:
+                    if update.status in (UpdateStatus.UNCHANGED, UpdateStatus.FAILED):
+                        held.append(update)
+                        continue
+                    conn = await self._connect(begin_write)
+                    for held_update in held:
+                        await self._record(conn, held_update, None)
+                await self._record(conn, update, drugs)
+                changed = changed or update.status == UpdateStatus.COMPLETED
+            if conn is None:
+                # Nothing to apply: the checks are recorded in place
+                conn = await self._connect(None)
+                for held_update in held:
+                    await self._record(conn, held_update, None)
+            if changed:
+                # Alternatives are ranked from coverage, so re-rank once per run
+                await asyncio.to_thread(build_equivalence_groups, conn)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    async def _connect(
+        self, begin_write: Callable[[], Awaitable[str]] | None
+    ) -> sqlite3.Connection:
+        path = self.db_path if begin_write is None else await begin_write()
+        # One connection, used by one write at a time from a worker thread
+        return sqlite3.connect(path, check_same_thread=False)
+
+    async def _record(
+        self, conn: sqlite3.Connection, update: FormularyUpdate, drugs: list[dict[str, Any]] | None
+    ) -> None:
+        try:
+            await asyncio.to_thread(self._write_update, conn, update, drugs)
+        except Exception as e:
+            # Even the failure could not be recorded; keep draining the queue
+            update.status = UpdateStatus.FAILED
+            update.error_message = str(e) or type(e).__name__
+            logger.exception(f"❌ Could not record the update of {update.plan_name}")
+
+    def _write_update(
+        self, conn: sqlite3.Connection, update: FormularyUpdate, drugs: list[dict[str, Any]] | None
+    ) -> None:
+        if update.status == UpdateStatus.UNCHANGED:
+            with conn:
+                record_source(conn, update)
+                record_update(conn, update)
+            logger.info(f"✅ {update.plan_name}: unchanged")
+            return
+
+        try:
+            with conn:
+                if update.status != UpdateStatus.FAILED:
+                    # Fetched payloads that are neither unchanged nor failed carry drugs
+                    assert drugs is not None
+                    start = time.perf_counter()
+                    counts = apply_formulary_drugs(conn, update.formulary_id, drugs)
+                    update.drugs_added, update.drugs_modified, update.drugs_removed = counts
+                    update.apply_ms = (time.perf_counter() - start) * 1000
+                    conn.execute(
+                        "UPDATE formularies SET last_updated = CURRENT_TIMESTAMP WHERE id = ?",
+                        (update.formulary_id,),
+                    )
+                    record_source(conn, update)
+                    update.status = UpdateStatus.COMPLETED
+                record_update(conn, update)
+        except Exception as e:
+            update.status = UpdateStatus.FAILED
+            update.error_message = str(e) or type(e).__name__
+            update.drugs_added = update.drugs_modified = update.drugs_removed = 0
+            with conn:
+                record_update(conn, update)
+
+        if update.status == UpdateStatus.COMPLETED:
+            logger.info(
+                f"✅ {update.plan_name}: +{update.drugs_added}, "
+                f"~{update.drugs_modified}, -{update.drugs_removed}"
+            )
+        else:
+            logger.error(f"❌ Failed to update {update.plan_name}: {update.error_message}")
+
+
+async def _unless_writer_fails(work: Awaitable[Any], writer: asyncio.Task[None]) -> None:
+    """Await ``work``, unless the writer task ends first: then cancel ``work``
+    and raise the writer's error."""
+    task = asyncio.ensure_future(work)
+    try:
+        await asyncio.wait({task, writer}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        finished = task.done()
+        if not finished:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    if not finished:
+        writer.result()
+        raise RuntimeError("Update writer stopped before the queue was drained")
+    task.result()
+
+
+async def run_formulary_updates(
+    db_path: str = "fastform.db",
+    force: bool = False,
+    begin_write: Callable[[], Awaitable[str]] | None = None,
+) -> list[FormularyUpdate]:
+    """Run automated formulary updates (see ``process_updates`` for ``begin_write``)."""
+    logger.info("🔄 Starting automated formulary update process...")
+
+    manager = FormularyUpdateManager(db_path)
+
+    # Check for needed updates
+    updates_needed = await manager.check_for_updates(force)
+
+    if not updates_needed:
+        logger.info("✅ All formularies are up to date")
+        return []
+
+    logger.info(f"📋 Found {len(updates_needed)} formularies needing updates")
+
+    # Process updates
+    await manager.process_updates(updates_needed, begin_write)
+
+    # Summary
+    completed = [u for u in updates_needed if u.status == UpdateStatus.COMPLETED]
+    unchanged = len([u for u in updates_needed if u.status == UpdateStatus.UNCHANGED])
+    failed = len([u for u in updates_needed if u.status == UpdateStatus.FAILED])
+
+    logger.info("\n📊 Update Summary:")
+    logger.info(f"  ✅ Successful: {len(completed)}")
+    logger.info(f"  ⏭️ Unchanged: {unchanged}")
+    logger.info(f"  ❌ Failed: {failed}")
+
+    if completed:
+        total_added = sum(u.drugs_added for u in completed)
+        total_modified = sum(u.drugs_modified for u in completed)
+        total_removed = sum(u.drugs_removed for u in completed)
+
+        logger.info(
+            f"  📈 Total changes: +{total_added} drugs, ~{total_modified} modified, "
+            f"-{total_removed} removed"
+        )
+
+    return updates_needed
@@ -0,0 +1,39 @@
+"""
+Per-insurer request rate limiting.
+
+Each insurer API gets its own ``TokenBucket``: up to ``capacity`` requests go
+out immediately, after which callers wait for tokens that refill at ``rate``
+per second. Buckets are only shared within one event loop, so no lock is
+needed; a waiter simply re-checks after sleeping.
+"""
+
+import asyncio
+import time
+from collections.abc import Callable
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
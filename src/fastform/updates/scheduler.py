@@ -0,0 +1,150 @@
+"""
+In-app formulary update scheduler.
+
+Updates never write to the database the API is reading. Due plans are synced
+into a new generation of the database (a side copy, see ``fastform.db``),
+which is then published atomically. Requests already running keep their
+connection to the old file; new connections, and the per-generation caches
+keyed on ``data_generation``, pick up the new one without a restart. The side
+copy is only made once a fetched source turns out to have changed, so a run in
+which every source is unchanged copies and publishes nothing: only the check
+bookkeeping is written to the live database.
+
+``UpdateScheduler`` runs this from the FastAPI lifespan. It sleeps until the
+next plan is due per its ``update_frequency``, plus random jitter so several
+processes do not all hit the insurer APIs at the same moment.
+"""
+
+import asyncio
+import logging
+import random
+import sqlite3
+from contextlib import suppress
+
+from fastform.db import WriterLock, begin_generation, publish_generation, remove_database
+from fastform.settings import settings
+from fastform.updates.manager import (
+    FormularyUpdate,
+    FormularyUpdateManager,
+    UpdateStatus,
+    record_checks,
+    run_formulary_updates,
+)
+
+logger = logging.getLogger(__name__)
+
+# How often to retry while another writer holds the database's lock
+LOCK_POLL_S = 0.5
+
+
+async def update_in_side_file(db_path: str, force: bool = False) -> list[FormularyUpdate]:
+    """Run the due updates against a new generation of ``db_path`` and publish it.
+
+    Nothing is copied unless a source changed, and nothing is published unless
+    a plan was updated. If the run fails or is cancelled, the side file is
+    discarded and ``db_path`` keeps its data. Other writers of ``db_path`` wait
+    for the run.
+    """
+    if not force and not await FormularyUpdateManager(db_path).check_for_updates():
+        return []
+
+    # Polled rather than blocking, so cancelling the wait cannot leak the lock
+    lock = WriterLock(db_path)
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(LOCK_POLL_S)
+    try:
+        side_path: str | None = None
+
+        async def begin_side_file() -> str:
+            nonlocal side_path
+            side_path = await asyncio.to_thread(begin_generation, db_path)
+            return side_path
+
+        published = False
+        try:
+            updates = await run_formulary_updates(db_path, force, begin_side_file)
+            if side_path and any(update.status == UpdateStatus.COMPLETED for update in updates):
+                await asyncio.to_thread(publish_generation, side_path, db_path)
+                published = True
+        finally:
+            if side_path and not published:
+                remove_database(side_path)
+
+        if side_path is None:
+            logger.info(f"No formulary changed; recorded {len(updates)} checks in {db_path}")
+            return updates
+        if not published:
+            # No change could be applied: keep the live generation, and every
+            # cache keyed on it
+            await asyncio.to_thread(_record_checks_in_place, db_path, updates)
+            logger.info(f"No formulary updated; recorded {len(updates)} checks in {db_path}")
+            return updates
+    finally:
+        lock.release()
+    logger.info(f"Published formulary updates to {db_path}")
+    return updates
+
+
+def _record_checks_in_place(db_path: str, updates: list[FormularyUpdate]) -> None:
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            record_checks(conn, updates)
+    finally:
+        conn.close()
+
+
+class UpdateScheduler:
+    def __init__(
+        self,
+        db_path: str,
+        jitter_s: float | None = None,
+        min_interval_s: float | None = None,
+        max_interval_s: float | None = None,
+        rng: random.Random | None = None,
+    ):
+        self.db_path = db_path
+        self.jitter_s = settings.update_jitter_s if jitter_s is None else jitter_s
+        self.min_interval_s = (
+            settings.update_min_interval_s if min_interval_s is None else min_interval_s
+        )
+        self.max_interval_s = (
+            settings.update_max_interval_s if max_interval_s is None else max_interval_s
+        )
+        self.rng = rng or random.Random()
+        self.runs = 0
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def next_delay(self) -> float:
+        """Seconds to sleep before the next run."""
+        due_in = await asyncio.to_thread(FormularyUpdateManager(self.db_path).seconds_until_due)
+        # At least min_interval_s, so plans that keep failing are not retried in a
+        # tight loop; at most max_interval_s, so new or edited plans get noticed
+        delay = min(max(due_in, self.min_interval_s), self.max_interval_s)
+        return delay + self.rng.uniform(0, self.jitter_s)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delay = await self.next_delay()
+            except Exception:
+                logger.exception("Could not read the formulary update schedule")
+                delay = self.max_interval_s
+            await asyncio.sleep(delay)
+
+            try:
+                await update_in_side_file(self.db_path)
+            except Exception:
+                logger.exception("Scheduled formulary update failed")
+            self.runs += 1
@@ -1,6 +1,221 @@
+import json
 import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+import pytest
+
 # Add src directory to Python path for imports
 src_path = Path(__file__).parent.parent / "src"
 sys.path.insert(0, str(src_path))
+# Data scripts are imported as modules by their tests
+scripts_path = Path(__file__).parent.parent / "scripts"
+sys.path.insert(0, str(scripts_path))
+
+from fastform.settings import settings  # noqa: E402
+
+
+class OpenAIStub:
+    """Local stand-in for the OpenAI chat completions API."""
+
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        self.delay = 0.0
+        self.reply = lambda body: "[]"
+        self.stream_chunk_size = 8
+        self.stream_delay = 0.0
+        self.lock = threading.Lock()
+
+    def handle(self, body, client_address):
+        with self.lock:
+            attempt = len(self.requests)
+            self.requests.append(body)
+            self.connections.add(client_address)
+        # delay may be a number or a function of the request index
+        time.sleep(self.delay(attempt) if callable(self.delay) else self.delay)
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply(body)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm_cache(tmp_path):
+    """Keep cached LLM answers out of the working directory and between tests"""
+    original = settings.llm_cache_path
+    settings.llm_cache_path = str(tmp_path / "llm_cache.db")
+    yield settings.llm_cache_path
+    settings.llm_cache_path = original
+
+
+@pytest.fixture
+def openai_stub():
+    """Run a local OpenAI-compatible server and point the settings at it"""
+    stub = OpenAIStub()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            completion = stub.handle(body, self.client_address)
+            if body.get("stream"):
+                self._stream(completion)
+                return
+            payload = json.dumps(completion).encode()
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client gave up (deadline, hedging or cancellation)
+                self.close_connection = True
+
+        def _stream(self, completion):
+            # Server-sent chat.completion.chunk events, a few characters at a time
+            content = completion["choices"][0]["message"]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for start in range(0, len(content), stub.stream_chunk_size):
+                    chunk = {
+                        "id": completion["id"],
+                        "object": "chat.completion.chunk",
+                        "created": 0,
+                        "model": completion["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {
+                                    "content": content[start : start + stub.stream_chunk_size]
+                                },
+                                "finish_reason": None,
+                            }
+                        ],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.stream_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    original = (settings.openai_api_key, settings.openai_base_url)
+    settings.openai_api_key = "test-key"
+    settings.openai_base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield stub
+
+    settings.openai_api_key, settings.openai_base_url = original
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """Small seeded synthetic formulary database, generated once per test session"""
+    pytest.importorskip("numpy")
+    from generate_synthetic_formulary import generate
+
+    db_path = str(tmp_path_factory.mktemp("synthetic") / "synthetic.db")
+    generate(db_path, drugs=300, formularies=8, seed=11)
+    return db_path
+
+
+class InsurerStub:
+    """Local stand-in for insurer formulary APIs, one drug list per path."""
+
+    def __init__(self):
+        self.formularies: dict[str, list[dict]] = {}
+        self.failing: set[str] = set()
+        # Send ETags and answer If-None-Match with 304
+        self.conditional = True
+        self.delay = 0.0
+        self.requests: list[tuple[float, str]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.base_url = ""
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def handle(self, path: str, if_none_match: str | None) -> tuple[int, bytes, dict]:
+        with self.lock:
+            self.requests.append((time.monotonic(), path))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if path in self.failing or path not in self.formularies:
+            return 503, b'{"error": "unavailable"}', {}
+        payload = json.dumps({"drugs": self.formularies[path]}).encode()
+        if not self.conditional:
+            return 200, payload, {}
+        etag = f'"{hash(payload) & 0xFFFFFFFF:x}"'
+        if if_none_match == etag:
+            return 304, b"", {"ETag": etag}
+        return 200, payload, {"ETag": etag}
+
+
+@pytest.fixture
+def insurer_stub():
+    """Run a local insurer formulary API with configurable latency and failures"""
+    stub = InsurerStub()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, payload, headers = stub.handle(
+                self.path.lstrip("/"), self.headers.get("If-None-Match")
+            )
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stub.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield stub
+
+    server.shutdown()
+    server.server_close()
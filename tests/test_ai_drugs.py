@@ -0,0 +1,391 @@
+import asyncio
+import json
+import re
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.ai.client import close_openai_client
+from fastform.ai.resilience import CircuitBreaker
+from fastform.api.app import app
+from fastform.api.routes import ai_drugs
+from fastform.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker():
+    """Start every test with a closed circuit breaker"""
+    ai_drugs._breaker.reset()
+    yield
+    ai_drugs._breaker.reset()
+
+
+@pytest.fixture
+def ai_db():
+    """Create a temporary drug_rules database for intelligent search"""
+    with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as f:
+        db_path = f.name
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE drug_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            dosage_form TEXT,
+            strength_qty REAL,
+            strength_unit TEXT,
+            route TEXT,
+            generic_name TEXT,
+            brand_name TEXT,
+            ndc TEXT,
+            formulary_tier INTEGER,
+            prior_authorization BOOLEAN DEFAULT 0,
+            quantity_limit BOOLEAN DEFAULT 0,
+            step_therapy BOOLEAN DEFAULT 0
+        )
+    """)
+    conn.executemany(
+        """
+        INSERT INTO drug_rules (name, dosage_form, strength_qty, strength_unit, route,
+                                generic_name, brand_name, ndc, formulary_tier)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        [
+            ("Ibuprofen", "tablet", 200.0, "mg", "oral", "ibuprofen", "Advil", "1-1", 1),
+            ("Acetaminophen", "tablet", 500.0, "mg", "oral", "acetaminophen", "Tylenol", "1-2", 1),
+            ("Metformin", "tablet", 500.0, "mg", "oral", "metformin", "Glucophage", "1-3", 1),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    original_db_path = settings.db_path
+    settings.db_path = db_path
+
+    yield db_path
+
+    settings.db_path = original_db_path
+    Path(db_path).unlink()
+
+
+def test_intelligent_search_uses_stub(ai_db, openai_stub):
+    """Test the search awaits the completion and maps it to catalog rows"""
+    openai_stub.reply = lambda body: json.dumps(
+        [{"medication_name": "Ibuprofen", "confidence": 0.95, "reason": "Brand name"}]
+    )
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["name"] == "Ibuprofen"
+    assert data[0]["match_confidence"] == 0.95
+    assert openai_stub.requests[0]["model"] == settings.openai_model
+
+
+def test_intelligent_search_skips_malformed_confidence(ai_db, openai_stub):
+    """Test suggestions with a non-numeric confidence are dropped instead of failing"""
+    openai_stub.reply = lambda body: json.dumps(
+        [
+            {"medication_name": "Ibuprofen", "confidence": "high"},
+            {"medication_name": "Metformin", "confidence": None},
+            {"medication_name": "Acetaminophen", "confidence": 7, "reason": None},
+        ]
+    )
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [d["name"] for d in data] == ["Acetaminophen"]
+    assert data[0]["match_confidence"] <= 1.0
+    assert data[0]["match_reason"] == "AI suggested match"
+
+
+def test_intelligent_search_prefilters_candidates(ai_db, openai_stub):
+    """Test only locally plausible drugs are sent in the prompt"""
+    with TestClient(app) as client:
+        client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    prompt = openai_stub.requests[0]["messages"][1]["content"]
+    assert "Ibuprofen" in prompt
+    assert "Glucophage" not in prompt
+    assert "\\n" not in prompt
+
+
+def test_intelligent_search_reuses_connection(ai_db, openai_stub):
+    """Test consecutive searches share one pooled keep-alive connection"""
+    with TestClient(app) as client:
+        for query in ("advil", "tylenol", "metformin"):
+            assert client.post("/v1/drugs/intelligent-search", json={"query": query}).is_success
+
+    assert len(openai_stub.requests) == 3
+    assert len(openai_stub.connections) == 1
+
+
+def test_intelligent_search_upstream_error_falls_back(ai_db, openai_stub):
+    """Test an unreachable API is served from local matches instead of a 503"""
+    settings.openai_base_url = "http://127.0.0.1:9/v1"
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    assert response.status_code == 200
+    assert response.headers["x-search-path"] == "fallback"
+    assert response.json()[0]["name"] == "Ibuprofen"
+
+
+def test_intelligent_search_budget_exceeded(ai_db, openai_stub, monkeypatch):
+    """Test a slow completion is cut off at the latency budget"""
+    monkeypatch.setattr(settings, "ai_search_budget_ms", 100)
+    openai_stub.delay = 0.5
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "tylenol"})
+
+    assert response.headers["x-search-path"] == "fallback"
+    assert response.json()[0]["name"] == "Acetaminophen"
+    assert response.json()[0]["match_reason"] == "Local match"
+
+
+def test_intelligent_search_open_circuit_skips_upstream(ai_db, openai_stub, monkeypatch):
+    """Test repeated failures open the breaker and stop upstream calls"""
+    monkeypatch.setattr(ai_drugs._breaker, "failure_threshold", 1)
+    # Room for the first request to reach the stub on a cold client
+    monkeypatch.setattr(settings, "ai_search_budget_ms", 300)
+    openai_stub.delay = 1.0
+
+    with TestClient(app) as client:
+        client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "metformin"})
+
+    assert response.headers["x-search-path"] == "fallback"
+    assert len(openai_stub.requests) == 1
+
+
+def test_breaker_readmits_probe_that_never_reported():
+    """Test a probe abandoned without an outcome does not keep the circuit shut"""
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10.0
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    now[0] = 20.0
+    assert breaker.allow()
+
+
+def test_breaker_guard_counts_unexpected_error_as_failure():
+    """Test an unexpected error in the guarded call opens the circuit"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=10)
+    with pytest.raises(AttributeError), breaker.guard():
+        raise AttributeError
+    assert breaker.state == breaker.OPEN
+
+    breaker.opened_at -= 10
+    assert breaker.allow()
+    with breaker.guard():
+        pass
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_guard_ignores_cancellation():
+    """Test abandoned calls neither open the circuit nor keep a probe slot"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=10)
+    for error in (asyncio.CancelledError, GeneratorExit):
+        with pytest.raises(error), breaker.guard():
+            raise error
+        assert breaker.state == breaker.CLOSED
+        assert breaker.failures == 0
+
+    breaker.record_failure()
+    breaker.opened_at -= 10
+    assert breaker.allow()
+    with pytest.raises(asyncio.CancelledError), breaker.guard():
+        raise asyncio.CancelledError
+    assert breaker.state == breaker.OPEN
+    # The abandoned probe's slot is free again
+    assert breaker.allow()
+
+
+def test_intelligent_search_empty_content_closes_probe(ai_db, openai_stub):
+    """Test a reply without content still records the probe outcome"""
+    ai_drugs._breaker.state = ai_drugs._breaker.OPEN
+    ai_drugs._breaker.opened_at = ai_drugs._breaker.clock() - ai_drugs._breaker.reset_timeout_s
+    openai_stub.reply = lambda body: None
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    assert response.status_code == 200
+    assert ai_drugs._breaker.state == ai_drugs._breaker.CLOSED
+
+
+def test_intelligent_search_hedged_request(ai_db, openai_stub, monkeypatch):
+    """Test a hedged second request answers when the first one stalls"""
+    monkeypatch.setattr(settings, "ai_hedge_delay_ms", 50)
+    monkeypatch.setattr(settings, "ai_search_budget_ms", 1000)
+    openai_stub.delay = lambda attempt: 2.0 if attempt == 0 else 0.0
+    openai_stub.reply = lambda body: json.dumps(
+        [{"medication_name": "Ibuprofen", "confidence": 0.9, "reason": "Brand name"}]
+    )
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+
+    assert response.headers["x-search-path"] == "llm"
+    assert response.json()[0]["match_confidence"] == 0.9
+    assert len(openai_stub.requests) == 2
+
+
+def test_intelligent_search_cached_answer(ai_db, openai_stub):
+    """Test near-identical queries are answered from the cache"""
+    openai_stub.reply = lambda body: json.dumps(
+        [{"medication_name": "Ibuprofen", "confidence": 0.9, "reason": "Brand name"}]
+    )
+
+    with TestClient(app) as client:
+        for query in ("advil", "Advil ", "ADVIL"):
+            response = client.post("/v1/drugs/intelligent-search", json={"query": query})
+            assert response.json()[0]["name"] == "Ibuprofen"
+
+    assert len(openai_stub.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_searches_coalesce(ai_db, openai_stub):
+    """Test N concurrent identical searches make exactly one upstream call"""
+    openai_stub.delay = 0.2
+    openai_stub.reply = lambda body: json.dumps(
+        [{"medication_name": "Ibuprofen", "confidence": 0.9, "reason": "Brand name"}]
+    )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *[
+                client.post("/v1/drugs/intelligent-search", json={"query": "advil"})
+                for _ in range(10)
+            ]
+        )
+    await close_openai_client()
+
+    assert all(response.json()[0]["name"] == "Ibuprofen" for response in responses)
+    assert len(openai_stub.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_distinct_searches_micro_batched(ai_db, openai_stub, monkeypatch):
+    """Test distinct concurrent queries are resolved by one batched completion"""
+    monkeypatch.setattr(settings, "ai_batch_window_ms", 50)
+    monkeypatch.setattr(ai_drugs._batcher, "window_s", 0.05)
+    names = {"advil": "Ibuprofen", "tylenol": "Acetaminophen", "glucophage": "Metformin"}
+
+    def reply(body):
+        prompt = body["messages"][1]["content"]
+        queries = re.findall(r'Query (\d+): "([^"]+)"', prompt)
+        return json.dumps(
+            {
+                index: [{"medication_name": names[query], "confidence": 0.9, "reason": "Brand"}]
+                for index, query in queries
+            }
+        )
+
+    openai_stub.reply = reply
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *[client.post("/v1/drugs/intelligent-search", json={"query": query}) for query in names]
+        )
+    await close_openai_client()
+
+    assert [response.json()[0]["name"] for response in responses] == list(names.values())
+    assert len(openai_stub.requests) == 1
+    assert openai_stub.requests[0]["response_format"] == {"type": "json_object"}
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_counts_as_one_failure(ai_db, openai_stub, monkeypatch):
+    """Test a failed batched completion records one breaker failure, not one per query"""
+    monkeypatch.setattr(settings, "ai_batch_window_ms", 50)
+    monkeypatch.setattr(ai_drugs._batcher, "window_s", 0.05)
+    monkeypatch.setattr(settings, "openai_max_retries", 0)
+    settings.openai_base_url = "http://127.0.0.1:9/v1"
+    queries = ["advil", "tylenol", "glucophage", "ibuprofen", "metformin", "acetaminophen"]
+    assert len(queries) > ai_drugs._breaker.failure_threshold
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *[client.post("/v1/drugs/intelligent-search", json={"query": q}) for q in queries]
+        )
+    await close_openai_client()
+
+    assert {response.headers["x-search-path"] for response in responses} == {"fallback"}
+    assert ai_drugs._breaker.failures == 1
+    assert ai_drugs._breaker.state == ai_drugs._breaker.CLOSED
+
+
+def read_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_streaming_search_sends_local_then_llm_matches(ai_db, openai_stub):
+    """Test SSE stream order: local matches, streamed LLM matches, done"""
+    openai_stub.reply = lambda body: json.dumps(
+        [
+            {"medication_name": "Ibuprofen", "confidence": 0.95, "reason": "Brand name"},
+            {"medication_name": "Acetaminophen", "confidence": 0.6, "reason": "Pain relief"},
+        ]
+    )
+
+    with TestClient(app) as client:
+        response = client.post("/v1/drugs/intelligent-search/stream", json={"query": "advil"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = read_events(response)
+
+        assert events[0][0] == "local"
+        assert events[0][1][0]["name"] == "Ibuprofen"
+        assert [data["name"] for event, data in events if event == "match"] == [
+            "Ibuprofen",
+            "Acetaminophen",
+        ]
+        assert events[-1] == ("done", {"path": "llm", "ids": [1, 2]})
+
+        # The streamed answer was cached for the next identical query
+        cached = read_events(
+            client.post("/v1/drugs/intelligent-search/stream", json={"query": "ADVIL"})
+        )
+
+    assert cached[-1][1]["path"] == "cache"
+    assert len(openai_stub.requests) == 1
+    assert openai_stub.requests[0]["stream"] is True
+
+
+def test_streaming_search_budget_exceeded(ai_db, openai_stub, monkeypatch):
+    """Test a stalled stream ends with the fallback path after local matches"""
+    monkeypatch.setattr(settings, "ai_search_budget_ms", 200)
+    openai_stub.stream_delay = 0.1
+    openai_stub.reply = lambda body: json.dumps(
+        [{"medication_name": "Ibuprofen", "confidence": 0.95, "reason": "Brand name"}]
+    )
+
+    with TestClient(app) as client:
+        events = read_events(
+            client.post("/v1/drugs/intelligent-search/stream", json={"query": "advil"})
+        )
+
+    assert events[0][0] == "local"
+    assert events[-1] == ("done", {"path": "fallback", "ids": []})
@@ -0,0 +1,135 @@
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.api.app import app
+from fastform.equivalence import build_equivalence_groups
+from fastform.settings import settings
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def multi_formulary_db():
+    """Create a temporary multi-formulary database with precomputed equivalence groups"""
+    with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as f:
+        db_path = f.name
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE drugs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            generic_name TEXT,
+            brand_name TEXT,
+            ndc TEXT,
+            dosage_form TEXT,
+            strength_qty REAL,
+            strength_unit TEXT,
+            route TEXT,
+            drug_class TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE formulary_coverage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            formulary_id INTEGER NOT NULL,
+            drug_id INTEGER NOT NULL,
+            is_covered BOOLEAN DEFAULT 1,
+            formulary_tier INTEGER,
+            prior_authorization BOOLEAN DEFAULT 0,
+            quantity_limit BOOLEAN DEFAULT 0,
+            step_therapy BOOLEAN DEFAULT 0,
+            UNIQUE(formulary_id, drug_id)
+        )
+    """)
+    conn.executemany(
+        """
+        INSERT INTO drugs (id, name, generic_name, brand_name, dosage_form,
+                           strength_qty, strength_unit, route, drug_class)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        [
+            (1, "Lipitor", "atorvastatin", "Lipitor", "tablet", 20.0, "mg", "oral", "statin"),
+            (2, "Atorvastatin", "atorvastatin", None, "tablet", 20.0, "mg", "oral", "statin"),
+            (3, "Simvastatin", "simvastatin", "Zocor", "tablet", 20.0, "mg", "oral", "statin"),
+            (4, "Crestor", "rosuvastatin", "Crestor", "tablet", 10.0, "mg", "oral", "statin"),
+        ],
+    )
+    conn.executemany(
+        """
+        INSERT INTO formulary_coverage (formulary_id, drug_id, is_covered, formulary_tier,
+                                        prior_authorization)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        [
+            (1, 1, 1, 3, 1),
+            (1, 2, 1, 1, 0),
+            (1, 3, 1, 1, 0),
+            (1, 4, 0, 2, 0),
+            (2, 1, 1, 2, 0),
+            (2, 3, 1, 3, 0),
+        ],
+    )
+    conn.commit()
+    build_equivalence_groups(conn)
+    conn.close()
+
+    original_db_path = settings.db_path
+    settings.db_path = db_path
+
+    yield db_path
+
+    settings.db_path = original_db_path
+    Path(db_path).unlink()
+
+
+def test_alternatives_prefers_same_generic(multi_formulary_db):
+    """Test same-ingredient alternatives are listed before same-class ones"""
+    response = client.get("/v1/drugs/1/alternatives", params={"formulary_id": 1})
+    assert response.status_code == 200
+    data = response.json()
+    assert [d["id"] for d in data] == [2, 3]
+    assert data[0]["equivalence"] == "generic"
+    assert data[0]["formulary_tier"] == 1
+    assert data[1]["equivalence"] == "class"
+
+
+def test_alternatives_excludes_uncovered_and_other_formularies(multi_formulary_db):
+    """Test only covered drugs from the requested formulary are returned"""
+    response = client.get("/v1/drugs/3/alternatives", params={"formulary_id": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert [d["id"] for d in data] == [1]
+
+
+def test_alternatives_unknown_drug(multi_formulary_db):
+    """Test unknown drug id returns 404"""
+    response = client.get("/v1/drugs/999/alternatives", params={"formulary_id": 1})
+    assert response.status_code == 404
+
+
+def test_search_results_link_to_alternatives(multi_formulary_db):
+    """Test text search returns the catalog drug id that /alternatives takes"""
+    conn = sqlite3.connect(multi_formulary_db)
+    conn.execute("UPDATE drugs SET ndc = '00071015523' WHERE id = 1")
+    conn.execute("""
+        CREATE TABLE drug_rules (
+            id INTEGER PRIMARY KEY, name TEXT NOT NULL, generic_name TEXT, brand_name TEXT,
+            ndc TEXT, strength_qty REAL, strength_unit TEXT, dosage_form TEXT,
+            formulary_tier INTEGER, prior_authorization BOOLEAN DEFAULT 0,
+            quantity_limit BOOLEAN DEFAULT 0, step_therapy BOOLEAN DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT INTO drug_rules (id, name, ndc) VALUES (7, 'Lipitor', '00071015523')")
+    conn.commit()
+    conn.close()
+
+    item = client.post("/v1/drugs/search", json={"query": "lipitor"}).json()[0]
+
+    assert (item["id"], item["drug_id"]) == (7, 1)
+    response = client.get(f"/v1/drugs/{item['drug_id']}/alternatives", params={"formulary_id": 1})
+    assert [d["id"] for d in response.json()] == [2, 3]
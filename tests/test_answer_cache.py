@@ -0,0 +1,45 @@
+import time
+
+from fastform.ai.cache import AnswerCache, answer_cache_key
+
+MATCHES = [{"medication_name": "Ibuprofen", "confidence": 0.9, "reason": "Brand name"}]
+
+
+def make_cache(path, **overrides):
+    options = {"ttl_s": 60.0, "max_memory_entries": 10, "max_disk_entries": 100}
+    options.update(overrides)
+    return AnswerCache(str(path), **options)
+
+
+def test_key_normalizes_query():
+    """Test case and spacing variants share a key, other models do not"""
+    key = answer_cache_key("advil", (1, 2), "gpt")
+    assert answer_cache_key(" ADVIL ", (1, 2), "gpt") == key
+    assert answer_cache_key("advil", (1, 3), "gpt") != key
+    assert answer_cache_key("advil", (1, 2), "other") != key
+
+
+def test_entries_survive_restart(tmp_path):
+    """Test answers written by one instance are read by the next"""
+    cache = make_cache(tmp_path / "cache.db")
+    cache.set("k", MATCHES)
+    cache.close()
+
+    assert make_cache(tmp_path / "cache.db").get("k") == MATCHES
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    """Test entries past their TTL are not returned"""
+    cache = make_cache(tmp_path / "cache.db", ttl_s=0.01)
+    cache.set("k", MATCHES)
+    time.sleep(0.02)
+    assert cache.get("k") is None
+
+
+def test_memory_lru_falls_back_to_disk(tmp_path):
+    """Test entries evicted from memory are still served from SQLite"""
+    cache = make_cache(tmp_path / "cache.db", max_memory_entries=1)
+    cache.set("a", MATCHES)
+    cache.set("b", [])
+    assert "a" not in cache._memory
+    assert cache.get("a") == MATCHES
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import pytest
+
+from fastform.ai.batching import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_items_in_window_share_one_call():
+    """Test items submitted within the window resolve from one handler call"""
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(handler, window_s=0.02, max_batch=100)
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(5)])
+
+    assert results == [0, 2, 4, 6, 8]
+    assert batches == [[0, 1, 2, 3, 4]]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting():
+    """Test a full batch is sent immediately instead of waiting for the window"""
+    batches = []
+
+    async def handler(items):
+        batches.append(items)
+        return items
+
+    batcher = MicroBatcher(handler, window_s=10.0, max_batch=3)
+    started = time.monotonic()
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(3)])
+
+    assert results == [0, 1, 2]
+    assert time.monotonic() - started < 1.0
+    assert len(batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_handler_error_reaches_every_submitter():
+    """Test a failing batch fails all of its submitters"""
+
+    async def handler(items):
+        raise RuntimeError("upstream down")
+
+    batcher = MicroBatcher(handler, window_s=0.01, max_batch=10)
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
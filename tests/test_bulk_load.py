@@ -0,0 +1,74 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from fastform.db import list_generations
+from fastform.ingest.bulk import bulk_load
+from fastform.ingest.cms import ingest_basic_drugs
+from fastform.schema import INGEST_LOOKUP_INDEXES, MULTI_FORMULARY_INDEXES, create_formulary_tables
+
+SAMPLE = Path(__file__).parent / "fixtures" / "cms" / "basic_drugs_formulary_sample.txt"
+
+
+@pytest.fixture
+def live_db(tmp_path):
+    """Existing WAL-mode database with the full schema and one drug"""
+    db_path = str(tmp_path / "fastform.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    create_formulary_tables(conn)
+    conn.execute("INSERT INTO drugs (name, ndc) VALUES ('Lipitor', '00071015523')")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def index_names(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_bulk_load_defers_indexes_and_swaps(live_db):
+    """Test loading into an unjournaled new generation that replaces the live file"""
+    original_inode = os.stat(live_db).st_ino
+
+    with bulk_load(live_db, keep_indexes=INGEST_LOOKUP_INDEXES) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "off"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0
+        assert "idx_drugs_name" not in index_names(conn)
+        assert set(INGEST_LOOKUP_INDEXES) <= index_names(conn)
+        ingest_basic_drugs(conn, SAMPLE)
+
+    assert os.stat(live_db).st_ino != original_inode
+    assert list(list_generations(live_db)) == [1]
+    assert not os.path.exists(f"{live_db}-wal")
+
+    conn = sqlite3.connect(live_db)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert set(MULTI_FORMULARY_INDEXES) <= index_names(conn)
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+        assert conn.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 18
+        # The NDC already in the catalog kept its drug row
+        assert conn.execute("SELECT id FROM drugs WHERE ndc = '00071015523'").fetchall() == [(1,)]
+    finally:
+        conn.close()
+
+
+def test_failed_bulk_load_leaves_database_untouched(live_db):
+    """Test an error during the load discards the new generation"""
+    original_inode = os.stat(live_db).st_ino
+
+    with pytest.raises(RuntimeError), bulk_load(live_db) as conn:
+        conn.execute("DELETE FROM drugs")
+        raise RuntimeError("bad file")
+
+    assert os.stat(live_db).st_ino == original_inode
+    assert list_generations(live_db) == {}
+    conn = sqlite3.connect(live_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 1
+        assert "idx_drugs_name" in index_names(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,246 @@
+import sqlite3
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from fastform.ingest import cms
+from fastform.ingest.canonical import product_key
+from fastform.ingest.cms import batched, ingest_basic_drugs, parse_rows
+from fastform.ingest.parallel import ingest_files
+
+SAMPLE = Path(__file__).parent / "fixtures" / "cms" / "basic_drugs_formulary_sample.txt"
+
+
+@pytest.fixture
+def cms_zip(tmp_path):
+    """Package the sample file the way CMS publishes it: a zip nested in a zip"""
+    inner = tmp_path / "basic drugs formulary file PPUF_2024Q1.zip"
+    with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(SAMPLE, "basic drugs formulary file PPUF_2024Q1.txt")
+
+    outer = tmp_path / "SPUF_2024_20240101.zip"
+    with zipfile.ZipFile(outer, "w") as archive:
+        archive.writestr("plan information PPUF_2024Q1.zip", b"")
+        archive.write(inner, inner.name)
+    return outer
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Empty database connection"""
+    conn = sqlite3.connect(tmp_path / "fastform.db")
+    yield conn
+    conn.close()
+
+
+def test_ingest_from_nested_zip(db, cms_zip):
+    """Test rows stream out of the nested CMS zip into the multi-formulary schema"""
+    stats = ingest_basic_drugs(db, cms_zip, batch_size=4)
+
+    assert stats.rows == 18
+    assert stats.skipped == 4
+    assert stats.batches == 5
+    assert stats.rows_per_s > 0
+
+    formularies = db.execute(
+        "SELECT data_source, coverage_year FROM formularies ORDER BY data_source"
+    ).fetchall()
+    assert formularies == [("cms:00024201", 2024), ("cms:00024312", 2024)]
+    assert db.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 10
+    assert db.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 18
+
+    row = db.execute("""
+        SELECT fc.formulary_tier, fc.prior_authorization, fc.quantity_limit, fc.step_therapy
+        FROM formulary_coverage fc
+        JOIN formularies f ON f.id = fc.formulary_id
+        JOIN drugs d ON d.id = fc.drug_id
+        WHERE f.data_source = 'cms:00024312' AND d.ndc = '61958220101'
+    """).fetchone()
+    assert row == (5, 1, 1, 1)
+
+
+def test_reingest_updates_in_place(db, tmp_path):
+    """Test loading a newer file updates coverage and reuses existing drugs"""
+    ingest_basic_drugs(db, SAMPLE)
+    db.execute("INSERT INTO drugs (name, ndc) VALUES ('Unrelated', '11111111111')")
+    db.commit()
+
+    updated = tmp_path / "basic_drugs.txt"
+    lines = SAMPLE.read_text().splitlines()
+    updated.write_text("\n".join([lines[0], lines[1].replace("|1|N|0|0|N|N", "|2|N|0|0|Y|N")]))
+    ingest_basic_drugs(db, updated)
+
+    assert db.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 11
+    assert db.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 18
+    assert db.execute("""
+        SELECT fc.formulary_tier, fc.prior_authorization
+        FROM formulary_coverage fc JOIN drugs d ON d.id = fc.drug_id
+        WHERE d.ndc = '00093505698' AND fc.formulary_id = 1
+    """).fetchone() == (2, 1)
+
+
+def test_ndcs_of_one_rxcui_share_a_drug(db, tmp_path):
+    """Test package NDCs of the same RxCUI merge into one catalog drug"""
+    path = tmp_path / "basic_drugs.txt"
+    header = SAMPLE.read_text().splitlines()[0]
+    path.write_text(
+        "\n".join(
+            [
+                header,
+                "00024201|12|2024|617310|00071015523|3|Y|30|30|N|N",
+                "00024201|12|2024|617310|00071015540|3|Y|30|30|N|N",
+                "00024312|8|2024|617310|00071015588|2|N|0|0|N|N",
+            ]
+        )
+    )
+    ingest_basic_drugs(db, path, batch_size=2)
+
+    assert db.execute("SELECT id, name, ndc, product_key FROM drugs").fetchall() == [
+        (1, "RxCUI 617310", "00071015523", product_key("RxCUI 617310", None, None, None))
+    ]
+    assert db.execute("SELECT alias, drug_id FROM drug_aliases ORDER BY alias").fetchall() == [
+        ("00071015540", 1),
+        ("00071015588", 1),
+    ]
+    assert db.execute(
+        "SELECT formulary_id, drug_id, formulary_tier FROM formulary_coverage"
+    ).fetchall() == [(1, 1, 3), (2, 1, 2)]
+
+
+def test_interrupted_ingest_resumes_after_last_chunk(db, tmp_path, monkeypatch):
+    """Test a rerun after a crash writes only the chunks that were not committed"""
+    write_batch = cms.write_batch
+    written = []
+
+    def crash_on_third(conn, batch):
+        if len(written) == 2:
+            raise RuntimeError("killed")
+        write_batch(conn, batch)
+        written.append(batch)
+
+    monkeypatch.setattr(cms, "write_batch", crash_on_third)
+    with pytest.raises(RuntimeError, match="killed"):
+        ingest_basic_drugs(db, SAMPLE, batch_size=4)
+    assert db.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 8
+    assert db.execute(
+        "SELECT chunks_committed, rows_committed, completed FROM ingest_progress"
+    ).fetchone() == (2, 8, 0)
+
+    monkeypatch.setattr(cms, "write_batch", write_batch)
+    stats = ingest_basic_drugs(db, SAMPLE, batch_size=4)
+
+    assert stats.resumed_lines > 0
+    assert (stats.rows, stats.batches) == (10, 3)
+    assert db.execute(
+        "SELECT chunks_committed, rows_committed, rows_skipped, completed FROM ingest_progress"
+    ).fetchone() == (5, 18, 4, 1)
+
+    clean = sqlite3.connect(tmp_path / "clean.db")
+    try:
+        ingest_basic_drugs(clean, SAMPLE, batch_size=4)
+        assert coverage_by_ndc(db) == coverage_by_ndc(clean)
+    finally:
+        clean.close()
+
+
+def test_completed_file_is_not_reingested(db, tmp_path):
+    """Test checkpoints skip a loaded file until it changes or a restart is asked for"""
+    path = tmp_path / "basic_drugs.txt"
+    path.write_bytes(SAMPLE.read_bytes())
+    ingest_basic_drugs(db, path)
+
+    assert ingest_basic_drugs(db, path).rows == 0
+    assert ingest_basic_drugs(db, path, resume=False).rows == 18
+
+    path.write_bytes(SAMPLE.read_bytes() + b"\n")
+    stats = ingest_basic_drugs(db, path, batch_size=4)
+    assert (stats.rows, stats.resumed_lines) == (18, 0)
+
+
+def test_missing_columns_rejected():
+    """Test files without the basic drugs columns fail fast"""
+    with pytest.raises(ValueError, match="NDC"):
+        list(parse_rows(["FORMULARY_ID|CONTRACT_YEAR|RXCUI", "1|2024|42"]))
+
+
+def test_batched_is_lazy():
+    """Test batching pulls only one batch from the pipeline at a time"""
+    pulled = []
+
+    def rows():
+        for i in range(10):
+            pulled.append(i)
+            yield i
+
+    batches = batched(rows(), 4)
+    assert next(batches) == [0, 1, 2, 3]
+    assert len(pulled) == 4
+    assert list(batches) == [[4, 5, 6, 7], [8, 9]]
+
+
+def coverage_by_ndc(conn):
+    return sorted(
+        conn.execute("""
+            SELECT f.data_source, d.ndc, fc.formulary_tier, fc.prior_authorization,
+                   fc.quantity_limit, fc.step_therapy
+            FROM formulary_coverage fc
+            JOIN formularies f ON f.id = fc.formulary_id
+            JOIN drugs d ON d.id = fc.drug_id
+        """).fetchall()
+    )
+
+
+def test_parallel_ingest_matches_serial(db, tmp_path):
+    """Test per-file staging databases merge to the same rows as a serial load"""
+    ingest_basic_drugs(db, SAMPLE)
+
+    header, *lines = SAMPLE.read_text().splitlines()
+    paths = []
+    for formulary_id in ("00024201", "00024312"):
+        path = tmp_path / f"basic_drugs_{formulary_id}.txt"
+        path.write_text("\n".join([header] + [line for line in lines if formulary_id in line]))
+        paths.append(path)
+
+    parallel = sqlite3.connect(tmp_path / "parallel.db")
+    try:
+        stats = ingest_files(parallel, paths, workers=2, batch_size=3)
+
+        assert (stats.rows, stats.skipped) == (18, 3)
+        assert coverage_by_ndc(parallel) == coverage_by_ndc(db)
+        # Drugs shared by both files map to one catalog row
+        assert parallel.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 10
+        assert parallel.execute("PRAGMA database_list").fetchall()[-1][1] == "main"
+    finally:
+        parallel.close()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith("tmp")) == []
+
+
+def test_parallel_ingest_skips_merged_files(db, tmp_path):
+    """Test a rerun of a multi-file load only parses files not merged yet"""
+    header, *lines = SAMPLE.read_text().splitlines()
+    paths = []
+    for formulary_id in ("00024201", "00024312"):
+        path = tmp_path / f"basic_drugs_{formulary_id}.txt"
+        path.write_text("\n".join([header] + [line for line in lines if formulary_id in line]))
+        paths.append(path)
+
+    first = ingest_files(db, paths[:1], workers=1)
+    stats = ingest_files(db, paths, workers=1)
+
+    assert stats.rows == 18 - first.rows
+    assert db.execute("SELECT COUNT(*) FROM ingest_progress WHERE completed").fetchone()[0] == 2
+
+
+def test_parallel_ingest_reparses_changed_files(db, tmp_path):
+    """Test a merged file that changed since is parsed again on a rerun"""
+    header, *lines = SAMPLE.read_text().splitlines()
+    path = tmp_path / "basic_drugs.txt"
+    path.write_text("\n".join([header] + lines[:4]))
+    ingest_files(db, [path], workers=1)
+
+    path.write_text("\n".join([header] + lines))
+    stats = ingest_files(db, [path], workers=1)
+
+    assert stats.rows == 18
+    assert ingest_files(db, [path], workers=1).rows == 0
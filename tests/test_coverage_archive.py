@@ -0,0 +1,129 @@
+import os
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.api.app import app
+from fastform.api.routes import formularies
+from fastform.archive import archive_coverage_history, read_coverage_history
+from fastform.ingest.upsert import upsert_coverage, upsert_drug, upsert_formulary
+from fastform.schema import create_formulary_tables
+
+DRUGS = [
+    {"ndc": "00071015523", "name": "Lipitor"},
+    {"ndc": "00006074031", "name": "Zocor"},
+]
+
+
+def coverage(drug_id, tier):
+    return {"formulary_id": 1, "drug_id": drug_id, "is_covered": 1, "formulary_tier": tier}
+
+
+@pytest.fixture
+def history_db(tmp_path):
+    """Two drugs on one plan whose tiers changed once in 2024 and twice in 2025"""
+    db_path = str(tmp_path / "fastform.db")
+    conn = sqlite3.connect(db_path)
+    create_formulary_tables(conn)
+    upsert_formulary(conn, {"plan_name": "Gold", "insurer": "Acme"})
+    drug_ids = [upsert_drug(conn, drug) for drug in DRUGS]
+
+    upsert_coverage(conn, [coverage(drug_id, 1) for drug_id in drug_ids])
+    superseded = ("2024-02-10 08:00:00", "2025-05-20 08:00:00", "2025-06-01 08:00:00")
+    for tier, superseded_at in enumerate(superseded, start=2):
+        upsert_coverage(conn, [coverage(drug_id, tier) for drug_id in drug_ids])
+        conn.execute(
+            "UPDATE coverage_history SET valid_to = ? WHERE valid_to NOT IN (?, ?, ?)",
+            (superseded_at, *superseded),
+        )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def history(conn, archive_path, **filters):
+    return [
+        (entry["drug_id"], entry["formulary_tier"], entry["valid_to"])
+        for entry in read_coverage_history(conn, archive_path, 1, **filters)
+    ]
+
+
+def test_changes_are_recorded_as_history(tmp_path):
+    """Test only real changes and deletes leave the previous values behind"""
+    conn = sqlite3.connect(":memory:")
+    create_formulary_tables(conn)
+    upsert_formulary(conn, {"plan_name": "Gold", "insurer": "Acme"})
+    drug_id = upsert_drug(conn, DRUGS[0])
+
+    upsert_coverage(conn, [coverage(drug_id, 1)])
+    upsert_coverage(conn, [coverage(drug_id, 1)])
+    conn.execute("UPDATE formulary_coverage SET last_verified = CURRENT_TIMESTAMP")
+    assert conn.execute("SELECT COUNT(*) FROM coverage_history").fetchone()[0] == 0
+
+    upsert_coverage(conn, [coverage(drug_id, 2)])
+    conn.execute("DELETE FROM formulary_coverage")
+    assert conn.execute(
+        "SELECT drug_id, formulary_tier, valid_from IS NOT NULL FROM coverage_history ORDER BY id"
+    ).fetchall() == [(drug_id, 1, 1), (drug_id, 2, 1)]
+    conn.close()
+
+
+def test_archive_moves_old_history(history_db, tmp_path):
+    """Test whole months older than the window move to compressed per-period blobs"""
+    archive_path = str(tmp_path / "fastform.db.archive")
+    conn = sqlite3.connect(history_db)
+    before = history(conn, archive_path)
+
+    moved = archive_coverage_history(conn, archive_path, months=12, now="2025-06-15")
+
+    assert moved == 2
+    assert conn.execute("SELECT COUNT(*) FROM coverage_history").fetchone()[0] == 4
+    assert conn.execute("PRAGMA database_list").fetchall()[-1][1] == "main"
+    archive = sqlite3.connect(archive_path)
+    assert archive.execute(
+        "SELECT formulary_id, period, row_count FROM coverage_archive"
+    ).fetchall() == [(1, "2024-02", 2)]
+    archive.close()
+
+    # Reads see the same history whichever tier it lives in
+    assert history(conn, archive_path) == before
+    assert history(conn, archive_path, drug_id=1) == [row for row in before if row[0] == 1]
+    assert history(conn, archive_path, since="2025-06-01") == before[:2]
+    conn.close()
+
+
+def test_interrupted_archive_does_not_duplicate(history_db, tmp_path):
+    """Test rows left in both tiers by a crash are merged on the next run"""
+    archive_path = str(tmp_path / "fastform.db.archive")
+    conn = sqlite3.connect(history_db)
+    leftover = conn.execute(
+        "SELECT * FROM coverage_history WHERE valid_to < '2025-01-01'"
+    ).fetchall()
+    archive_coverage_history(conn, archive_path, months=12, now="2025-06-15")
+    conn.executemany(f"INSERT INTO coverage_history VALUES ({', '.join('?' * 10)})", leftover)
+    conn.commit()
+
+    assert archive_coverage_history(conn, archive_path, months=12, now="2025-06-15") == 2
+    assert len(history(conn, archive_path)) == 6
+    conn.close()
+
+
+def test_history_endpoint(history_db, tmp_path, monkeypatch):
+    conn = sqlite3.connect(history_db)
+    archive_coverage_history(conn, f"{history_db}.archive", months=1, now="2025-06-15")
+    conn.close()
+    assert os.path.exists(f"{history_db}.archive")
+    monkeypatch.setattr(formularies.settings, "db_path", history_db)
+    client = TestClient(app)
+
+    entries = client.get("/v1/formularies/1/coverage/history?drug_id=2").json()
+
+    assert [(entry["formulary_tier"], entry["valid_to"]) for entry in entries] == [
+        (3, "2025-06-01 08:00:00"),
+        (2, "2025-05-20 08:00:00"),
+        (1, "2024-02-10 08:00:00"),
+    ]
+    assert entries[-1]["is_covered"] is True
+    assert len(client.get("/v1/formularies/1/coverage/history?limit=2").json()) == 2
+    assert client.get("/v1/formularies/9999/coverage/history").status_code == 404
@@ -0,0 +1,324 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.api.app import app
+from fastform.api.routes import formularies
+from fastform.ingest.upsert import upsert_drug, upsert_formulary
+from fastform.schema import create_formulary_tables
+from fastform.updates import manager as manager_module
+from fastform.updates.manager import FormularyUpdateManager, UpdateStatus
+from fastform.updates.ratelimit import TokenBucket
+
+LIPITOR = {"ndc": "00071015523", "name": "Lipitor", "generic_name": "atorvastatin"}
+ZOCOR = {"ndc": "00006074031", "name": "Zocor", "generic_name": "simvastatin"}
+PLAVIX = {"ndc": "63653117101", "name": "Plavix", "generic_name": "clopidogrel"}
+
+
+def covered(drug, tier, **restrictions):
+    return {**drug, "formulary_tier": tier, **restrictions}
+
+
+@pytest.fixture
+def plans_db(tmp_path, insurer_stub):
+    """Database with ten plans from five insurers, all served by the insurer stub"""
+    db_path = str(tmp_path / "updates.db")
+    conn = sqlite3.connect(db_path)
+    create_formulary_tables(conn)
+    for index in range(10):
+        path = f"plan-{index}"
+        upsert_formulary(
+            conn,
+            {
+                "plan_name": f"Plan {index}",
+                "insurer": f"Insurer {index % 5}",
+                "api_endpoint": insurer_stub.url(path),
+            },
+        )
+        insurer_stub.formularies[path] = [covered(LIPITOR, 2), covered(ZOCOR, 1)]
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+async def run_updates(db_path, force=True, **limits):
+    manager = FormularyUpdateManager(db_path, **limits)
+    updates = await manager.check_for_updates(force)
+    await manager.process_updates(updates)
+    return {update.plan_name: update for update in updates}
+
+
+@pytest.mark.asyncio
+async def test_updates_run_concurrently(plans_db, insurer_stub):
+    insurer_stub.delay = 0.3
+
+    start = time.monotonic()
+    updates = await run_updates(plans_db, max_concurrency=10, insurer_burst=2)
+    elapsed = time.monotonic() - start
+
+    # Ten 300ms fetches one after another would take 3s
+    assert elapsed < 1.5
+    assert all(update.status == UpdateStatus.COMPLETED for update in updates.values())
+    assert updates["Plan 0"].drugs_added == 2
+
+    conn = sqlite3.connect(plans_db)
+    assert conn.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 20
+    assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 2
+    statuses = conn.execute("SELECT status, COUNT(*) FROM formulary_updates GROUP BY 1").fetchall()
+    assert statuses == [("completed", 10)]
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_global_concurrency_limit(plans_db, insurer_stub):
+    insurer_stub.delay = 0.05
+
+    await run_updates(plans_db, max_concurrency=3, insurer_burst=2)
+
+    assert len(insurer_stub.requests) == 10
+    assert insurer_stub.max_in_flight <= 3
+
+
+@pytest.mark.asyncio
+async def test_per_insurer_rate_limit(plans_db, insurer_stub):
+    conn = sqlite3.connect(plans_db)
+    conn.execute("UPDATE formularies SET insurer = 'Insurer 0'")
+    conn.commit()
+    conn.close()
+
+    await run_updates(plans_db, max_concurrency=10, insurer_rate_per_s=20.0, insurer_burst=2)
+
+    # Two requests go out at once, the other eight wait 50ms apiece for tokens
+    times = sorted(at for at, _ in insurer_stub.requests)
+    assert times[-1] - times[0] >= 0.35
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_is_recorded(plans_db, insurer_stub):
+    insurer_stub.failing.add("plan-3")
+    conn = sqlite3.connect(plans_db)
+    conn.execute("UPDATE formularies SET last_updated = 'before'")
+    conn.commit()
+    conn.close()
+
+    updates = await run_updates(plans_db)
+
+    assert updates["Plan 3"].status == UpdateStatus.FAILED
+    assert "503" in updates["Plan 3"].error_message
+    assert updates["Plan 4"].status == UpdateStatus.COMPLETED
+
+    conn = sqlite3.connect(plans_db)
+    failed = conn.execute(
+        "SELECT f.plan_name, u.error_message FROM formulary_updates u "
+        "JOIN formularies f ON f.id = u.formulary_id WHERE u.status = 'failed'"
+    ).fetchall()
+    assert [plan for plan, _ in failed] == ["Plan 3"]
+    last_updated = dict(conn.execute("SELECT plan_name, last_updated FROM formularies"))
+    assert last_updated["Plan 3"] == "before"
+    assert last_updated["Plan 4"] != "before"
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_unrecordable_update_does_not_stall_run(plans_db, monkeypatch):
+    def broken(conn, update):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(manager_module, "record_update", broken)
+
+    updates = await asyncio.wait_for(run_updates(plans_db, max_concurrency=1), timeout=10)
+
+    assert {update.status for update in updates.values()} == {UpdateStatus.FAILED}
+    assert updates["Plan 0"].error_message == "disk I/O error"
+
+
+@pytest.mark.asyncio
+async def test_writer_failure_cancels_fetches(plans_db, monkeypatch):
+    async def crash(self, queue, begin_write):
+        raise RuntimeError("writer crashed")
+
+    monkeypatch.setattr(FormularyUpdateManager, "_write_updates", crash)
+
+    with pytest.raises(RuntimeError, match="writer crashed"):
+        await asyncio.wait_for(run_updates(plans_db, max_concurrency=1), timeout=10)
+
+
+@pytest.mark.asyncio
+async def test_changes_are_classified(plans_db, insurer_stub):
+    await run_updates(plans_db)
+    insurer_stub.formularies["plan-0"] = [
+        covered(LIPITOR, 3, prior_authorization=True),
+        covered(PLAVIX, 2),
+    ]
+
+    updates = await run_updates(plans_db)
+
+    plan = updates["Plan 0"]
+    assert (plan.drugs_added, plan.drugs_modified, plan.drugs_removed) == (1, 1, 1)
+    assert updates["Plan 1"].status == UpdateStatus.UNCHANGED
+
+    conn = sqlite3.connect(plans_db)
+    rows = conn.execute(
+        "SELECT d.name, c.is_covered, c.formulary_tier, c.prior_authorization "
+        "FROM formulary_coverage c JOIN drugs d ON d.id = c.drug_id "
+        "JOIN formularies f ON f.id = c.formulary_id WHERE f.plan_name = 'Plan 0' ORDER BY 1"
+    ).fetchall()
+    assert rows == [("Lipitor", 1, 3, 1), ("Plavix", 1, 2, 0), ("Zocor", 0, 1, 0)]
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_partial_payload_keeps_catalog_drug(plans_db, insurer_stub):
+    """Test a sync listing only NDC, name and tier leaves the shared catalog row intact"""
+    catalog_row = """
+        SELECT name, generic_name, brand_name, strength_qty, strength_unit, route, product_key
+        FROM drugs WHERE ndc = '00071015523'
+    """
+    conn = sqlite3.connect(plans_db)
+    upsert_drug(
+        conn,
+        {
+            "ndc": "00071015523",
+            "name": "Atorvastatin",
+            "generic_name": "atorvastatin calcium",
+            "brand_name": "Lipitor",
+            "strength_qty": 10,
+            "strength_unit": "mg",
+            "dosage_form": "tablet",
+            "route": "oral",
+        },
+    )
+    conn.commit()
+    before = conn.execute(catalog_row).fetchone()
+    insurer_stub.formularies["plan-0"] = [
+        {"ndc": "00071015523", "name": "Lipitor", "formulary_tier": 3}
+    ]
+
+    updates = await run_updates(plans_db)
+
+    assert updates["Plan 0"].drugs_added == 1
+    assert conn.execute(catalog_row).fetchone() == before
+    assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 2
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_sync_reranks_alternatives(plans_db, insurer_stub):
+    """Test a sync refreshes the precomputed equivalence groups"""
+    generic = {"ndc": "00378395077", "name": "Atorvastatin", "generic_name": "atorvastatin"}
+    insurer_stub.formularies["plan-0"] = [covered(LIPITOR, 1), covered(generic, 2)]
+    await run_updates(plans_db)
+    insurer_stub.formularies["plan-0"] = [covered(LIPITOR, 3), covered(generic, 1)]
+    await run_updates(plans_db)
+
+    conn = sqlite3.connect(plans_db)
+    ranked = conn.execute("""
+        SELECT d.name FROM equivalence_best b
+        JOIN drugs d ON d.id = b.drug_id
+        JOIN formularies f ON f.id = b.formulary_id
+        WHERE f.plan_name = 'Plan 0' AND b.group_key LIKE 'generic:atorvastatin%'
+        ORDER BY b.rank
+    """).fetchall()
+    assert ranked == [("Atorvastatin",), ("Lipitor",)]
+    conn.close()
+
+
+def test_token_bucket_waits_for_refill():
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=1, clock=lambda: now[0])
+
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    now[0] = 0.5
+    assert bucket.try_acquire()
+
+
+@pytest.mark.asyncio
+async def test_only_due_plans_are_checked(plans_db, insurer_stub):
+    await run_updates(plans_db)
+    insurer_stub.requests.clear()
+
+    # Nothing is due right after a sync: no requests and no writes
+    conn = sqlite3.connect(plans_db)
+    changes_before = conn.execute("SELECT COUNT(*) FROM formulary_updates").fetchone()
+    assert await run_updates(plans_db, force=False) == {}
+    assert insurer_stub.requests == []
+
+    # A monthly plan last checked 40 days ago is due, a quarterly one is not
+    conn.execute("UPDATE formularies SET last_checked = datetime('now', '-40 days')")
+    conn.execute(
+        "UPDATE formularies SET update_frequency = 'quarterly' WHERE plan_name != 'Plan 2'"
+    )
+    conn.commit()
+    assert list(await run_updates(plans_db, force=False)) == ["Plan 2"]
+    # Only the plan that was due gets a (unchanged) history row
+    assert conn.execute("SELECT COUNT(*) FROM formulary_updates").fetchone()[0] == (
+        changes_before[0] + 1
+    )
+    conn.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("conditional", [True, False], ids=["etag", "hash"])
+async def test_unchanged_source_skips_apply(plans_db, insurer_stub, conditional):
+    insurer_stub.conditional = conditional
+    await run_updates(plans_db)
+    conn = sqlite3.connect(plans_db)
+    conn.execute("UPDATE formulary_coverage SET last_verified = 'before'")
+    conn.execute("UPDATE formularies SET last_checked = 'before'")
+    conn.commit()
+
+    updates = await run_updates(plans_db)
+
+    assert {update.status for update in updates.values()} == {UpdateStatus.UNCHANGED}
+    assert conn.execute(
+        "SELECT COUNT(*) FROM formulary_coverage WHERE last_verified != 'before'"
+    ).fetchone() == (0,)
+    assert conn.execute(
+        "SELECT COUNT(*) FROM formularies WHERE last_checked = 'before'"
+    ).fetchone() == (0,)
+    # Unchanged checks are recorded too, without a parse or apply
+    history = conn.execute(
+        "SELECT status, rows_parsed, apply_ms FROM formulary_updates WHERE id > 10"
+    ).fetchall()
+    assert history == [("unchanged", None, None)] * 10
+    sources = conn.execute(
+        "SELECT source_etag IS NOT NULL, source_hash FROM formularies"
+    ).fetchall()
+    assert {etag for etag, _ in sources} == {conditional}
+    assert all(source_hash for _, source_hash in sources)
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_runs_are_recorded_with_metrics(plans_db, insurer_stub, monkeypatch):
+    insurer_stub.failing.add("plan-1")
+    await run_updates(plans_db)
+    insurer_stub.failing.clear()
+    await run_updates(plans_db)
+
+    conn = sqlite3.connect(plans_db)
+    plan_ids = dict(conn.execute("SELECT plan_name, id FROM formularies"))
+    conn.close()
+    monkeypatch.setattr(formularies.settings, "db_path", plans_db)
+    client = TestClient(app)
+
+    history = client.get(f"/v1/formularies/{plan_ids['Plan 1']}/updates").json()
+
+    assert [run["status"] for run in history] == ["completed", "failed"]
+    completed, failed = history
+    assert completed["rows_parsed"] == 2
+    assert completed["drugs_added"] == 2
+    assert completed["bytes_fetched"] > 0
+    assert completed["fetch_ms"] > 0
+    assert completed["parse_ms"] >= 0
+    assert completed["apply_ms"] >= 0
+    assert completed["started_at"] and completed["completed_at"]
+    assert "503" in failed["error_message"]
+    assert failed["rows_parsed"] is None
+
+    assert len(client.get(f"/v1/formularies/{plan_ids['Plan 1']}/updates?limit=1").json()) == 1
+    assert client.get("/v1/formularies/9999/updates").status_code == 404
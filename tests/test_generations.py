@@ -0,0 +1,166 @@
+import os
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from ingest_formulary import create_database_schema
+
+from fastform.api.app import app
+from fastform.db import (
+    ConnectionPool,
+    WriterLock,
+    collect_generations,
+    data_generation,
+    list_generations,
+    new_generation,
+)
+from fastform.settings import settings
+
+client = TestClient(app)
+
+
+def add_drug(db_path, name):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS drug_rules (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("INSERT INTO drug_rules (name) VALUES (?)", (name,))
+    conn.commit()
+    conn.close()
+
+
+def drug_names(conn):
+    return [row[0] for row in conn.execute("SELECT name FROM drug_rules ORDER BY id")]
+
+
+@pytest.fixture
+def plain_db(tmp_path):
+    """Database that has never been rebuilt: a plain file, not a generation link"""
+    db_path = str(tmp_path / "fastform.db")
+    add_drug(db_path, "Aspirin")
+    return db_path
+
+
+def test_rebuild_is_isolated_from_readers(plain_db):
+    reader = sqlite3.connect(plain_db)
+
+    with new_generation(plain_db) as build_path:
+        add_drug(build_path, "Lipitor")
+        # Nothing is visible until the build is published
+        assert drug_names(sqlite3.connect(plain_db)) == ["Aspirin"]
+
+    assert os.path.islink(plain_db)
+    assert os.path.realpath(plain_db) == build_path
+    assert drug_names(reader) == ["Aspirin"]
+    assert drug_names(sqlite3.connect(plain_db)) == ["Aspirin", "Lipitor"]
+    reader.close()
+
+
+def test_same_size_commit_changes_generation(plain_db):
+    """Test an in-place commit is noticed even if size and mtime stay the same"""
+    st = os.stat(plain_db)
+    generation = data_generation(plain_db)
+
+    conn = sqlite3.connect(plain_db)
+    conn.execute("UPDATE drug_rules SET name = 'Aspirim'")
+    conn.commit()
+    conn.close()
+    os.utime(plain_db, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert os.path.getsize(plain_db) == st.st_size
+    assert data_generation(plain_db) != generation
+
+
+def test_failed_rebuild_is_discarded(plain_db):
+    generation = data_generation(plain_db)
+
+    with pytest.raises(RuntimeError), new_generation(plain_db) as build_path:
+        add_drug(build_path, "Lipitor")
+        raise RuntimeError("bad data")
+
+    assert not os.path.islink(plain_db)
+    assert list_generations(plain_db) == {}
+    assert data_generation(plain_db) == generation
+
+
+def test_writers_wait_for_generation_build(plain_db):
+    """Test the writer lock is held from copy to publish, then released"""
+    other = WriterLock(plain_db)
+    with new_generation(plain_db) as build_path:
+        assert not other.acquire(blocking=False)
+        add_drug(build_path, "Ibuprofen")
+
+    assert other.acquire(blocking=False)
+    other.release()
+
+
+def test_generations_are_numbered(plain_db):
+    for name in ("Lipitor", "Zocor"):
+        with new_generation(plain_db) as build_path:
+            add_drug(build_path, name)
+
+    assert sorted(list_generations(plain_db)) == [1, 2]
+    assert os.path.realpath(plain_db).endswith("fastform.2.db")
+
+
+def test_pool_reuses_connections_and_drains_old_generation(plain_db):
+    pool = ConnectionPool(plain_db, max_idle=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as again:
+        assert again is first
+
+    with pool.connection() as busy:
+        with new_generation(plain_db) as build_path:
+            add_drug(build_path, "Lipitor")
+        # A connection checked out before the swap keeps the old data
+        assert drug_names(busy) == ["Aspirin"]
+
+        with pool.connection() as fresh:
+            assert fresh is not first
+            assert drug_names(fresh) == ["Aspirin", "Lipitor"]
+
+    # Connections to the retired file are closed rather than pooled again
+    with pytest.raises(sqlite3.ProgrammingError):
+        busy.execute("SELECT 1")
+    with pool.connection() as reused:
+        assert reused is fresh
+    pool.close()
+
+
+def test_collect_generations_after_grace(plain_db):
+    for name in ("Lipitor", "Zocor", "Plavix"):
+        with new_generation(plain_db) as build_path:
+            add_drug(build_path, name)
+
+    assert collect_generations(plain_db, grace_s=3600) == []
+    held = list_generations(plain_db)[2]
+    removed = collect_generations(plain_db, grace_s=0, keep=frozenset({held}))
+
+    assert sorted(os.path.basename(path) for path in removed) == ["fastform.1.db"]
+    assert sorted(list_generations(plain_db)) == [2, 3]
+    assert drug_names(sqlite3.connect(plain_db)) == ["Aspirin", "Lipitor", "Zocor", "Plavix"]
+
+
+def test_api_picks_up_new_generation(plain_db):
+    original = settings.db_path
+    settings.db_path = plain_db
+    try:
+        conn = sqlite3.connect(plain_db)
+        conn.execute("DROP TABLE drug_rules")
+        conn.commit()
+        conn.close()
+
+        create_database_schema(plain_db)
+        search = {"query": "lipitor"}
+        assert client.post("/v1/drugs/search", json=search).json() == []
+
+        with new_generation(plain_db) as build_path:
+            conn = sqlite3.connect(build_path)
+            conn.execute("INSERT INTO drug_rules (name, formulary_tier) VALUES ('Lipitor', 2)")
+            conn.commit()
+            conn.close()
+
+        assert [drug["name"] for drug in client.post("/v1/drugs/search", json=search).json()] == [
+            "Lipitor"
+        ]
+    finally:
+        settings.db_path = original
@@ -0,0 +1,44 @@
+import json
+
+from fastform.ai.json_stream import JsonArrayStream
+
+MATCHES = [
+    {"medication_name": "Ibuprofen", "confidence": 0.95, "reason": "Brand [Advil]"},
+    {"medication_name": "Naproxen", "confidence": 0.6, "reason": 'Also an "NSAID", {sort of}'},
+]
+
+
+def feed_in_pieces(text, size):
+    parser = JsonArrayStream()
+    elements = []
+    for start in range(0, len(text), size):
+        elements.extend(parser.feed(text[start : start + size]))
+    return parser, elements
+
+
+def test_elements_emitted_as_they_complete():
+    """Test each element is returned as soon as its closing brace arrives"""
+    text = json.dumps(MATCHES)
+    parser = JsonArrayStream()
+    first_end = text.index("}") + 1
+
+    assert parser.feed(text[:first_end]) == [MATCHES[0]]
+    assert parser.feed(text[first_end:]) == [MATCHES[1]]
+    assert parser.complete
+
+
+def test_any_chunking_gives_same_elements():
+    """Test brackets, quotes and escapes inside strings survive arbitrary splits"""
+    text = "Here you go:\n```json\n" + json.dumps(MATCHES, indent=2) + "\n```"
+    for size in (1, 2, 3, 7, len(text)):
+        parser, elements = feed_in_pieces(text, size)
+        assert elements == MATCHES
+        assert parser.complete
+
+
+def test_truncated_stream_is_incomplete():
+    """Test a stream cut off mid-element yields only the finished elements"""
+    text = json.dumps(MATCHES)
+    parser, elements = feed_in_pieces(text[:-20], 5)
+    assert elements == [MATCHES[0]]
+    assert not parser.complete
@@ -0,0 +1,179 @@
+import sqlite3
+
+import migrate_to_multi_formulary as migration
+import pytest
+
+DRUG_RULES = [
+    (
+        "Lipitor",
+        "tablet",
+        20.0,
+        "mg",
+        "oral",
+        "atorvastatin",
+        "Lipitor",
+        "0071-0155-23",
+        3,
+        0,
+        1,
+        0,
+    ),
+    (
+        "Atorvastatin",
+        "tablet",
+        20.0,
+        "mg",
+        "oral",
+        "atorvastatin",
+        None,
+        "60505-2579-9",
+        1,
+        0,
+        0,
+        0,
+    ),
+    ("Humira", "injection", 40.0, "mg", "subcutaneous", "adalimumab", "Humira", None, 5, 1, 1, 1),
+    (
+        "Metformin",
+        "tablet",
+        500.0,
+        "mg",
+        "oral",
+        "metformin",
+        "Glucophage",
+        "00093-1048-01",
+        1,
+        0,
+        0,
+        0,
+    ),
+]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """Single-formulary drug_rules database as written by ingest_formulary.py"""
+    db_path = str(tmp_path / "fastform.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE drug_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            dosage_form TEXT,
+            strength_qty REAL,
+            strength_unit TEXT,
+            route TEXT,
+            generic_name TEXT,
+            brand_name TEXT,
+            ndc TEXT,
+            formulary_tier INTEGER,
+            prior_authorization BOOLEAN DEFAULT 0,
+            quantity_limit BOOLEAN DEFAULT 0,
+            step_therapy BOOLEAN DEFAULT 0
+        )
+    """)
+    conn.executemany(
+        """
+        INSERT INTO drug_rules (
+            name, dosage_form, strength_qty, strength_unit, route, generic_name,
+            brand_name, ndc, formulary_tier, prior_authorization, quantity_limit, step_therapy
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        DRUG_RULES,
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def migrate(db_path):
+    migration.create_multi_formulary_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    formulary_ids = migration.create_sample_formularies(conn)
+    migration.migrate_existing_drugs(conn, formulary_ids)
+    return conn
+
+
+def coverage(conn):
+    return conn.execute("""
+        SELECT formulary_id, drug_id, is_covered, formulary_tier,
+               prior_authorization, quantity_limit, step_therapy
+        FROM formulary_coverage ORDER BY formulary_id, drug_id
+    """).fetchall()
+
+
+def test_migration_is_reproducible(legacy_db, tmp_path):
+    """Test the migration copies every drug and yields the same coverage every run"""
+    fresh_db = str(tmp_path / "fresh.db")
+    source = sqlite3.connect(legacy_db)
+    source.backup(sqlite3.connect(fresh_db))
+    source.close()
+
+    conn = migrate(legacy_db)
+    first = coverage(conn)
+
+    assert conn.execute("SELECT ndc FROM drugs ORDER BY id").fetchall() == [
+        ("00071015523",),
+        ("60505257909",),
+        ("00093104801",),
+        (None,),
+    ]
+    # Baseline plus one row per insurer profile for each drug
+    assert len(first) == len(DRUG_RULES) * (1 + len(migration.INSURER_PROFILES))
+    # Restrictions are only ever added to the Medicare baseline
+    baseline = {row[1]: row for row in first if row[0] == 1}
+    for row in first:
+        assert row[4] >= baseline[row[1]][4]
+        assert 1 <= row[3] <= 5
+
+    # Re-running keeps ids and rewrites no rows
+    conn.execute("UPDATE drugs SET updated_at = 'before'")
+    conn.execute("UPDATE formulary_coverage SET last_verified = 'before'")
+    conn.commit()
+    formulary_ids = migration.create_sample_formularies(conn)
+    migration.migrate_existing_drugs(conn, formulary_ids)
+    assert coverage(conn) == first
+    assert conn.execute("SELECT DISTINCT updated_at FROM drugs").fetchall() == [("before",)]
+    assert conn.execute("SELECT DISTINCT last_verified FROM formulary_coverage").fetchall() == [
+        ("before",)
+    ]
+    conn.close()
+
+    # The same source data migrates to the same coverage in another database
+    assert coverage(migrate(fresh_db)) == first
+
+
+def test_uniform_draws_are_keyed_per_row():
+    """Test draws depend only on (seed, key, id), not on which other ids are present"""
+    ids = [3, 7, 11]
+    draws = migration.uniform_draws(42, 5, ids, streams=4)
+
+    assert [len(row) for row in draws] == [4, 4, 4]
+    assert all(0 <= draw < 1 for row in draws for draw in row)
+    assert migration.uniform_draws(42, 5, ids[1:], 4) == draws[1:]
+    assert migration.uniform_draws(43, 5, ids, 4) != draws
+    assert migration.uniform_draws(42, 6, ids, 4) != draws
+
+
+def test_migration_merges_spellings_of_one_product(legacy_db):
+    """Test drug_rules rows of the same product share one catalog drug"""
+    conn = sqlite3.connect(legacy_db)
+    conn.execute("""
+        INSERT INTO drug_rules (name, dosage_form, strength_qty, strength_unit, ndc, formulary_tier)
+        VALUES ('LIPITOR', 'TAB', 20, 'MG', '0071-0155-40', 3)
+    """)
+    conn.commit()
+    conn.close()
+
+    conn = migrate(legacy_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == len(DRUG_RULES)
+        assert conn.execute("SELECT alias_type, alias, drug_id FROM drug_aliases").fetchall() == [
+            ("name", "LIPITOR", 1),
+            ("ndc", "00071015540", 1),
+        ]
+        assert conn.execute(
+            "SELECT COUNT(*) FROM formulary_coverage WHERE formulary_id = 1"
+        ).fetchone()[0] == len(DRUG_RULES)
+    finally:
+        conn.close()
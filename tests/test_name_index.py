@@ -0,0 +1,65 @@
+from fastform.search.name_index import NameIndex, suggestion_strengths
+
+DRUGS = [
+    {
+        "id": 1,
+        "name": "Acetaminophen",
+        "generic_name": "acetaminophen",
+        "brand_name": "Tylenol",
+        "strength_qty": 325.0,
+    },
+    {
+        "id": 2,
+        "name": "Acetaminophen",
+        "generic_name": "acetaminophen",
+        "brand_name": "Tylenol",
+        "strength_qty": 500.0,
+    },
+    {
+        "id": 3,
+        "name": "Metformin",
+        "generic_name": "metformin",
+        "brand_name": "Glucophage",
+        "strength_qty": 500.0,
+    },
+    {
+        "id": 4,
+        "name": "Insulin Glargine",
+        "generic_name": "insulin glargine",
+        "brand_name": "Lantus",
+        "strength_qty": 100.0,
+    },
+]
+
+index = NameIndex(DRUGS)
+
+
+def resolved_ids(suggestion, confidence=1.0):
+    return [drug["id"] for drug, _ in index.resolve(suggestion, confidence)]
+
+
+def test_exact_name_returns_every_strength():
+    """Test an exact name resolves to all of its strength variants"""
+    assert resolved_ids("acetaminophen") == [1, 2]
+    assert resolved_ids("TYLENOL") == [1, 2]
+
+
+def test_mentioned_strength_ranks_first():
+    """Test the strength named in the suggestion outranks other variants"""
+    resolved = index.resolve("Acetaminophen 500 mg tablets", 0.9)
+    assert [drug["id"] for drug, _ in resolved] == [2, 1]
+    assert resolved[0][1] > resolved[1][1]
+    assert suggestion_strengths("Tylenol 500mg / 0.5 ml") == {500.0, 0.5}
+
+
+def test_token_tier_needs_every_name_word():
+    """Test multi-word names only match when all their words are suggested"""
+    assert resolved_ids("Lantus (insulin glargine) pen") == [4]
+    assert resolved_ids("glargine pen") == []
+
+
+def test_prefix_tier():
+    """Test partial names resolve in either direction"""
+    assert resolved_ids("metfor") == [3]
+    assert resolved_ids("metformina") == [3]
+    assert resolved_ids("zzz") == []
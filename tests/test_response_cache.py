@@ -0,0 +1,93 @@
+import gzip
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.api.app import app
+from fastform.api.response_cache import EncodedResponse, response_cache
+from fastform.api.routes import formularies
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def formulary_db():
+    """Create a temporary database with the formulary tables"""
+    with tempfile.NamedTemporaryFile(suffix=".db", delete=False) as f:
+        db_path = f.name
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE drugs (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    conn.execute("""
+        CREATE TABLE formularies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_name TEXT NOT NULL,
+            insurer TEXT NOT NULL,
+            update_frequency TEXT DEFAULT 'monthly',
+            last_updated DATETIME,
+            is_active BOOLEAN DEFAULT 1
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE formulary_coverage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            formulary_id INTEGER NOT NULL,
+            drug_id INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO drugs (id, name) VALUES (1, 'Ibuprofen')")
+    conn.execute("INSERT INTO formularies (plan_name, insurer) VALUES ('Gold', 'Humana Inc.')")
+    conn.execute("INSERT INTO formulary_coverage (formulary_id, drug_id) VALUES (1, 1)")
+    conn.commit()
+    conn.close()
+
+    original_db_path = formularies.settings.db_path
+    formularies.settings.db_path = db_path
+    response_cache.clear()
+
+    yield db_path
+
+    formularies.settings.db_path = original_db_path
+    Path(db_path).unlink()
+
+
+def test_formularies_served_gzip(formulary_db):
+    """Test cached list is served with the encoding the client asked for"""
+    response = client.get("/v1/formularies/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    data = response.json()
+    assert data[0]["plan_name"] == "Gold"
+    assert data[0]["coverage_count"] == 1
+
+
+def test_formularies_served_identity(formulary_db):
+    """Test clients without compression support get plain JSON"""
+    response = client.get("/v1/formularies/", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.json()[0]["insurer"] == "Humana Inc."
+
+
+def test_stats_refresh_on_new_generation(formulary_db):
+    """Test a data change invalidates the cached stats"""
+    assert client.get("/v1/formularies/stats").json()["total_drugs"] == 1
+
+    conn = sqlite3.connect(formulary_db)
+    conn.execute("INSERT INTO drugs (id, name) VALUES (2, 'Naproxen')")
+    conn.commit()
+    conn.close()
+
+    assert client.get("/v1/formularies/stats").json()["total_drugs"] == 2
+
+
+def test_encoded_response_variants():
+    """Test all variants decode to the same JSON body"""
+    entry = EncodedResponse.from_content([{"name": "Ibuprofen"}])
+    assert gzip.decompress(entry.gzip) == entry.identity
+    assert entry.select("gzip;q=0, identity") == (entry.identity, None)
+    assert entry.select("gzip, deflate")[1] == "gzip"
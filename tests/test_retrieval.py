@@ -0,0 +1,40 @@
+from fastform.search.retrieval import CandidateRetriever, phonetic_key
+
+DRUGS = [
+    {"name": "Acetaminophen", "generic_name": "acetaminophen", "brand_name": "Tylenol"},
+    {"name": "Acetaminophen", "generic_name": "acetaminophen", "brand_name": None},
+    {"name": "Ibuprofen", "generic_name": "ibuprofen", "brand_name": "Advil"},
+    {"name": "Insulin Glargine", "generic_name": "insulin glargine", "brand_name": "Lantus"},
+    {"name": "Metformin", "generic_name": "metformin", "brand_name": "Glucophage"},
+]
+
+retriever = CandidateRetriever(DRUGS)
+
+
+def names(query, k=5):
+    return [drug["name"] for drug, _ in retriever.top_k(query, k)]
+
+
+def test_brand_reaches_all_generic_rows():
+    """Test a brand query returns every row sharing the generic"""
+    assert names("tylenol") == ["Acetaminophen", "Acetaminophen"]
+
+
+def test_misspelling_and_phonetic():
+    """Test misspelled queries still retrieve the intended drug"""
+    assert names("ibuprofin")[0] == "Ibuprofen"
+    assert phonetic_key("tylanol") == phonetic_key("tylenol")
+
+
+def test_abbreviation_prefix_and_word():
+    """Test synonym, prefix and single-word matches"""
+    assert names("APAP")[0] == "Acetaminophen"
+    assert names("metfor") == ["Metformin"]
+    assert names("glargine") == ["Insulin Glargine"]
+
+
+def test_top_k_limits_candidates():
+    """Test only the requested number of candidates is returned"""
+    assert len(retriever.top_k("acetaminophen", 1)) == 1
+    # Nothing plausible: fall back to catalog order
+    assert len(retriever.top_k("zzzz", 3)) == 3
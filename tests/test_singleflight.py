@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from fastform.ai.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_call():
+    """Test callers with the same key await one underlying call"""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "result"
+
+    results = await asyncio.gather(*[flight.do("key", work) for _ in range(10)])
+
+    assert results == ["result"] * 10
+    assert calls == 1
+    assert not flight.in_flight("key")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_others():
+    """Test one cancelled caller leaves the shared call running for the rest"""
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    first = asyncio.ensure_future(flight.do("key", work))
+    second = asyncio.ensure_future(flight.do("key", work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "result"
+    assert first.cancelled()
+    assert not flight.in_flight("key")
+
+
+@pytest.mark.asyncio
+async def test_last_waiter_cancels_and_releases_key():
+    """Test the shared call is cancelled and the key freed when nobody waits"""
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def work():
+        started.set()
+        await asyncio.sleep(10)
+
+    waiter = asyncio.ensure_future(flight.do("key", work))
+    await started.wait()
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.sleep(0.01)
+
+    assert not flight.in_flight("key")
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_all_waiters():
+    """Test a failing call raises in every waiter and releases the key"""
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        *[flight.do("key", work) for _ in range(3)], return_exceptions=True
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not flight.in_flight("key")
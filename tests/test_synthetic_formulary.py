@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from generate_synthetic_formulary import generate  # noqa: E402
+
+TIMESTAMP_COLUMNS = {"created_at", "updated_at", "last_updated", "last_verified"}
+
+
+def dump(db_path):
+    """Every table's rows, minus the wall-clock timestamp columns"""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {}
+        for table in ("drug_rules", "drugs", "formularies", "formulary_coverage"):
+            columns = [
+                row[1]
+                for row in conn.execute(f"PRAGMA table_info({table})")
+                if row[1] not in TIMESTAMP_COLUMNS
+            ]
+            query = f"SELECT {', '.join(columns)} FROM {table} ORDER BY 1"
+            tables[table] = conn.execute(query).fetchall()
+        return tables
+    finally:
+        conn.close()
+
+
+def test_same_seed_reproduces_database(synthetic_db, tmp_path):
+    again = str(tmp_path / "again.db")
+    generate(again, drugs=300, formularies=8, seed=11)
+
+    assert dump(synthetic_db) == dump(again)
+
+
+def test_different_seed_changes_database(synthetic_db, tmp_path):
+    other = str(tmp_path / "other.db")
+    generate(other, drugs=300, formularies=8, seed=12)
+
+    assert dump(synthetic_db)["drug_rules"] != dump(other)["drug_rules"]
+
+
+def test_dataset_shape(synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    try:
+        assert conn.execute("SELECT COUNT(*), COUNT(DISTINCT ndc) FROM drugs").fetchone() == (
+            300,
+            300,
+        )
+        # Medicare baseline plus the 8 insurer plans, each covering every drug
+        assert conn.execute("SELECT COUNT(*) FROM formularies").fetchone()[0] == 9
+        assert conn.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0] == 300 * 9
+        assert (
+            conn.execute("SELECT COUNT(*) FROM drugs WHERE drug_class IS NULL").fetchone()[0] == 0
+        )
+
+        pa_by_tier = dict(
+            conn.execute(
+                "SELECT formulary_tier, AVG(prior_authorization) FROM drug_rules GROUP BY 1"
+            ).fetchall()
+        )
+        assert pa_by_tier[1] < 0.2
+        assert pa_by_tier[5] > 0.5
+    finally:
+        conn.close()
+
+
+def test_refuses_to_overwrite(synthetic_db):
+    with pytest.raises(FileExistsError):
+        generate(synthetic_db, drugs=10, formularies=1)
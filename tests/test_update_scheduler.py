@@ -0,0 +1,179 @@
+import asyncio
+import os
+import random
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from fastform.api.app import app
+from fastform.db import WriterLock, data_generation, list_generations
+from fastform.ingest.upsert import upsert_formulary
+from fastform.schema import create_formulary_tables
+from fastform.settings import settings
+from fastform.updates import scheduler
+from fastform.updates.scheduler import UpdateScheduler, update_in_side_file
+
+LIPITOR = {"ndc": "00071015523", "name": "Lipitor", "formulary_tier": 2}
+
+
+@pytest.fixture
+def live_db(tmp_path, insurer_stub):
+    """Database with one plan served by the insurer stub, never synced"""
+    db_path = str(tmp_path / "live.db")
+    conn = sqlite3.connect(db_path)
+    create_formulary_tables(conn)
+    upsert_formulary(
+        conn,
+        {"plan_name": "Gold", "insurer": "Aetna", "api_endpoint": insurer_stub.url("gold")},
+    )
+    conn.commit()
+    conn.close()
+    insurer_stub.formularies["gold"] = [LIPITOR]
+    return db_path
+
+
+def coverage_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM formulary_coverage").fetchone()[0]
+
+
+@pytest.mark.asyncio
+async def test_update_is_swapped_in(live_db):
+    reader = sqlite3.connect(live_db)
+    assert coverage_count(reader) == 0
+    generation = data_generation(live_db)
+
+    updates = await update_in_side_file(live_db)
+
+    assert [update.plan_name for update in updates] == ["Gold"]
+    assert data_generation(live_db) != generation
+    assert os.path.islink(live_db)
+    assert list(list_generations(live_db)) == [1]
+    # Open connections keep the old file; new ones see the new data
+    assert coverage_count(reader) == 0
+    reader.close()
+    conn = sqlite3.connect(live_db)
+    assert coverage_count(conn) == 1
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_nothing_due_leaves_live_file_alone(live_db, insurer_stub):
+    await update_in_side_file(live_db)
+    generation = data_generation(live_db)
+    insurer_stub.requests.clear()
+
+    assert await update_in_side_file(live_db) == []
+    assert insurer_stub.requests == []
+    assert data_generation(live_db) == generation
+
+
+@pytest.mark.asyncio
+async def test_unchanged_run_publishes_nothing(live_db, insurer_stub):
+    """Test a run where every source is unchanged keeps the live generation"""
+    await update_in_side_file(live_db)
+    generation = os.path.realpath(live_db)
+
+    updates = await update_in_side_file(live_db, force=True)
+
+    assert [update.status.value for update in updates] == ["unchanged"]
+    assert os.path.realpath(live_db) == generation
+    assert list(list_generations(live_db)) == [1]
+    conn = sqlite3.connect(live_db)
+    assert conn.execute("SELECT status FROM formulary_updates ORDER BY id").fetchall() == [
+        ("completed",),
+        ("unchanged",),
+    ]
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_unchanged_run_copies_nothing(live_db, insurer_stub, monkeypatch):
+    """Test a run where every source is unchanged never creates a side file"""
+    await update_in_side_file(live_db)
+    copies = []
+    monkeypatch.setattr(scheduler, "begin_generation", lambda *args: copies.append(args))
+
+    updates = await update_in_side_file(live_db, force=True)
+
+    assert [update.status.value for update in updates] == ["unchanged"]
+    assert copies == []
+    assert list(list_generations(live_db)) == [1]
+
+
+@pytest.mark.asyncio
+async def test_update_waits_for_other_writer(live_db, monkeypatch):
+    """Test a run does not copy the database while another writer holds it"""
+    monkeypatch.setattr(scheduler, "LOCK_POLL_S", 0.01)
+    lock = WriterLock(live_db)
+    lock.acquire()
+    run = asyncio.create_task(update_in_side_file(live_db))
+    await asyncio.sleep(0.1)
+    assert not run.done()
+    assert list_generations(live_db) == {}
+
+    lock.release()
+    assert [update.status.value for update in await run] == ["completed"]
+
+
+@pytest.mark.asyncio
+async def test_failed_run_discards_side_file(live_db, monkeypatch):
+    async def crash(db_path, force, begin_write):
+        assert os.path.exists(await begin_write())
+        raise RuntimeError("crashed mid-update")
+
+    monkeypatch.setattr(scheduler, "run_formulary_updates", crash)
+    generation = data_generation(live_db)
+
+    with pytest.raises(RuntimeError):
+        await update_in_side_file(live_db)
+
+    assert data_generation(live_db) == generation
+    assert list_generations(live_db) == {}
+
+
+@pytest.mark.asyncio
+async def test_next_delay_is_bounded_and_jittered(live_db):
+    updater = UpdateScheduler(
+        live_db, jitter_s=10, min_interval_s=5, max_interval_s=60, rng=random.Random(1)
+    )
+    # Never-synced plan: due now, but no sooner than min_interval_s
+    assert 5 <= await updater.next_delay() <= 15
+
+    await update_in_side_file(live_db)
+    # Monthly plan just synced: capped at max_interval_s
+    assert 60 <= await updater.next_delay() <= 70
+
+
+def test_scheduler_runs_in_app_lifespan(live_db, insurer_stub):
+    original = (
+        settings.db_path,
+        settings.update_scheduler_enabled,
+        settings.update_min_interval_s,
+        settings.update_jitter_s,
+    )
+    settings.db_path = live_db
+    settings.update_scheduler_enabled = True
+    settings.update_min_interval_s = 0
+    settings.update_jitter_s = 0
+    try:
+        with TestClient(app) as client:
+            updater = app.state.update_scheduler
+            deadline = time.monotonic() + 5
+            while updater.runs == 0 and time.monotonic() < deadline:
+                assert client.get("/v1/health").status_code == 200
+                time.sleep(0.05)
+            assert updater.runs >= 1
+    finally:
+        (
+            settings.db_path,
+            settings.update_scheduler_enabled,
+            settings.update_min_interval_s,
+            settings.update_jitter_s,
+        ) = original
+
+    assert [path for _, path in insurer_stub.requests] == ["gold"]
+    conn = sqlite3.connect(live_db)
+    assert coverage_count(conn) == 1
+    conn.close()
@@ -0,0 +1,168 @@
+import sqlite3
+
+import pytest
+
+from fastform.ingest.canonical import canonical_ndc, canonicalize_ndcs, product_key
+from fastform.ingest.upsert import upsert_coverage, upsert_drug, upsert_formulary
+from fastform.schema import create_formulary_tables
+
+LIPITOR = {
+    "name": "Lipitor",
+    "generic_name": "atorvastatin",
+    "brand_name": "Lipitor",
+    "ndc": "0071-0155-23",
+    "dosage_form": "tablet",
+    "strength_qty": 20.0,
+    "strength_unit": "mg",
+    "route": "oral",
+}
+
+
+@pytest.fixture
+def conn():
+    """In-memory database with the multi-formulary schema"""
+    conn = sqlite3.connect(":memory:")
+    create_formulary_tables(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize(
+    "ndc, expected",
+    [
+        ("0071-0155-23", "00071015523"),  # 4-4-2
+        ("50580-506-02", "50580050602"),  # 5-3-2
+        ("00093-1048-1", "00093104801"),  # 5-4-1
+        ("00169-4130-13", "00169413013"),  # 5-4-2
+        ("00169413013", "00169413013"),
+        (" 00169413013 ", "00169413013"),
+        ("0169413013", None),  # unhyphenated 10 digits is ambiguous
+        ("123-45-6", None),
+        ("ABCDE-1234-12", None),
+        (None, None),
+    ],
+)
+def test_canonical_ndc(ndc, expected):
+    assert canonical_ndc(ndc) == expected
+
+
+@pytest.mark.parametrize(
+    "drug",
+    [
+        ("LIPITOR", 20, "MG", "TAB"),
+        ("Lipitor ", "20.0", "milligrams", "Tablets"),
+        ("Lipitor", None, "20 mg", "tablet"),
+        ("Lipitor", 0.02, "g", "tablet"),
+        ("Lipitor", 20000, "mcg", "tab."),
+    ],
+)
+def test_product_key_ignores_spelling(drug):
+    assert product_key(*drug) == "lipitor|20mg|tablet"
+
+
+def test_product_key_separates_products():
+    assert product_key("Lipitor", 20, "mg", "tablet") != product_key("Lipitor", 40, "mg", "tablet")
+    assert product_key("Lipitor", 20, "mg", "tablet") != product_key("Lipitor", 20, "mg", "capsule")
+    assert product_key(None, 20, "mg", "tablet") is None
+
+
+def test_canonicalize_existing_rows(conn):
+    """Test existing NDCs are rewritten in place and unparseable ones kept"""
+    conn.execute("DROP INDEX idx_drugs_ndc")
+    conn.executemany(
+        "INSERT INTO drugs (name, ndc) VALUES (?, ?)",
+        [("A", "50580-506-02"), ("B", "00169413013"), ("C", "legacy")],
+    )
+    assert canonicalize_ndcs(conn, "drugs") == 1
+    assert [row[0] for row in conn.execute("SELECT ndc FROM drugs ORDER BY id")] == [
+        "50580050602",
+        "00169413013",
+        "legacy",
+    ]
+
+
+def test_repeated_upsert_touches_nothing(conn):
+    """Test an identical refresh keeps ids and writes no rows"""
+    drug_id = upsert_drug(conn, LIPITOR)
+    formulary_id = upsert_formulary(conn, {"plan_name": "Gold", "insurer": "Acme"})
+    coverage = {
+        "formulary_id": formulary_id,
+        "drug_id": drug_id,
+        "is_covered": True,
+        "formulary_tier": 3,
+        "prior_authorization": False,
+        "quantity_limit": True,
+        "step_therapy": False,
+    }
+    upsert_coverage(conn, [coverage])
+
+    changes = conn.total_changes
+    assert upsert_drug(conn, dict(LIPITOR, ndc="00071015523")) == drug_id
+    assert upsert_formulary(conn, {"plan_name": "Gold", "insurer": "Acme"}) == formulary_id
+    upsert_coverage(conn, [coverage])
+    assert conn.total_changes == changes
+
+    upsert_coverage(conn, [dict(coverage, formulary_tier=2)])
+    # The row itself and the history entry for its previous values
+    assert conn.total_changes == changes + 2
+    assert conn.execute("SELECT id, formulary_tier FROM formulary_coverage").fetchall() == [(1, 2)]
+    assert conn.execute("SELECT drug_id, formulary_tier FROM coverage_history").fetchall() == [
+        (drug_id, 3)
+    ]
+
+
+def test_changed_drug_updates_in_place(conn):
+    """Test a changed attribute updates the row under the same id"""
+    drug_id = upsert_drug(conn, LIPITOR)
+    assert upsert_drug(conn, dict(LIPITOR, brand_name="Lipitor 20")) == drug_id
+    assert conn.execute("SELECT COUNT(*), MAX(brand_name) FROM drugs").fetchone() == (
+        1,
+        "Lipitor 20",
+    )
+
+
+def test_same_product_merged_into_one_drug(conn):
+    """Test other NDCs and spellings of a catalog product become its aliases"""
+    drug_id = upsert_drug(conn, LIPITOR)
+    variant = dict(
+        LIPITOR, name="LIPITOR", ndc="00071-0155-40", strength_qty=None, strength_unit="20 MG"
+    )
+    assert upsert_drug(conn, variant) == drug_id
+    assert upsert_drug(conn, dict(variant, ndc=None, dosage_form="TAB")) == drug_id
+    assert upsert_drug(conn, dict(LIPITOR, ndc="00071015640", strength_qty=40.0)) != drug_id
+
+    assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 2
+    assert conn.execute(
+        "SELECT alias_type, alias FROM drug_aliases WHERE drug_id = ? ORDER BY alias_type",
+        (drug_id,),
+    ).fetchall() == [("name", "LIPITOR"), ("ndc", "00071015540")]
+    # Known aliases resolve without adding rows
+    changes = conn.total_changes
+    assert upsert_drug(conn, variant) == drug_id
+    assert conn.total_changes == changes
+
+
+def test_product_keys_backfilled_on_upgrade():
+    """Test drugs from before product keys get one when the schema is upgraded"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""
+        CREATE TABLE drugs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, generic_name TEXT,
+            brand_name TEXT, ndc TEXT, dosage_form TEXT, strength_qty REAL,
+            strength_unit TEXT, route TEXT, drug_class TEXT, manufacturer TEXT,
+            created_at DATETIME, updated_at DATETIME
+        )
+    """)
+    conn.execute(
+        "INSERT INTO drugs (name, strength_qty, strength_unit) VALUES ('Lipitor', 20, 'mg')"
+    )
+    create_formulary_tables(conn)
+    assert conn.execute("SELECT product_key FROM drugs").fetchone() == ("lipitor|20mg|",)
+    conn.close()
+
+
+def test_drug_without_ndc_matched_by_name(conn):
+    """Test drugs lacking a usable NDC are not duplicated on refresh"""
+    drug = dict(LIPITOR, ndc=None)
+    assert upsert_drug(conn, drug) == upsert_drug(conn, drug)
+    assert conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0] == 1
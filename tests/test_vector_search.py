@@ -0,0 +1,144 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+from fastform.api.app import app  # noqa: E402
+from fastform.ingest.upsert import (  # noqa: E402
+    upsert_coverage,
+    upsert_drug,
+    upsert_formulary,
+)
+from fastform.schema import create_formulary_tables  # noqa: E402
+from fastform.search.vector import VectorIndex, load_or_build  # noqa: E402
+from fastform.settings import settings  # noqa: E402
+
+client = TestClient(app)
+
+DRUGS = [
+    {"name": "Acetaminophen", "generic_name": "acetaminophen", "brand_name": "Tylenol"},
+    {"name": "Ibuprofen", "generic_name": "ibuprofen", "brand_name": "Advil"},
+    {"name": "Metformin", "generic_name": "metformin", "brand_name": "Glucophage"},
+    {"name": "Metoprolol", "generic_name": "metoprolol tartrate", "brand_name": "Lopressor"},
+]
+
+
+@pytest.fixture
+def vector_db(tmp_path):
+    """Create a drug_rules database and keep its vector index in tmp_path"""
+    db_path = str(tmp_path / "vector.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE drug_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            dosage_form TEXT,
+            strength_qty REAL,
+            strength_unit TEXT,
+            route TEXT,
+            generic_name TEXT,
+            brand_name TEXT,
+            ndc TEXT,
+            formulary_tier INTEGER,
+            prior_authorization BOOLEAN DEFAULT 0,
+            quantity_limit BOOLEAN DEFAULT 0,
+            step_therapy BOOLEAN DEFAULT 0
+        )
+    """)
+    conn.executemany(
+        """
+        INSERT INTO drug_rules (name, generic_name, brand_name, ndc, strength_qty,
+                                strength_unit, formulary_tier)
+        VALUES (?, ?, ?, ?, 200.0, 'mg', 1)
+    """,
+        [
+            (d["name"], d["generic_name"], d["brand_name"], f"0000000000{i}")
+            for i, d in enumerate(DRUGS)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    original = (settings.db_path, settings.vector_index_path)
+    settings.db_path = db_path
+    settings.vector_index_path = str(tmp_path / "vector.db.vectors")
+
+    yield db_path
+
+    settings.db_path, settings.vector_index_path = original
+
+
+def test_similarity_ranks_misspellings():
+    """Test misspelled and partial queries rank the intended drug first"""
+    index = VectorIndex.build(DRUGS, "gen-1")
+    assert index.search("ibuprofin", 2)[0][0] == 1
+    assert index.search("lopresor", 2)[0][0] == 3
+    batch = index.search_many(["tylenol", "metformn"], 1)
+    assert [hits[0][0] for hits in batch] == [0, 2]
+
+
+def test_index_persisted_and_memory_mapped(tmp_path):
+    """Test a saved index is reloaded for the same generation and rebuilt otherwise"""
+    path = str(tmp_path / "drugs.vectors")
+    built = load_or_build(path, DRUGS, "gen-1")
+
+    loaded = VectorIndex.load(path)
+    assert loaded.generation == "gen-1"
+    assert type(loaded.idf).__name__ == "memmap"
+    assert not loaded.matrix.data.flags.owndata
+    assert loaded.search("advil", 1) == built.search("advil", 1)
+
+    assert load_or_build(path, DRUGS[:2], "gen-2").matrix.shape[0] == 2
+
+
+def test_search_vector_mode(vector_db):
+    """Test mode=vector on the search endpoint tolerates typos"""
+    response = client.post("/v1/drugs/search", json={"query": "metforman", "mode": "vector"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["name"] == "Metformin"
+    assert data[0]["strength"] == "200.0mg"
+
+
+def test_search_vector_mode_in_formulary(vector_db):
+    """Test mode=vector only returns drugs the requested formulary covers, on its terms"""
+    conn = sqlite3.connect(vector_db)
+    create_formulary_tables(conn)
+    formulary_id = upsert_formulary(conn, {"plan_name": "Gold", "insurer": "Acme"})
+    drug_ids = [
+        upsert_drug(conn, {"ndc": f"0000000000{i}", "name": d["name"]}) for i, d in enumerate(DRUGS)
+    ]
+    upsert_coverage(
+        conn,
+        [
+            {
+                "formulary_id": formulary_id,
+                "drug_id": drug_ids[3],
+                "is_covered": 1,
+                "formulary_tier": 4,
+                "prior_authorization": 1,
+            },
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    response = client.post(
+        "/v1/drugs/search",
+        json={"query": "meto", "mode": "vector", "formulary_id": formulary_id},
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [d["name"] for d in data] == ["Metoprolol"]
+    assert (data[0]["formulary_name"], data[0]["insurer"]) == ("Gold", "Acme")
+    assert (data[0]["formulary_tier"], data[0]["prior_authorization"]) == (4, True)
+    assert data[0]["drug_id"] == drug_ids[3]
+
+    response = client.post(
+        "/v1/drugs/search", json={"query": "meto", "mode": "vector", "formulary_id": 999}
+    )
+    assert response.status_code == 404